@@ -1,15 +1,65 @@
 import numpy as np
 import pandas as pd
 
+import isotopeRegistry as ir
+
 '''
-This code takes care of basic manipulations between delta, ratio, and concentration space. Currently, it works for H, C, N, O, and S. 
+This code takes care of basic manipulations between delta, ratio, and concentration space. It works for the elements of the isotope registry: H, C, N, O, and S, and any others added with ir.registerElement. 
 '''
                                                                                                                        
 
 #DEFINE STANDARDS
 #Doubly isotopic atoms are given as standard ratios. The standards are: VPDB for carbon, AIR for nitrogen, VSMOW for H/O, and CDT for sulfur. 
-STD_Rs = {"H": 0.00015576, "C": 0.011180, "N": 0.003676, "17O": 0.0003799, "18O": 0.0020052,
-         "33S":0.007877,"34S":0.0441626,"36S":0.000105274}
+#Kept in the isotope registry, e.g. {"H": 0.00015576, "C": 0.011180, ..., "17O": 0.0003799, "18O": 0.0020052, ...}
+STD_Rs = ir.STD_RS
+
+#Integer codes for the atom identities understood by this module, used by the array-aware functions (deltasToConcentrations, etc.). An identity
+#is an element, whose delta refers to its lightest rare isotope ("O" gives 17O), or the label of a rare isotope ("18O"). 
+#Compiled from the isotope registry by compileDeltaTables, e.g. {"H": 0, "D": 1, "C": 2, "13C": 3, ...}
+ATOM_CODES = {}
+
+#The cardinal masses of the rare isotopes in the 4-tuple of deltaToConcentration, which gives (unsubstituted, M+1, M+2, M+4)
+CONCENTRATION_MASSES = (1, 2, 4)
+
+#Arrays indexed by atom code, compiled by compileDeltaTables. 
+#CODE_STD_RS gives the standard ratio of each atom code, as used by ratioToDelta. 
+#CODE_SUB_SLOPES and CODE_SUB_STD_RS give, for each of CONCENTRATION_MASSES, the slope and standard ratio used by deltaToConcentration; a delta d 
+#gives the ratio (slope * d/1000 + 1) * standard for each isotope. Elements with isotopes of other cardinal masses have no 4-tuple, so are NaN. 
+CODE_STD_RS = None
+CODE_SUB_SLOPES = None
+CODE_SUB_STD_RS = None
+
+def compileDeltaTables():
+    '''
+    Compiles ATOM_CODES and the CODE_ lookup arrays from the isotope registry. Called again whenever an element is registered. 
+    '''
+    global CODE_STD_RS, CODE_SUB_SLOPES, CODE_SUB_STD_RS
+
+    ATOM_CODES.clear()
+    stdRs, subSlopes, subStdRs = [], [], []
+
+    for element, deltaLabel in ir.DELTA_ISOTOPES.items():
+        rareLabels = [label for label, rare in ir.RARE_ISOTOPES.items() if rare[0] == element]
+        representable = all(ir.RARE_ISOTOPES[label][1] in CONCENTRATION_MASSES for label in rareLabels)
+
+        for identity, referenceLabel in [(element, deltaLabel)] + [(label, label) for label in rareLabels]:
+            ATOM_CODES[identity] = len(stdRs)
+            referenceScaling = ir.RARE_ISOTOPES[referenceLabel][3]
+            stdRs.append(ir.RARE_ISOTOPES[referenceLabel][2])
+
+            slopes, ratios = [0] * len(CONCENTRATION_MASSES), [0] * len(CONCENTRATION_MASSES)
+            for label in rareLabels:
+                rareElement, cardinalMass, referenceRatio, scaling = ir.RARE_ISOTOPES[label]
+                if representable:
+                    slopes[CONCENTRATION_MASSES.index(cardinalMass)] = scaling / referenceScaling
+                    ratios[CONCENTRATION_MASSES.index(cardinalMass)] = referenceRatio
+
+            subSlopes.append(slopes if representable else [np.nan] * len(CONCENTRATION_MASSES))
+            subStdRs.append(ratios if representable else [np.nan] * len(CONCENTRATION_MASSES))
+
+    CODE_STD_RS, CODE_SUB_SLOPES, CODE_SUB_STD_RS = np.array(stdRs, dtype = float), np.array(subSlopes, dtype = float), np.array(subStdRs, dtype = float)
+
+ir.onCompile(compileDeltaTables)
     
 def deltaToConcentration(atomIdentity,delta):
     '''
@@ -24,109 +74,30 @@ def deltaToConcentration(atomIdentity,delta):
     '''
     if type(delta) == tuple:
         return twoDeltasToConcentration(atomIdentity, delta)
-    
-    if atomIdentity == 'C' or atomIdentity == '13C':
-        ratio = (delta/1000+1)*STD_Rs['C']
-        concentrationSub = ratio/(1+ratio)
-        
-        return (1-concentrationSub,concentrationSub,0,0)
-    
-    if atomIdentity == 'H' or atomIdentity == 'D':
-        ratio = (delta/1000+1)*STD_Rs['H']
-        concentrationSub = ratio/(1+ratio)
-        
-        return (1-concentrationSub,concentrationSub,0,0)
-    
-    if atomIdentity == 'N' or atomIdentity == '15N':
-        ratio = (delta/1000+1)*STD_Rs['N']
-        concentrationSub = ratio/(1+ratio)
-        
-        return (1-concentrationSub,concentrationSub,0,0)
-    
-    elif atomIdentity == '17O' or atomIdentity == 'O':
-        r17 = (delta/1000+1)*STD_Rs['17O']
-        delta18 = 1/0.52 * delta
-        r18 = (delta18/1000+1)*STD_Rs['18O']
-        
-        o17 = r17/(1+r17+r18)
-        o18 = r18/(1+r17+r18)
-        o16 = 1-(o17+o18)
-        
-        return (o16,o17,o18,0)
-    
-    elif atomIdentity == '33S' or atomIdentity == 'S':
-        r33 = (delta/1000+1)*STD_Rs['33S']
-        delta34 = delta/0.515
-        r34 = (delta34/1000+1)*STD_Rs['34S']
-        delta36 = delta34*1.9
-        r36 = (delta36/1000+1)*STD_Rs['36S']
-        
-        s33 = r33/(1+r33 + r34 + r36)
-        s34 = r34/(1+r33+r34+r36)
-        s36 = r36/(1+r33+r34+r36)
 
-        s32 = 1-(s33+s34+s36)
-        
-        return (s32,s33,s34,s36)
-        
-    elif atomIdentity == '34S':
-        r34 = (delta/1000+1)*STD_Rs['34S']
-        delta33 = delta * 0.515
-        r33 = (delta/1000+1)*STD_Rs['33S']
-        delta36 = delta*1.9
-        r36 = (delta36/1000+1)*STD_Rs['36S']
-        
-        s33 = r33/(1+r33 + r34 + r36)
-        s34 = r34/(1+r33+r34+r36)
-        s36 = r36/(1+r33+r34+r36)
-
-        s32 = 1-(s33+s34+s36)
-        
-        return (s32,s33,s34,s36)
-                
-    else:
-        raise Exception('Sorry, I do not know how to deal with ' + atomIdentity)
+    return tuple(concentration.item() if concentration.ndim == 0 else concentration for concentration in deltasToConcentrations(atomIdentity, delta))
 
 def twoDeltasToConcentration(atomIdentity, deltaTuple):
     '''
-    A special version of the deltaToConcentration function, for 17/18O or 33/34S, when both are constrained via experiment. In this case, we do not set the additional isotopes via a mass scaling law, and instead calculate explicitly.
+    A special version of the deltaToConcentration function, for 17/18O or 33/34S, when both are constrained via experiment. In this case, we do not set the second rare isotope via a mass scaling law, and instead calculate explicitly; any further isotopes (36S) are scaled from the second. 
     
     Inputs:
-        atomIdentity: "O" or "S", for oxygen or sulfur. 
+        atomIdentity: An element with at least two rare isotopes, e.g. "O" or "S", for oxygen or sulfur. 
         deltaTuple: A 2-tuple. The first entry is 17O or 33S, the second is 18O or 34S. 
         
     Outputs: 
         A 4-tuple giving the concentration vector for this delta value. The first entry gives the unsubstituted; successive entries give higher mass substitutions. E.g. for S the entries are (32S, 33S, 34S, 36S). 
     '''
-    if atomIdentity == 'O':
-        delta17 = deltaTuple[0]
-        delta18 = deltaTuple[1]
-        
-        r17 = (delta17/1000+1)*STD_Rs['17O']
-        r18 = (delta18/1000+1)*STD_Rs['18O']
-        
-        o17 = r17/(1+r17+r18)
-        o18 = r18/(1+r17+r18)
-        o16 = 1-(o17+o18)
-        
-        return (o16,o17,o18,0)
-    
-    elif atomIdentity == 'S':
-        delta33 = deltaTuple[0]
-        delta34 = deltaTuple[1]
-        
-        r33 = (delta33/1000+1)*STD_Rs['33S']
-        r34 = (delta34/1000+1)*STD_Rs['34S']
-        delta36 = delta34*1.9
-        r36 = (delta36/1000+1)*STD_Rs['36S']
-        
-        s33 = r33/(1+r33 + r34 + r36)
-        s34 = r34/(1+r33+r34+r36)
-        s36 = r36/(1+r33+r34+r36)
+    rareLabels = sorted((rare[1], label) for label, rare in ir.RARE_ISOTOPES.items() if rare[0] == atomIdentity)
+    if len(rareLabels) < 2:
+        raise Exception('Sorry, I can only take two deltas for elements with at least two rare isotopes, not ' + str(atomIdentity))
 
-        s32 = 1-(s33+s34+s36)
-        
-        return (s32,s33,s34,s36)
+    #Scale from the delta of the second rare isotope, then set the first explicitly
+    code = ATOM_CODES[rareLabels[1][1]]
+    deltas = CODE_SUB_SLOPES[code] * deltaTuple[1]
+    deltas[CONCENTRATION_MASSES.index(rareLabels[0][0])] = deltaTuple[0]
+
+    return tuple(concentration.item() for concentration in ratiosToConcentrations((deltas / 1000 + 1) * CODE_SUB_STD_RS[code]))
     
 def concentrationToM1Ratio(concentrationTuple):
     '''
@@ -151,33 +122,9 @@ def ratioToDelta(atomIdentity, ratio):
     outputs: 
         delta: The delta value for that isotope and ratio.
     '''
-    delta = 0
-    if atomIdentity == 'D':
-        atomIdentity = 'H'
-        
-    if atomIdentity in 'HCN' or atomIdentity in ['13C','15N']:
-        #in case atomIdentity is 2H, 13C, 15N, take last character only
-        delta = (ratio/STD_Rs[atomIdentity[-1]]-1)*1000
-        
-    elif atomIdentity == 'O' or atomIdentity == '17O':
-        delta = (ratio/STD_Rs['17O']-1)*1000
-        
-    elif atomIdentity == '18O':
-        delta = (ratio/STD_Rs['18O']-1)*1000
-        
-    elif atomIdentity == 'S' or atomIdentity == '33S':
-        delta = (ratio/STD_Rs['33S']-1)*1000
-        
-    elif atomIdentity == '34S':
-        delta = (ratio/STD_Rs['34S']-1)*1000
-        
-    elif atomIdentity == '36S':
-        delta = (ratio/STD_Rs['36S']-1)*1000
+    delta = ratiosToDeltas(atomIdentity, ratio)
         
-    else:
-        raise Exception('Sorry, I do not know how to deal with ' + atomIdentity)
-        
-    return delta
+    return delta.item() if delta.ndim == 0 else delta
 
 def compareRelDelta(atomID, deltaStd, deltaSmp):
     '''
@@ -196,4 +143,91 @@ def compareRelDelta(atomID, deltaStd, deltaSmp):
 
     relDelta = 1000*(rSmp/rStd-1)
     
-    return relDelta
\ No newline at end of file
+    return relDelta
+
+def atomCodes(atomIdentities):
+    '''
+    Converts atom identities to the integer codes used by the array-aware functions. 
+    
+    Inputs:
+        atomIdentities: A string, or an array (or list, or Series) of strings or ints giving the isotope of interest, e.g. molecularDataFrame['IDS']. Ints are taken to be codes already. 
+        
+    Outputs:
+        A numpy array of ints, of the same shape as the input. See ATOM_CODES. 
+    '''
+    atomIdentities = np.asarray(atomIdentities)
+    if atomIdentities.dtype.kind in 'iu':
+        return atomIdentities
+
+    codes = np.empty(atomIdentities.shape, dtype = np.int64)
+    for index, atomIdentity in np.ndenumerate(atomIdentities):
+        if atomIdentity not in ATOM_CODES:
+            raise Exception('Sorry, I do not know how to deal with ' + str(atomIdentity))
+        codes[index] = ATOM_CODES[atomIdentity]
+        
+    return codes
+
+def deltasToConcentrations(atomIdentities, deltas):
+    '''
+    The array-aware counterpart of deltaToConcentration. Converts any number of deltas at once; atomIdentities and deltas are broadcast against each other, so e.g. an array of site identities and a (draws x sites) array of deltas gives the concentrations of every site in every draw. 
+    
+    Inputs:
+        atomIdentities: Atom identities or codes; see atomCodes. 
+        deltas: The input delta values, a float or numpy array. 
+        
+    Outputs:
+        A numpy array of shape (4,) + the broadcast shape of the inputs. Entry 0 gives the concentration of the unsubstituted isotope, successive entries the M+1, M+2, and M+4 isotopes, as in the 4-tuple of deltaToConcentration. 
+    '''
+    codes, deltas = np.broadcast_arrays(atomCodes(atomIdentities), np.asarray(deltas, dtype = float))
+
+    #Keep the isotope axis last while broadcasting against the deltas, and move it to the front only at the end
+    slopes = CODE_SUB_SLOPES[codes]
+    if np.isnan(slopes).any():
+        raise Exception('Sorry, I can only convert deltas to concentrations for elements whose rare isotopes are M+1, M+2, or M+4')
+    
+    return ratiosToConcentrations((slopes * deltas[..., np.newaxis] / 1000 + 1) * CODE_SUB_STD_RS[codes])
+
+def ratiosToConcentrations(ratios):
+    '''
+    Converts the ratios of the M+1, M+2, and M+4 isotopes of atoms to concentration vectors. 
+    
+    Inputs:
+        ratios: A numpy array of shape (..., 3), giving the ratio of each rare isotope (see CONCENTRATION_MASSES) to the unsubstituted isotope; 0 for isotopes the element does not have. 
+        
+    Outputs:
+        A numpy array of shape (4, ...), as deltasToConcentrations. 
+    '''
+    subConcentrations = ratios / (1 + ratios.sum(axis = -1, keepdims = True))
+    concentrations = np.concatenate((1 - subConcentrations.sum(axis = -1, keepdims = True), subConcentrations), axis = -1)
+    
+    return np.moveaxis(concentrations, -1, 0)
+
+def ratiosToDeltas(atomIdentities, ratios):
+    '''
+    The array-aware counterpart of ratioToDelta; atomIdentities and ratios are broadcast against each other. 
+    
+    Inputs:
+        atomIdentities: Atom identities or codes; see atomCodes. 
+        ratios: The isotope ratios, a float or numpy array. 
+        
+    Outputs:
+        A numpy array of delta values, of the broadcast shape of the inputs. 
+    '''
+    return (np.asarray(ratios, dtype = float) / CODE_STD_RS[atomCodes(atomIdentities)] - 1) * 1000
+
+def compareRelDeltas(atomIdentities, deltaStd, deltaSmp):
+    '''
+    The array-aware counterpart of compareRelDelta; all inputs are broadcast against each other. 
+    
+    Inputs:
+        atomIdentities: Atom identities or codes; see atomCodes. 
+        deltaStd: The delta values of the "standard" (denominator)
+        deltaSmp: The delta values of the "sample" (numerator)
+        
+    Outputs:
+        A numpy array giving the delta values of the sample relative to the standard.
+    '''
+    rStd = concentrationToM1Ratio(deltasToConcentrations(atomIdentities, deltaStd))
+    rSmp = concentrationToM1Ratio(deltasToConcentrations(atomIdentities, deltaSmp))
+    
+    return 1000 * (rSmp / rStd - 1)
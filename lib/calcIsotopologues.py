@@ -1,12 +1,16 @@
 import itertools
 import copy
 import math
+import functools
+import heapq
+import collections.abc
 
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
 import basicDeltaOperations as op
+import isotopeRegistry as ir
 
 '''                                                 
 This code calculates a dictionary giving all possible isotopologues of a molecule and their concentrations, based on input information about the sites and their isotopic composition.                                                 
@@ -17,7 +21,7 @@ It assumes one has access to a dataframe specifying details about a molecule. Se
 '''
 
 #The possible substitutions, by cardinal mass, for each element. 
-setsOfElementIsotopes = {'H':(0,1),'N':(0,1),'C':(0,1),'O':(0,1,2),'S':(0,1,2,4)}
+setsOfElementIsotopes = ir.ISOTOPES_BY_ELEMENT
 
 def calculateSetsOfSiteIsotopes(molecularDataFrame):
     '''
@@ -48,26 +52,10 @@ def calculateSetsOfSiteIsotopes(molecularDataFrame):
             multinomialCoefficients.append([1] * len(setsOfElementIsotopes[el]))
 
         else:
-            siteIsotopes = tuple(itertools.combinations_with_replacement(setsOfElementIsotopes[el], n))
+            siteIsotopes, counts = multiatomicSiteIsotopes(el, int(n))
             setsOfSiteIsotopes.append(siteIsotopes)
 
-            #Determining the multinomial coefficients takes a bit of work. There must be a more elegant way to do so.
-            #First we generate all possible isotopic structures
-            siteIsotopicStructures = itertools.product(setsOfElementIsotopes[el],repeat = n)
-
-            #Then we sort each structure, i.e. so that [0,1] and [1,0] both become [0,1]
-            sort = [sorted(list(x)) for x in siteIsotopicStructures]
-
-            #Then we count how many times each structure occurs; i.e. [0,1] may appear twice
-            counts = []
-            for siteComposition in siteIsotopes:
-                c = 0
-                for isotopeStructure in sort:
-                    if list(siteComposition) == isotopeStructure:
-                        c += 1
-                counts.append(c)
-
-            #Finally, we expand the counts. Suppose we have a set of site Isotopes with [0,0], [0,1], [1,1] with 
+            #We expand the counts. Suppose we have a set of site Isotopes with [0,0], [0,1], [1,1] with 
             #multinomial Coefficients of [1,2,1], respectively. We want to output [[1,1],[2,2],[1,1]] rather than 
             #[1,2,1], because doing so will allow us to take advantage of the optimized itertools.product function
             #to calculate the symmetry number of isotopologues with many multiatomic sites.
@@ -80,13 +68,40 @@ def calculateSetsOfSiteIsotopes(molecularDataFrame):
             
     return setsOfSiteIsotopes, multinomialCoefficients
 
-def calcAllIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, M1Only = False):
+@functools.lru_cache(maxsize = None)
+def multiatomicSiteIsotopes(el, n):
+    '''
+    Gives the possible isotopes of a site with n atoms of element el, and the number of ways to construct each. Each possible isotope is a multiset of element isotopes, i.e. (0, 0, 1), and the number of ways to construct it is the multinomial coefficient n! / (c_1! c_2! ...), where c_i counts the atoms with each element isotope. Results are cached, as the same (element, n) pairs recur across sites and molecules. 
+    
+    Inputs:
+        el: A string, the chemical element of the site.
+        n: An int, the number of atoms at the site.
+        
+    Outputs:
+        siteIsotopes: A tuple of tuples, giving the possible combinations of substitutions at the site. 
+        counts: A tuple of ints, giving the multinomial coefficient of each entry of siteIsotopes. 
+    '''
+    siteIsotopes = tuple(itertools.combinations_with_replacement(setsOfElementIsotopes[el], n))
+
+    counts = []
+    for siteComposition in siteIsotopes:
+        multiplicities = collections.Counter(siteComposition).values()
+        counts.append(math.factorial(n) // math.prod(math.factorial(c) for c in multiplicities))
+
+    return siteIsotopes, tuple(counts)
+
+#The isotopes of an element change if it is registered again
+ir.onCompile(multiatomicSiteIsotopes.cache_clear)
+
+def calcAllIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, M1Only = False, maxMass = None):
     '''
-    Compute all isotopologues of a molecule. For much larger molecules (>1 million isotopologues), we will want to avoid this step and instead just calculate the MN populations we are most interested in. 
+    Compute all isotopologues of a molecule. For much larger molecules (>1 million isotopologues), we will want to avoid this step and instead just calculate the MN populations we are most interested in; set maxMass to do so (see calcBoundedMassIsotopologues). 
     
     Inputs:
         setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
         multinomialCoefficients: A list of tuples, where tuple i gives the multinomial coefficients of substitutions at site i. 
+        M1Only: If True, only calculates the unsubstituted and M+1 isotopologues. 
+        maxMass: An int or None. If an int, only calculates isotopologues with cardinal mass difference less than or equal to maxMass. 
         
     Outputs: 
         setOfAllIsotopologues: A list of tuples, where each tuple is an isotopologue of a molecule.
@@ -95,6 +110,10 @@ def calcAllIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, M1Only = F
     if M1Only:
         setOfM1Isotopologues, symmetryNumbers = calcThroughM1Isotopologues(setsOfSiteIsotopes)
         return setOfM1Isotopologues, symmetryNumbers
+
+    if maxMass is not None:
+        setOfBoundedIsotopologues, symmetryNumbers = calcBoundedMassIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, maxMass)
+        return setOfBoundedIsotopologues, symmetryNumbers
     
     i = 0
     setOfAllIsotopologues = []
@@ -112,9 +131,398 @@ def calcAllIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, M1Only = F
                              
     return setOfAllIsotopologues, symmetryNumbers
 
+def calcAllIsotopologueCodes(setsOfSiteIsotopes, multinomialCoefficients, start = 0, stop = None):
+    '''
+    Computes all isotopologues of a molecule directly as an isotope code array (see isotopologueCodeArray), without constructing a tuple for each isotopologue. Row i of the output is the ATOM depiction of isotopologue i from calcAllIsotopologues, i.e. the same ordering as itertools.product. 
+
+    The isotope chosen at site s for row i follows from mixed-radix arithmetic: it is (i // stride) % k, where k is the number of possible isotopes at site s and stride is the product of k over all later sites. As each row is computed from its index alone, any contiguous range of isotopologues can be computed on its own via start and stop. 
+    
+    Inputs:
+        setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
+        multinomialCoefficients: A list of tuples, where tuple i gives the multinomial coefficients of substitutions at site i. 
+        start: An int, the index of the first isotopologue to compute. 
+        stop: An int or None, one past the index of the last isotopologue to compute. If None, computes through the last isotopologue. 
+        
+    Outputs: 
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8.
+        symmetryNumbers: A numpy array of ints, where int i gives the number of ways to construct isotopologue i. 
+    '''
+    siteSizes = [len(siteIsotopes) for siteIsotopes in setsOfSiteIsotopes]
+    nIsotopologues = math.prod(siteSizes)
+    if stop is None:
+        stop = nIsotopologues
+    rowIndices = np.arange(start, stop, dtype = np.int64)
+
+    columns = []
+    symmetryNumbers = np.ones(len(rowIndices), dtype = np.int64)
+    stride = nIsotopologues
+    for siteIsotopes, siteCoefficients, k in zip(setsOfSiteIsotopes, multinomialCoefficients, siteSizes):
+        stride //= k
+        choice = (rowIndices // stride) % k
+
+        optionCodes = np.array([isotope if type(isotope) == tuple else (isotope,) for isotope in siteIsotopes], dtype = np.uint8)
+        optionNumbers = np.array([coefficient[0] if type(coefficient) == list else coefficient for coefficient in siteCoefficients], dtype = np.int64)
+
+        columns.append(optionCodes[choice])
+        symmetryNumbers *= optionNumbers[choice]
+
+    isotopeCodes = np.hstack(columns)
+
+    return isotopeCodes, symmetryNumbers
+
+def countIsotopologues(setsOfSiteIsotopes, maxMass = None):
+    '''
+    Counts the isotopologues of a molecule, or those with cardinal mass difference up to maxMass, without enumerating them. The count by mass is the product of one polynomial per site, where the coefficient of x^m gives the number of options at that site with cardinal mass m. 
+    
+    Inputs:
+        setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
+        maxMass: An int or None. If an int, only counts isotopologues with cardinal mass difference less than or equal to maxMass. 
+        
+    Outputs:
+        An int, the number of isotopologues. 
+    '''
+    if maxMass is None:
+        return math.prod(len(siteIsotopes) for siteIsotopes in setsOfSiteIsotopes)
+
+    countByMass = [1] + [0] * maxMass
+    for siteIsotopes in setsOfSiteIsotopes:
+        siteCounts = collections.Counter(sum(isotope) if type(isotope) == tuple else isotope for isotope in siteIsotopes)
+        extended = [0] * (maxMass + 1)
+        for mass, count in enumerate(countByMass):
+            for siteMass, siteCount in siteCounts.items():
+                if mass + siteMass <= maxMass:
+                    extended[mass + siteMass] += count * siteCount
+        countByMass = extended
+
+    return sum(countByMass)
+
+def calcBoundedMassIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, maxMass):
+    '''
+    Computes only the isotopologues with cardinal mass difference less than or equal to maxMass, i.e. the M0, M1, ..., M+maxMass populations. Works site by site, only descending into isotopes of a site which fit in the mass remaining; isotopologues above maxMass are never constructed. The output is in the same order as calcAllIsotopologues with those above maxMass removed. 
+    
+    Inputs:
+        setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
+        multinomialCoefficients: A list of tuples, where tuple i gives the multinomial coefficients of substitutions at site i. 
+        maxMass: An int, the highest cardinal mass difference to include. 
+        
+    Outputs: 
+        setOfBoundedIsotopologues: A list of tuples, where each tuple is an isotopologue of a molecule.
+        symmetryNumbers: A list of ints, where int i gives the number of ways to construct isotopologue i. Follows same indexing as setOfBoundedIsotopologues. 
+    '''
+    #For each site, the cardinal mass and multinomial coefficient of each of its possible isotopes
+    siteOptions = []
+    for siteIsotopes, siteCoefficients in zip(setsOfSiteIsotopes, multinomialCoefficients):
+        options = []
+        for isotope, coefficient in zip(siteIsotopes, siteCoefficients):
+            mass = sum(isotope) if type(isotope) == tuple else isotope
+            number = coefficient[0] if type(coefficient) == list else coefficient
+            options.append((isotope, mass, number))
+        siteOptions.append(options)
+
+    setOfBoundedIsotopologues = []
+    symmetryNumbers = []
+    partialIsotopologue = []
+
+    def addSite(siteIndex, number, massRemaining):
+        if siteIndex == len(siteOptions):
+            setOfBoundedIsotopologues.append(tuple(partialIsotopologue))
+            symmetryNumbers.append(number)
+            return
+
+        for isotope, mass, coefficient in siteOptions[siteIndex]:
+            if mass <= massRemaining:
+                partialIsotopologue.append(isotope)
+                addSite(siteIndex + 1, number * coefficient, massRemaining - mass)
+                partialIsotopologue.pop()
+
+    addSite(0, 1, maxMass)
+
+    return setOfBoundedIsotopologues, symmetryNumbers
+
+def calcBoundedMassIsotopologueCodes(setsOfSiteIsotopes, multinomialCoefficients, maxMass, start = 0, stop = None):
+    '''
+    Computes the isotopologues of calcBoundedMassIsotopologues directly as an isotope code array, as calcAllIsotopologueCodes does for all isotopologues. Row i of the output is isotopologue i of calcBoundedMassIsotopologues, so any contiguous range of them can be computed on its own via start and stop, and isotopologues above maxMass are never constructed. 
+
+    Rows are found from their index by counting rather than by enumeration. completions[s][m] gives the number of ways to fill sites s onwards with cardinal mass at most m. At site s, the options are taken in order; a row whose index is below the completions of option j, given the mass remaining, takes option j, and otherwise its index is reduced by that count and it moves on to option j + 1. 
+
+    Inputs:
+        setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
+        multinomialCoefficients: A list of tuples, where tuple i gives the multinomial coefficients of substitutions at site i. 
+        maxMass: An int, the highest cardinal mass difference to include. 
+        start: An int, the index of the first isotopologue to compute. 
+        stop: An int or None, one past the index of the last isotopologue to compute. If None, computes through the last isotopologue. 
+        
+    Outputs: 
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8.
+        symmetryNumbers: A numpy array of ints, where int i gives the number of ways to construct isotopologue i. 
+    '''
+    siteOptions = []
+    for siteIsotopes, siteCoefficients in zip(setsOfSiteIsotopes, multinomialCoefficients):
+        optionCodes = np.array([isotope if type(isotope) == tuple else (isotope,) for isotope in siteIsotopes], dtype = np.uint8)
+        optionNumbers = np.array([coefficient[0] if type(coefficient) == list else coefficient for coefficient in siteCoefficients], dtype = np.int64)
+        siteOptions.append((optionCodes, optionCodes.sum(axis = 1).astype(np.int64), optionNumbers))
+
+    #completions[s][m], filled from the last site backwards
+    completions = [np.ones(maxMass + 1, dtype = np.int64)]
+    for optionCodes, optionMasses, optionNumbers in reversed(siteOptions):
+        following = completions[0]
+        siteCompletions = np.zeros(maxMass + 1, dtype = np.int64)
+        for mass in optionMasses:
+            if mass <= maxMass:
+                siteCompletions[mass:] += following[:maxMass + 1 - mass]
+        completions.insert(0, siteCompletions)
+
+    if stop is None:
+        stop = int(completions[0][maxMass])
+    rowIndices = np.arange(start, stop, dtype = np.int64)
+    massRemaining = np.full(len(rowIndices), maxMass, dtype = np.int64)
+
+    columns = []
+    symmetryNumbers = np.ones(len(rowIndices), dtype = np.int64)
+    for (optionCodes, optionMasses, optionNumbers), following in zip(siteOptions, completions[1:]):
+        choice = np.zeros(len(rowIndices), dtype = np.int64)
+        undecided = np.ones(len(rowIndices), dtype = bool)
+        for optionIndex, mass in enumerate(optionMasses):
+            counts = np.where(massRemaining >= mass, following[np.maximum(massRemaining - mass, 0)], 0)
+            take = undecided & (rowIndices < counts)
+            choice[take] = optionIndex
+            undecided &= ~take
+            rowIndices = np.where(undecided, rowIndices - counts, rowIndices)
+
+        columns.append(optionCodes[choice])
+        symmetryNumbers *= optionNumbers[choice]
+        massRemaining -= optionMasses[choice]
+
+    isotopeCodes = np.hstack(columns) if columns else np.zeros((len(rowIndices), 0), dtype = np.uint8)
+
+    return isotopeCodes, symmetryNumbers
+
+def calcSparseIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, maxMass):
+    '''
+    Computes the isotopologues with cardinal mass difference up to maxMass, as calcBoundedMassIsotopologues, but stores each only by its substitutions: a tuple of (position, cardinal mass) pairs for the substituted atomic positions, i.e. '00100' is ((2, 1),). For large molecules the M0...M3 isotopologues have only a few substitutions among hundreds of atoms, so this is far smaller than an ATOM string, and everything computed from it (see sparseConcentrations, sparseSubs, and fas.fragmentSparseIsotopologue) takes time proportional to the number of substitutions rather than the number of atoms. 
+
+    Rather than visiting every site, we pick the next substituted site directly. The output is in the same order as calcBoundedMassIsotopologues: with the earlier sites unsubstituted, substituting a later site gives an earlier isotopologue in itertools.product order, so later sites are tried first. 
+    
+    Inputs:
+        setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. The first combination of each site must be the unsubstituted one, as from calculateSetsOfSiteIsotopes. 
+        multinomialCoefficients: A list of tuples, where tuple i gives the multinomial coefficients of substitutions at site i. 
+        maxMass: An int, the highest cardinal mass difference to include. 
+        
+    Outputs: 
+        setOfSparseIsotopologues: A list of tuples of (position, cardinal mass) pairs, one tuple for each isotopologue. 
+        symmetryNumbers: A list of ints, where int i gives the number of ways to construct isotopologue i. Follows same indexing as setOfSparseIsotopologues. 
+    '''
+    #For each site, the substitutions, cardinal mass and multinomial coefficient of each of its substituted options
+    siteOptions = []
+    position = 0
+    for siteIsotopes, siteCoefficients in zip(setsOfSiteIsotopes, multinomialCoefficients):
+        options = []
+        for isotope, coefficient in zip(siteIsotopes[1:], siteCoefficients[1:]):
+            atoms = isotope if type(isotope) == tuple else (isotope,)
+            number = coefficient[0] if type(coefficient) == list else coefficient
+            substitutions = tuple((position + offset, cardinalMass) for offset, cardinalMass in enumerate(atoms) if cardinalMass != 0)
+            options.append((substitutions, sum(atoms), number))
+        siteOptions.append(options)
+        position += len(siteIsotopes[0]) if type(siteIsotopes[0]) == tuple else 1
+
+    setOfSparseIsotopologues = []
+    symmetryNumbers = []
+
+    def addSubstitutions(firstSite, substitutions, number, massRemaining):
+        setOfSparseIsotopologues.append(substitutions)
+        symmetryNumbers.append(number)
+
+        for siteIndex in range(len(siteOptions) - 1, firstSite - 1, -1):
+            for siteSubstitutions, mass, coefficient in siteOptions[siteIndex]:
+                if mass <= massRemaining:
+                    addSubstitutions(siteIndex + 1, substitutions + siteSubstitutions, number * coefficient, massRemaining - mass)
+
+    addSubstitutions(0, (), 1, maxMass)
+
+    return setOfSparseIsotopologues, symmetryNumbers
+
+def sparseToCodes(setOfSparseIsotopologues, nAtoms):
+    '''
+    Expands sparse isotopologues (see calcSparseIsotopologues) to an isotope code array. 
+
+    Inputs:
+        setOfSparseIsotopologues: A list of tuples of (position, cardinal mass) pairs.
+        nAtoms: An int, the number of atoms of the molecule.
+
+    Outputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8.
+    '''
+    isotopeCodes = np.zeros((len(setOfSparseIsotopologues), nAtoms), dtype = np.uint8)
+    for row, substitutions in enumerate(setOfSparseIsotopologues):
+        for position, cardinalMass in substitutions:
+            isotopeCodes[row, position] = cardinalMass
+
+    return isotopeCodes
+
+def sparseConcentrations(setOfSparseIsotopologues, symmetryNumbers, concentrationArray, atomSites):
+    '''
+    Computes the concentration of sparse isotopologues (see calcSparseIsotopologues). The concentration of the unsubstituted isotopologue is found once; each substitution then replaces the unsubstituted isotope at its position, multiplying by the ratio of their concentrations. 
+
+    Inputs:
+        setOfSparseIsotopologues: A list of tuples of (position, cardinal mass) pairs.
+        symmetryNumbers: A list of ints, where int i gives the number of ways to construct isotopologue i.
+        concentrationArray: A numpy array giving the concentration of each isotope at each site.
+        atomSites: A numpy array giving the site index of each atomic position. See atomSiteIndices.
+
+    Outputs:
+        concentrations: A list of floats giving the concentration of each isotopologue, including its symmetry number.
+    '''
+    atomConcentrations = np.array(concentrationArray, dtype = float)[:, atomSites]
+    unsubConc = atomConcentrations[0].prod()
+    ratios = (atomConcentrations / atomConcentrations[0]).T.tolist()
+
+    concentrations = []
+    for substitutions, number in zip(setOfSparseIsotopologues, symmetryNumbers):
+        conc = unsubConc * number
+        for position, cardinalMass in substitutions:
+            conc *= ratios[position][cardinalMass]
+        concentrations.append(conc)
+
+    return concentrations
+
+def sparseSubs(substitutions, siteElements):
+    '''
+    Gives the substitution string of a sparse isotopologue (see calcSparseIsotopologues), as the 'Subs' of calcAtomDictionary, i.e. '13C-D'. 
+
+    Inputs:
+        substitutions: A tuple of (position, cardinal mass) pairs.
+        siteElements: A tuple giving the chemical element by position. See strSiteElements.
+
+    Outputs:
+        A string.
+    '''
+    return '-'.join(uEl(siteElements[position], cardinalMass) for position, cardinalMass in substitutions)
+
+def sparseToATOM(substitutions, nAtoms):
+    '''
+    Gives the ATOM string of a sparse isotopologue (see calcSparseIsotopologues), for reporting. 
+
+    Inputs:
+        substitutions: A tuple of (position, cardinal mass) pairs.
+        nAtoms: An int, the number of atoms of the molecule.
+
+    Outputs:
+        ATOM: A string.
+    '''
+    ATOM = ['0'] * nAtoms
+    for position, cardinalMass in substitutions:
+        ATOM[position] = str(cardinalMass)
+
+    return ''.join(ATOM)
+
+def calcAbundantIsotopologues(setsOfSiteIsotopes, multinomialCoefficients, concentrationArray, abundanceThreshold = 0, topK = None, maxMass = None):
+    '''
+    Computes only the isotopologues with concentration at or above abundanceThreshold, or only the topK most abundant isotopologues, without constructing the rest. Most isotopologues of a large molecule are far too rare to be observed (1e-30 and below), and are culled from predicted measurements anyway. 
+
+    Works site by site, as calcBoundedMassIsotopologues. The concentration of a partial isotopologue times the highest possible concentration of the sites still to add bounds the concentration of every isotopologue built from it; if this bound falls below abundanceThreshold, none of them are constructed. With topK, partial isotopologues are instead extended in order of this bound, using a priority queue, until topK complete isotopologues are found; these are then the most abundant. 
+
+    The total concentration of the isotopologues which are left out is reported as well, so one can check how much of the molecule is lost. Isotopologues above maxMass are excluded by choice, so are not counted in this total. 
+    
+    Inputs:
+        setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
+        multinomialCoefficients: A list of tuples, where tuple i gives the multinomial coefficients of substitutions at site i. 
+        concentrationArray: A tuple of numpy arrays; the output of siteSpecificConcentrations.
+        abundanceThreshold: A float. Isotopologues with concentration below this are not included. 
+        topK: An int or None. If an int, includes only this many isotopologues, the most abundant. 
+        maxMass: An int or None. If an int, only includes isotopologues with cardinal mass difference less than or equal to maxMass. 
+        
+    Outputs: 
+        setOfAbundantIsotopologues: A list of tuples, where each tuple is an isotopologue of a molecule. In the same order as calcAllIsotopologues, or from most to least abundant if topK is given. 
+        symmetryNumbers: A list of ints, where int i gives the number of ways to construct isotopologue i. Follows same indexing as setOfAbundantIsotopologues. 
+        concentrations: A list of floats, giving the concentration of each isotopologue. Follows same indexing as setOfAbundantIsotopologues. 
+        discarded: A float, the total concentration of all isotopologues (up to maxMass) which are not included. 
+    '''
+    #For each site, the cardinal mass, multinomial coefficient, and concentration of each of its possible isotopes
+    siteOptions = []
+    for siteIndex, (siteIsotopes, siteCoefficients) in enumerate(zip(setsOfSiteIsotopes, multinomialCoefficients)):
+        options = []
+        for isotope, coefficient in zip(siteIsotopes, siteCoefficients):
+            atoms = isotope if type(isotope) == tuple else (isotope,)
+            number = coefficient[0] if type(coefficient) == list else coefficient
+            conc = number * np.prod([concentrationArray[cardinalMass][siteIndex] for cardinalMass in atoms])
+            options.append((isotope, sum(atoms), number, conc))
+        siteOptions.append(options)
+    nSites = len(siteOptions)
+
+    if maxMass is None:
+        maxMass = sum(max(mass for isotope, mass, number, conc in options) for options in siteOptions)
+
+    #bestRemaining[i] is the highest concentration the sites from i on can contribute
+    bestRemaining = [1] * (nSites + 1)
+    for siteIndex in range(nSites - 1, -1, -1):
+        bestRemaining[siteIndex] = bestRemaining[siteIndex + 1] * max(conc for isotope, mass, number, conc in siteOptions[siteIndex])
+
+    #totalRemaining[i][m] is the total concentration the sites from i on contribute with cardinal mass up to m, so a partial isotopologue
+    #with concentration c and m mass remaining stands for c * totalRemaining[i][m] of the molecule
+    totalRemaining = [[1] * (maxMass + 1) for siteIndex in range(nSites + 1)]
+    for siteIndex in range(nSites - 1, -1, -1):
+        for massRemaining in range(maxMass + 1):
+            totalRemaining[siteIndex][massRemaining] = sum(conc * totalRemaining[siteIndex + 1][massRemaining - mass]
+                                                           for isotope, mass, number, conc in siteOptions[siteIndex] if mass <= massRemaining)
+
+    setOfAbundantIsotopologues = []
+    symmetryNumbers = []
+    concentrations = []
+    discarded = 0
+
+    if topK is None:
+        partialIsotopologue = []
+
+        def addSite(siteIndex, number, partialConc, massRemaining):
+            nonlocal discarded
+            if partialConc * bestRemaining[siteIndex] < abundanceThreshold:
+                discarded += partialConc * totalRemaining[siteIndex][massRemaining]
+                return
+
+            if siteIndex == nSites:
+                setOfAbundantIsotopologues.append(tuple(partialIsotopologue))
+                symmetryNumbers.append(number)
+                concentrations.append(partialConc)
+                return
+
+            for isotope, mass, coefficient, conc in siteOptions[siteIndex]:
+                if mass <= massRemaining:
+                    partialIsotopologue.append(isotope)
+                    addSite(siteIndex + 1, number * coefficient, partialConc * conc, massRemaining - mass)
+                    partialIsotopologue.pop()
+
+        addSite(0, 1, 1, maxMass)
+
+    else:
+        #Entries are (-bound, tiebreak, siteIndex, number, concentration, mass remaining, partial isotopologue)
+        queue = [(-bestRemaining[0], 0, 0, 1, 1, maxMass, ())]
+        pushed = 1
+        while queue and len(setOfAbundantIsotopologues) < topK:
+            negBound, tiebreak, siteIndex, number, partialConc, massRemaining, partialIsotopologue = heapq.heappop(queue)
+            if siteIndex == nSites:
+                setOfAbundantIsotopologues.append(partialIsotopologue)
+                symmetryNumbers.append(number)
+                concentrations.append(partialConc)
+                continue
+
+            for isotope, mass, coefficient, conc in siteOptions[siteIndex]:
+                if mass <= massRemaining:
+                    newConc = partialConc * conc
+                    bound = newConc * bestRemaining[siteIndex + 1]
+                    if bound < abundanceThreshold:
+                        discarded += newConc * totalRemaining[siteIndex + 1][massRemaining - mass]
+                        continue
+                    heapq.heappush(queue, (-bound, pushed, siteIndex + 1, number * coefficient, newConc, massRemaining - mass, partialIsotopologue + (isotope,)))
+                    pushed += 1
+
+        for negBound, tiebreak, siteIndex, number, partialConc, massRemaining, partialIsotopologue in queue:
+            discarded += partialConc * totalRemaining[siteIndex][massRemaining]
+
+    return setOfAbundantIsotopologues, symmetryNumbers, concentrations, discarded
+
 def calcThroughM1Isotopologues(setsOfSiteIsotopes):
     '''
-    A workaround to compute only the M1 population of isotopologues (and the unsubstituted isotopologue). This will speed calculation for M+1 experiments. Variants could be written for M+2, M+3, etc.; this is a future goal. 
+    A workaround to compute only the M1 population of isotopologues (and the unsubstituted isotopologue). This will speed calculation for M+1 experiments. For M+2, M+3, etc., see calcBoundedMassIsotopologues. 
     
     Inputs:
         setsOfSiteIsotopes: A list of tuples, where tuple i gives the possible combinations of substitutions at site i. 
@@ -178,15 +586,31 @@ def siteSpecificConcentrations(molecularDataFrame):
         concentrationArray: A numpy array giving the concentration of each isotope at each site. 
     '''
     elIDs = molecularDataFrame['IDS'].values
-    numberAtSite = molecularDataFrame['Number'].values
     deltas = molecularDataFrame['deltas'].values
+
+    return siteConcentrationsFromDeltas(elIDs, deltas)
+
+def siteConcentrationsFromDeltas(elIDs, deltas):
+    '''
+    As siteSpecificConcentrations, for the elements and deltas of each site given directly. Useful when the same molecule is evaluated for many sets of deltas. 
     
-    concentrationList = []
-    for index in range(len(elIDs)):
-        element = elIDs[index]
-        delta = deltas[index]
-        concentration = op.deltaToConcentration(element, delta)
-        concentrationList.append(concentration)
+    Inputs:
+        elIDs: A list of strings, giving the element at each site.
+        deltas: A list of floats, giving the delta value of each site.
+        
+    Outputs:
+        concentrationArray: A numpy array giving the concentration of each isotope at each site. 
+    '''
+    #Sites constrained by two deltas (17/18O, 33/34S) are given as tuples; otherwise, convert all sites at once
+    if any(type(delta) == tuple for delta in deltas):
+        concentrationList = []
+        for index in range(len(elIDs)):
+            element = elIDs[index]
+            delta = deltas[index]
+            concentration = op.deltaToConcentration(element, delta)
+            concentrationList.append(concentration)
+    else:
+        concentrationList = op.deltasToConcentrations(elIDs, np.asarray(deltas, dtype = float)).T
 
     #put site-specific concentrations into a workable form
     unsub = []
@@ -205,23 +629,211 @@ def siteSpecificConcentrations(molecularDataFrame):
     
     return concentrationArray
 
-def calculateIsotopologueConcentrations(setOfAllIsotopologues, symmetryNumbers, concentrationArray, disable = False):
+def siteWidths(isotopologue):
     '''
-    Puts information about the isotopologues of a molecule, their symmetry numbers, and concentrations of individual isotopes together in order to calculate the concentration of each isotopologue. Does so under the stochastic assumption, i.e. assuming that isotopes are distributed stochastically across all isotopologues.
-    
-    This is a computationally expensive step--ways to improve would be welcome. For molecules where it is too expensive, it would be expedient to avoid calculating all isotopologues and only calculate the M1, M2, etc populations of interest. 
-    
+    Gives the number of atoms at each site of an isotopologue. Single-atomic sites are given as integers and multiatomic sites as tuples, so the structure of any one isotopologue from calcAllIsotopologues is sufficient.
+
+    Inputs:
+        isotopologue: A tuple (or list) giving one isotopologue of a molecule, e.g. (0, (0, 1), 0).
+
+    Outputs:
+        widths: A list of ints, where int i gives the number of atoms at site i.
+    '''
+    widths = [len(value) if type(value) == tuple else 1 for value in isotopologue]
+
+    return widths
+
+def atomSiteIndices(widths):
+    '''
+    Gives the site index of each atomic position, i.e. for sites with widths [1, 2, 1] returns [0, 1, 1, 2]. This lets us expand site-specific information (such as the concentrationArray) to the ATOM depiction.
+
+    Inputs:
+        widths: A list of ints giving the number of atoms at each site. See siteWidths.
+
+    Outputs:
+        A numpy array of ints, one entry per atomic position, giving the site of that position.
+    '''
+    return np.repeat(np.arange(len(widths)), widths)
+
+def isotopologueCodeArray(setOfAllIsotopologues, disable = True):
+    '''
+    Encodes a list of isotopologues as a single integer array, where entry [i][j] gives the cardinal mass of the isotope at atomic position j of isotopologue i. Each row is the ATOM depiction of an isotopologue, i.e. '(0, 1)0' becomes [0, 1, 0].
+
     Inputs:
         setOfAllIsotopologues: A list of tuples, where each tuple is an isotopologue of a molecule.
-        symmetryNumbers: A list of ints, where int i gives the number of ways to construct isotopologue i. Follows same indexing as setOfAllIsotopologues. 
-        concentrationArray: A numpy array giving the concentration of each isotope at each site. 
-        disable: Disables the tqdm progress bar if True. 
-        
+        disable: Disables the tqdm progress bar, over sites, if True.
+
+    Outputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8.
+    '''
+    nIsotopologues = len(setOfAllIsotopologues)
+    widths = siteWidths(setOfAllIsotopologues[0])
+
+    #Working site by site lets numpy handle the tuples of multiatomic sites as 2D columns
+    columns = []
+    for siteIndex in tqdm(range(len(widths)), disable = disable):
+        siteColumn = np.array([isotopologue[siteIndex] for isotopologue in setOfAllIsotopologues], dtype = np.uint8)
+        columns.append(siteColumn.reshape(nIsotopologues, widths[siteIndex]))
+
+    isotopeCodes = np.hstack(columns)
+
+    return isotopeCodes
+
+def isotopologueConcentrationArray(isotopeCodes, symmetryNumbers, concentrationArray, atomSites, logSum = False):
+    '''
+    Computes the concentration of every isotopologue at once. Expands the concentrationArray to atomic positions, gathers the concentration of the isotope present at every position of every isotopologue, and takes the product along each row. Does so under the stochastic assumption.
+
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position. See isotopologueCodeArray.
+        symmetryNumbers: A list or array of ints, where int i gives the number of ways to construct isotopologue i.
+        concentrationArray: A numpy array giving the concentration of each isotope at each site.
+        atomSites: A numpy array giving the site index of each atomic position. See atomSiteIndices.
+        logSum: If True, sums the logarithms of the concentrations rather than taking the product, and returns the logarithm of each concentration. Slower, but the logarithms do not underflow for very large molecules, where the concentrations themselves would.
+
     Outputs:
-        d: A dictionary where the keys are string representations of each isotopologue and the values are dictionaries. For example, a string could be '00100', where there is an M1 substitution at position 2 and M0 isotopes at all other sites. The value dictionaries include "Conc", or concentration, and "num", giving the number of isotopologues of that form. The sum of all concentrations should be 1.  
+        A numpy array giving the concentration of each isotopologue, already multiplied by its symmetry number. If logSum, gives the natural logarithm of these concentrations instead.
+    '''
+    atomConcentrations = np.array(concentrationArray, dtype = float)[:, atomSites]
+    isotopeConcs = atomConcentrations[isotopeCodes, np.arange(len(atomSites))]
+
+    if logSum:
+        with np.errstate(divide = 'ignore'):
+            return np.log(isotopeConcs).sum(axis = 1) + np.log(np.asarray(symmetryNumbers, dtype = float))
+
+    isotopologueConcs = isotopeConcs.prod(axis = 1)
+
+    return isotopologueConcs * np.asarray(symmetryNumbers)
+
+def batchSiteConcentrations(elIDs, deltaMatrix):
+    '''
+    As siteConcentrationsFromDeltas, for many sets of deltas at once. 
+    
+    Inputs:
+        elIDs: A list of strings, giving the element at each site.
+        deltaMatrix: A numpy array of shape (scenarios, sites), where row i gives the delta value of each site in scenario i. 
         
-        The keys can be "expanded" strings, i.e. including multiple atomic sites in parentheses. For example, N1/N2 and O3 would appear as (0,1)0. 
+    Outputs:
+        concentrationArrays: A numpy array of shape (5, scenarios, sites), where entry [i][k][j] gives the concentration of an isotope with cardinal mass difference i at site j in scenario k. 
+    '''
+    deltaMatrix = np.asarray(deltaMatrix, dtype = float)
+    concentrationArrays = np.zeros((5,) + deltaMatrix.shape)
+
+    concentrationArrays[[0, 1, 2, 4]] = op.deltasToConcentrations(elIDs, deltaMatrix)
+
+    return concentrationArrays
+
+def isotopologueConcentrationMatrix(isotopeCodes, symmetryNumbers, concentrationArrays, atomSites):
     '''
+    Computes the concentration of every isotopologue in many scenarios at once. The concentration of an isotopologue is its symmetry number times the product, over isotopes, of the concentration of each isotope raised to the number of times it appears. Counting the appearances of each (isotope, site) pair in each isotopologue gives a small matrix which depends only on the isotopologues; the logarithm of every concentration is then a single matrix product of these counts with the logarithms of the site-specific concentrations of each scenario. 
+
+    The output has one entry per isotopologue per scenario, so memory scales as their product. 
+
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position. See isotopologueCodeArray.
+        symmetryNumbers: A list or array of ints, where int i gives the number of ways to construct isotopologue i.
+        concentrationArrays: A numpy array of shape (5, scenarios, sites); the output of batchSiteConcentrations.
+        atomSites: A numpy array giving the site index of each atomic position. See atomSiteIndices.
+
+    Outputs:
+        A numpy array of shape (scenarios, isotopologues) giving the concentration of each isotopologue in each scenario, already multiplied by its symmetry number.
+    '''
+    nMasses, nScenarios, nSites = concentrationArrays.shape
+    nIsotopologues = len(isotopeCodes)
+
+    #counts[i][m * nSites + j] is the number of atoms at site j of isotopologue i with cardinal mass m
+    counts = np.zeros((nIsotopologues, nMasses * nSites))
+    rowIndices = np.arange(nIsotopologues)
+    for position, site in enumerate(atomSites):
+        counts[rowIndices, isotopeCodes[:, position].astype(np.int64) * nSites + site] += 1
+
+    used = counts.any(axis = 0)
+    siteLogConcs = np.log(concentrationArrays.transpose(1, 0, 2).reshape(nScenarios, nMasses * nSites)[:, used])
+    logConcs = siteLogConcs @ counts[:, used].T
+
+    return np.exp(logConcs) * np.asarray(symmetryNumbers)
+
+def atomStrings(isotopeCodes):
+    '''
+    Gives the ATOM string depiction of every isotopologue of an isotope code array, i.e. '000100'. Each row is read as a byte string. 
+
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+
+    Outputs:
+        A list of strings.
+    '''
+    charArray = np.ascontiguousarray(isotopeCodes + ord('0'), dtype = np.uint8)
+    byteStrings = charArray.view('S' + str(charArray.shape[1])).ravel()
+
+    return np.char.decode(byteStrings, 'ascii').tolist()
+
+def fullStrings(isotopeCodes, widths):
+    '''
+    Produces the "expanded" string depiction of every row of an isotope code array, i.e. [0, 1, 0] with widths [2, 1] becomes '(0, 1)0'. These match the strings produced by joining the isotopologue tuples directly.
+
+    As every cardinal mass is a single digit, every string has the same length; we fill a byte array with a template and write the digits in place, which avoids formatting each isotopologue individually.
+
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+        widths: A list of ints giving the number of atoms at each site.
+
+    Outputs:
+        A list of strings, the expanded depiction of each isotopologue.
+    '''
+    template = []
+    digitPositions = []
+    for width in widths:
+        if width == 1:
+            digitPositions.append(len(template))
+            template.append('0')
+        else:
+            template.append('(')
+            for atom in range(width):
+                if atom > 0:
+                    template += [',', ' ']
+                digitPositions.append(len(template))
+                template.append('0')
+            template.append(')')
+
+    charArray = np.empty((len(isotopeCodes), len(template)), dtype = np.uint8)
+    charArray[:] = np.frombuffer(''.join(template).encode('ascii'), dtype = np.uint8)
+    charArray[:, digitPositions] = isotopeCodes + ord('0')
+
+    byteStrings = np.ascontiguousarray(charArray).view('S' + str(len(template))).ravel()
+
+    return np.char.decode(byteStrings, 'ascii').tolist()
+
+def calculateIsotopologueConcentrations(setOfAllIsotopologues, symmetryNumbers, concentrationArray, disable = False, vectorize = True):
+    '''
+    Puts information about the isotopologues of a molecule, their symmetry numbers, and concentrations of individual isotopes together in order to calculate the concentration of each isotopologue. Does so under the stochastic assumption, i.e. assuming that isotopes are distributed stochastically across all isotopologues.
+
+    This is a computationally expensive step. By default, we encode all isotopologues as a single integer array and compute every concentration at once (see isotopologueConcentrationArray); the original loop is kept for reference via vectorize = False. For molecules where it is too expensive, it would be expedient to avoid calculating all isotopologues and only calculate the M1, M2, etc populations of interest.
+
+    Inputs:
+        setOfAllIsotopologues: A list of tuples, where each tuple is an isotopologue of a molecule.
+        symmetryNumbers: A list of ints, where int i gives the number of ways to construct isotopologue i. Follows same indexing as setOfAllIsotopologues.
+        concentrationArray: A numpy array giving the concentration of each isotope at each site.
+        disable: Disables the tqdm progress bar if True. If vectorize, the bar runs over sites as the isotopologues are encoded.
+        vectorize: If True, computes all concentrations with a single array operation rather than looping over isotopologues.
+
+    Outputs:
+        d: A dictionary where the keys are string representations of each isotopologue and the values are dictionaries. For example, a string could be '00100', where there is an M1 substitution at position 2 and M0 isotopes at all other sites. The value dictionaries include "Conc", or concentration, and "num", giving the number of isotopologues of that form. The sum of all concentrations should be 1.
+
+        The keys can be "expanded" strings, i.e. including multiple atomic sites in parentheses. For example, N1/N2 and O3 would appear as (0,1)0.
+    '''
+    if len(setOfAllIsotopologues) == 0:
+        return {}
+
+    if vectorize:
+        widths = siteWidths(setOfAllIsotopologues[0])
+        isotopeCodes = isotopologueCodeArray(setOfAllIsotopologues, disable = disable)
+        concs = isotopologueConcentrationArray(isotopeCodes, symmetryNumbers, concentrationArray, atomSiteIndices(widths))
+        strings = fullStrings(isotopeCodes, widths)
+
+        d = {string: {'Conc': conc, 'num': number} for string, conc, number in zip(strings, concs.tolist(), symmetryNumbers)}
+
+        return d
+
     d = {}
     for i, isotopologue in enumerate(tqdm(setOfAllIsotopologues, disable = disable)):
         number = symmetryNumbers[i]
@@ -242,9 +854,95 @@ def calculateIsotopologueConcentrations(setOfAllIsotopologues, symmetryNumbers,
         
     return d
 
+def packIsotopeCodes(isotopeCodes):
+    '''
+    Packs an isotope code array into 64 bit integers, 3 bits per atom (cardinal masses are at most 4). Position j of an isotopologue is held in bits 3*(j % 21) of word j // 21, so molecules of up to 21 atoms take a single word per isotopologue rather than a string of 21 characters. The packing is the same as that of isotopologueKey, so these words give the integer key of each isotopologue (see packedKeys). 
+
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+
+    Outputs:
+        packed: A numpy array of shape (isotopologues, words) of dtype uint64.
+    '''
+    nIsotopologues, nAtoms = isotopeCodes.shape
+    nWords = max(1, -(-nAtoms // 21))
+
+    packed = np.zeros((nIsotopologues, nWords), dtype = np.uint64)
+    for position in range(nAtoms):
+        word, shift = divmod(position, 21)
+        packed[:, word] |= isotopeCodes[:, position].astype(np.uint64) << np.uint64(3 * shift)
+
+    return packed
+
+def unpackIsotopeCodes(packed, nAtoms):
+    '''
+    Recovers the isotope code array from the output of packIsotopeCodes. 
+
+    Inputs:
+        packed: A numpy array of shape (isotopologues, words) of dtype uint64.
+        nAtoms: An int, the number of atoms of the molecule.
+
+    Outputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8.
+    '''
+    isotopeCodes = np.zeros((len(packed), nAtoms), dtype = np.uint8)
+    for position in range(nAtoms):
+        word, shift = divmod(position, 21)
+        isotopeCodes[:, position] = (packed[:, word] >> np.uint64(3 * shift)) & np.uint64(7)
+
+    return isotopeCodes
+
+def packedKeys(packed):
+    '''
+    Gives the integer key (see isotopologueKey) of every isotopologue of a packed array, as python ints for use as dictionary keys. 
+
+    Inputs:
+        packed: A numpy array of shape (isotopologues, words) of dtype uint64.
+
+    Outputs:
+        A list of ints.
+    '''
+    keys = packed[:, 0].tolist()
+    for word in range(1, packed.shape[1]):
+        keys = [key | (high << (63 * word)) for key, high in zip(keys, packed[:, word].tolist())]
+
+    return keys
+
+#The characters of a valid ATOM string, see isotopologueKey
+OCTAL_DIGITS = frozenset('01234567')
+
+def isotopologueKey(ATOM):
+    '''
+    Encodes an ATOM string as an integer, i.e. '0100' as 8. Each cardinal mass fits in 3 bits, an octal digit, so the key of an ATOM string is that string read backwards in base 8; position j of the isotopologue is held in bits 3j of the key. Integer keys hash faster than strings and take far less memory. 
+
+    Inputs:
+        ATOM: A string, the ATOM depiction of an isotopologue.
+
+    Outputs:
+        An int.
+    '''
+    #int() would also accept signs, underscores, whitespace and non-ascii digits
+    if ATOM == '' or not set(ATOM) <= OCTAL_DIGITS:
+        raise ValueError("Invalid ATOM string " + repr(ATOM) + "; expected only the digits 0-7.")
+
+    return int(ATOM[::-1], 8)
+
+def keyToATOM(key, nAtoms):
+    '''
+    Decodes an integer key from isotopologueKey to its ATOM string. 
+
+    Inputs:
+        key: An int. 
+        nAtoms: An int, the number of atoms of the molecule.
+
+    Outputs:
+        ATOM: A string, the ATOM depiction of an isotopologue.
+    '''
+    return format(key, 'o').zfill(nAtoms)[::-1]
+
 def condenseStr(text):
     '''
-    Takes the "expanded" string depictions, i.e. "(0,1)0" for multiatomic sites and transforms them into "ATOM" depictions, i.e. "010". This makes it easy to pick out the element for a particular substitution by finding the index of the ATOM depiction and looking at that same index in strSiteElements. 
+    Takes the "expanded" string depictions, i.e. "(0,1)0" for multiatomic sites and transforms them into "ATOM" depictions, i.e. "010". This makes it easy to pick out the element for a particular substitution by finding the index of the ATOM depiction and looking at that same index in the output of strSiteElements. 
     
     Inputs:
         text: A string, the "expanded" string depiction. 
@@ -270,56 +968,86 @@ def uEl(el, n):
     Returns: 
         A string identifying the isotope substitution. 
     '''
-    if n == 0:
-        return ''
     if n == 'x':
         return ''
-    if el == 'C':
-        if n == 1:
-            return '13C'
-    if el == 'H':
-        if n == 1:
-            return 'D'
-    if el == 'O':
-        if n == 1:
-            return '17O'
-        if n == 2:
-            return '18O'
-    if el == 'N':
-        if n == 1:
-            return '15N'
-    if el == 'S':
-        if n == 1:
-            return '33S'
-        if n == 2:
-            return '34S'
-        if n == 4:
-            return '36S'
+
+    return ir.isotopeLabel(el, n)
 
 def strSiteElements(molecularDataFrame):
     '''
-    Our dataframe may include multiatomic sites--for example, we may define site N1/N2 to include two nitrogens and site O3 to have one oxygen. It is useful to have a string where we can index in by position--i.e. "NNO"--to determine the chemical element at a given position. This function defines that string. 
+    Our dataframe may include multiatomic sites--for example, we may define site N1/N2 to include two nitrogens and site O3 to have one oxygen. It is useful to have a sequence where we can index in by position--i.e. ('N', 'N', 'O')--to determine the chemical element at a given position. This function defines that sequence. It is a tuple of element symbols rather than a string, so that elements with two-letter symbols (Cl, Br, Si) take one position each. 
     
     Inputs:
         molecularDataFrame: A dataFrame containing information about the molecule.
         
     Outputs: 
-        siteElements: A string giving the chemical element by position, expanding multiatomic sites. 
+        siteElements: A tuple giving the chemical element by position, expanding multiatomic sites. 
     '''
     elIDs = molecularDataFrame['IDS'].values
     numberAtSite = molecularDataFrame['Number'].values
 
     siteList = [(x,y) for x,y in zip(elIDs, numberAtSite)]
-    siteElementsList = [site[0] * site[1] for site in siteList]
-    siteElements = ''.join(siteElementsList)
+    siteElements = tuple(site[0] for site in siteList for atom in range(int(site[1])))
     
     return siteElements
 
+def cardinalMasses(isotopeCodes):
+    '''
+    Gives the cardinal mass difference of every isotopologue of an isotope code array, i.e. the sum of each row. 
+    
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+        
+    Outputs:
+        A numpy array of ints, giving the cardinal mass difference of each isotopologue. 
+    '''
+    return isotopeCodes.sum(axis = 1, dtype = np.int32)
+
+def substitutionClasses(isotopeCodes, siteElements):
+    '''
+    Assigns every isotopologue of an isotope code array to a substitution class, i.e. the "Subs" string of calcAtomDictionary ('13C-D', '18O', ''). Each position is mapped to an integer label for its substitution; the substituted positions of each row are moved to the front, keeping their order, and the distinct rows that result are the substitution classes. Only these few distinct classes are decoded to strings. 
+    
+    Inputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+        siteElements: A tuple giving the chemical element by position, i.e. the output of strSiteElements. 
+        
+    Outputs:
+        subIds: A numpy array of ints, giving the substitution class of each isotopologue. Classes are numbered in order of their first isotopologue. 
+        subLabels: A list of strings, where string i gives the substitution string of class i. 
+    '''
+    nIsotopologues, nAtoms = isotopeCodes.shape
+
+    #The label id of the isotope at each position, from the isotope registry; 0 is unsubstituted
+    labelNames = ir.LABELS
+    labelIds = ir.LABEL_IDS[ir.elementCodes(siteElements), isotopeCodes]
+    maxSubs = int((labelIds != 0).sum(axis = 1).max()) if nIsotopologues > 0 else 0
+
+    if maxSubs == 0:
+        return np.zeros(nIsotopologues, dtype = np.int32), ['']
+
+    #A stable sort on "is unsubstituted" moves the substituted positions to the front without reordering them
+    order = np.argsort(labelIds == 0, axis = 1, kind = 'stable')[:, :maxSubs]
+    compact = np.take_along_axis(labelIds, order, axis = 1)
+
+    #Number the distinct rows one column at a time; renumbering densely at each step keeps the keys small
+    subIds = np.zeros(nIsotopologues, dtype = np.int64)
+    for column in compact.T:
+        subIds = np.unique(subIds * len(labelNames) + column, return_inverse = True)[1].ravel()
+
+    #Renumber the classes in order of their first isotopologue, so the numbering does not depend on how the isotopologues were split up
+    representatives = np.unique(subIds, return_index = True)[1]
+    firstAppearance = np.argsort(representatives)
+    renumber = np.empty(len(representatives), dtype = np.int32)
+    renumber[firstAppearance] = np.arange(len(representatives))
+    subLabels = ['-'.join(labelNames[labelId] for labelId in row if labelId != 0) for row in compact[representatives[firstAppearance]]]
+
+    return renumber[subIds], subLabels
+
 def calcAtomDictionary(isotopologueConcentrationDict, molecularDataFrame, disable = False):
     '''
     Given the dictionary from calculateIsotopologueConcentrations, calculates another dictionary with more complete information. Takes the "expanded" string depictions i.e. "(0,1)0" to "ATOM" depictions i.e. "010" and makes these the keys. Stores the expanded depictions, number, and concentration for each isotopologue, then additionally calculates their mass and relevant substitutions. 
     
-    Computationally expensive; 20 seconds for methionine.
+    Masses and substitutions are found for all isotopologues at once from their isotope codes (see cardinalMasses and substitutionClasses). 
     
     An example entry from methionine for the unsubstituted isotopologue is shown below:  
     
@@ -340,17 +1068,50 @@ def calcAtomDictionary(isotopologueConcentrationDict, molecularDataFrame, disabl
     siteElements = strSiteElements(molecularDataFrame)
     
     byAtom = {}
-    for i, v in tqdm(isotopologueConcentrationDict.items(), disable = disable):
-        ATOM = condenseStr(i)
+    if len(isotopologueConcentrationDict) == 0:
+        return byAtom
+
+    #Masses and substitutions are found for all isotopologues at once from their isotope codes; only the distinct substitutions are decoded to strings
+    fullKeys = list(isotopologueConcentrationDict.keys())
+    isotopeCodes, ATOMStrings = fullStringsToCodes(fullKeys)
+    masses = cardinalMasses(isotopeCodes).tolist()
+    subIds, subLabels = substitutionClasses(isotopeCodes, siteElements)
+
+    for i, v, ATOM, mass, subId in tqdm(zip(fullKeys, isotopologueConcentrationDict.values(), ATOMStrings, masses, subIds.tolist()), total = len(fullKeys), disable = disable):
         byAtom[ATOM] = {}
         byAtom[ATOM]['Number'] = v['num']
         byAtom[ATOM]['Full'] = i
         byAtom[ATOM]['Conc'] = v['Conc']
-        byAtom[ATOM]['Mass'] = np.array(list(map(int,ATOM))).sum()
-        byAtom[ATOM]['Subs'] = '-'.join(filter(None, [uEl(element, int(number)) for element, number in zip(siteElements, ATOM)]))
+        byAtom[ATOM]['Mass'] = mass
+        byAtom[ATOM]['Subs'] = subLabels[subId]
     
     return byAtom
 
+def fullStringsToCodes(fullKeys):
+    '''
+    Gives the isotope code array and ATOM strings for a list of "expanded" string depictions, i.e. '00(0, 1)0', without calling condenseStr on each. All isotopologues of a molecule have the same layout of parentheses and commas, so the digits sit in the same character positions of every string; these positions are found once and read out of all strings together. 
+
+    Inputs:
+        fullKeys: A list of strings, the "expanded" depictions of isotopologues of a single molecule. 
+
+    Outputs:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8.
+        ATOMStrings: A list of strings, the ATOM depiction of each isotopologue. 
+    '''
+    length = len(fullKeys[0])
+    if any(len(key) != length for key in fullKeys):
+        isotopeCodes = np.array([list(map(int, condenseStr(key))) for key in fullKeys], dtype = np.uint8)
+        return isotopeCodes, [condenseStr(key) for key in fullKeys]
+
+    charArray = np.frombuffer(''.join(fullKeys).encode('ascii'), dtype = np.uint8).reshape(len(fullKeys), length)
+    digitPositions = np.nonzero((charArray[0] >= ord('0')) & (charArray[0] <= ord('9')))[0]
+    digitChars = np.ascontiguousarray(charArray[:, digitPositions])
+
+    isotopeCodes = digitChars - np.uint8(ord('0'))
+    ATOMStrings = np.char.decode(digitChars.view('S' + str(len(digitPositions))).ravel(), 'ascii').tolist()
+
+    return isotopeCodes, ATOMStrings
+
 def calcSubDictionary(isotopologueConcentrationDict, molecularDataFrame, atomInput = False):
     '''
     Similar to the "byAtom" dictionary, a more complete depiction of all isotopologues of a molecule. In this case, rather than index in by ATOM string, index in by substitution--i.e., the key '17O' gives information for all isotopologues with the substituion '17O'. This is a better way to index into this information for certain mass spectrometry experiments, e.g. a molecular average measurement of the ratio between two substitutions. 
@@ -386,7 +1147,16 @@ def calcSubDictionary(isotopologueConcentrationDict, molecularDataFrame, atomInp
         
     Outputs: 
         bySub: A new dictionary containing giving the same information as the ATOM dictionary but indexed via substitution. 
+
+    The input may also be a stream of isotopologue table chunks (see isotopologueTable.iterIsotopologueChunks), in which case only the totals are kept; see subTotalsFromChunks. 
     '''
+    if not isinstance(isotopologueConcentrationDict, collections.abc.Mapping):
+        return subTotalsFromChunks(isotopologueConcentrationDict)
+
+    #A view of an isotopologue table, which is grouped by substitution via its integer class ids
+    if atomInput and hasattr(isotopologueConcentrationDict, 'substitutionIndex'):
+        return isotopologueConcentrationDict.substitutionIndex().subDictionary()
+
     siteElements = strSiteElements(molecularDataFrame)
     if atomInput == False:
         bySub = {}
@@ -415,7 +1185,128 @@ def calcSubDictionary(isotopologueConcentrationDict, molecularDataFrame, atomInp
                 
     return bySub
 
-def inputToAtomDict(molecularDataFrame, disable = False, M1Only = False):
+def subTotalsFromChunks(chunks):
+    '''
+    Accumulates the "bySub" totals over a stream of isotopologue table chunks, holding one chunk at a time. Lists of every "Full" and "ATOM" string would grow with the size of the molecule, so only the 'Number' and 'Conc' of each substitution are kept, with its cardinal mass as a one-entry 'Mass' list, the same form as calcSubTotals. 
+    
+    Inputs:
+        chunks: An iterable of isotopologue tables (see isotopologueTable.IsotopologueTable), or a single table. 
+        
+    Outputs:
+        bySub: A dictionary where keys are substitutions and values are dictionaries giving the 'Number', 'Conc', and 'Mass' of all isotopologues with that substitution. 
+    '''
+    if hasattr(chunks, 'isotopeCodes'):
+        chunks = [chunks]
+
+    bySub = {}
+    for chunk in chunks:
+        nClasses = len(chunk.subLabels)
+        numberByClass = np.zeros(nClasses, dtype = np.int64)
+        np.add.at(numberByClass, chunk.subIds, chunk.number)
+        concByClass = np.bincount(chunk.subIds, weights = chunk.conc, minlength = nClasses)
+        massByClass = np.zeros(nClasses, dtype = np.int64)
+        massByClass[chunk.subIds] = chunk.mass
+
+        for classId in np.unique(chunk.subIds):
+            Subs = chunk.subLabels[classId]
+            if Subs not in bySub:
+                bySub[Subs] = {'Number': 0, 'Conc': 0, 'Mass': [int(massByClass[classId])]}
+            bySub[Subs]['Number'] += int(numberByClass[classId])
+            bySub[Subs]['Conc'] += concByClass[classId]
+
+    return bySub
+
+def subMass(sub):
+    '''
+    Gives the cardinal mass difference of a substitution string, e.g. 2 for '13C-D' or '18O'. 
+    
+    Inputs:
+        sub: A substitution string, as used to key the "bySub" dictionary. 
+        
+    Outputs:
+        mass: An int, the cardinal mass difference. 
+    '''
+    mass = 0
+    for label in filter(None, sub.split('-')):
+        mass += ir.LABEL_CARDINAL_MASSES[label]
+
+    return mass
+
+def massPopulationTotals(molecularDataFrame, massThreshold = 4):
+    '''
+    Calculates the total concentration of the M0, M1, ..., M+massThreshold populations without enumerating any isotopologues. Under the stochastic assumption, the concentration of each population is a coefficient of the product of one polynomial per site, where the coefficient of x^m in the polynomial for an atom is the concentration of its isotope with cardinal mass m. A site with n atoms contributes the n-th power of this polynomial. 
+    
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        massThreshold: An int, the highest cardinal mass difference to calculate. 
+        
+    Outputs:
+        populations: A dictionary where the keys are "M0", "M1", etc. and values are the total concentrations of those populations. 
+    '''
+    concentrationArray = np.array(siteSpecificConcentrations(molecularDataFrame))
+    numberAtSite = molecularDataFrame['Number'].values
+
+    moleculePolynomial = np.zeros(massThreshold + 1)
+    moleculePolynomial[0] = 1
+    for siteIndex, n in enumerate(numberAtSite):
+        atomPolynomial = concentrationArray[:massThreshold + 1, siteIndex]
+        for atom in range(n):
+            moleculePolynomial = np.convolve(moleculePolynomial, atomPolynomial)[:massThreshold + 1]
+
+    populations = {'M' + str(i): moleculePolynomial[i] for i in range(massThreshold + 1)}
+
+    return populations
+
+def calcSubTotals(molecularDataFrame, massThreshold = 4, subList = []):
+    '''
+    Calculates the total number and concentration of each substitution, i.e. the "Number" and "Conc" entries of the "bySub" dictionary, directly from the site-specific concentrations. This is the polynomial product of massPopulationTotals, tracking which substitutions each term includes: we add one site at a time, and each partial substitution string (e.g. '13C-D' so far) carries its concentration forward. As the substitution string for an isotopologue lists its substitutions in order of position, the strings are extended site by site. Strings above the mass threshold are dropped as we go, so only the few dozen substitutions of interest are ever stored. 
+    
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        massThreshold: An int. Substitutions with cardinal mass change above this are not calculated unless they are given in subList. 
+        subList: A list of substitutions (e.g. '13C', '13C-D'). If given, calculates up to the mass of the heaviest substitution in the list, rather than up to massThreshold. 
+        
+    Outputs:
+        bySub: A dictionary where keys are substitutions and values are dictionaries giving the 'Number' and 'Conc' of all isotopologues with that substitution, and their cardinal mass 'Mass'. 'Mass' is given as a one-entry list so that the output has the same form as calcSubDictionary for fas.UValueMeasurement. 
+    '''
+    if subList != []:
+        massThreshold = max(subMass(sub) for sub in subList)
+
+    siteIsotopes, multinomialCoeff = calculateSetsOfSiteIsotopes(molecularDataFrame)
+    concentrationArray = siteSpecificConcentrations(molecularDataFrame)
+    elIDs = molecularDataFrame['IDS'].values
+
+    #Each partial substitution, as a tuple of labels, keyed to [number, concentration, mass]
+    partial = {(): [1, 1, 0]}
+    for siteIndex, (isotopes, coefficients) in enumerate(zip(siteIsotopes, multinomialCoeff)):
+        element = elIDs[siteIndex]
+
+        options = []
+        for isotope, coefficient in zip(isotopes, coefficients):
+            atoms = isotope if type(isotope) == tuple else (isotope,)
+            number = coefficient[0] if type(coefficient) == list else coefficient
+            conc = number * np.prod([concentrationArray[cardinalMass][siteIndex] for cardinalMass in atoms])
+            labels = tuple(filter(None, [uEl(element, cardinalMass) for cardinalMass in atoms]))
+            options.append((labels, number, conc, sum(atoms)))
+
+        extended = {}
+        for labels, (number, conc, mass) in partial.items():
+            for siteLabels, siteNumber, siteConc, siteMass in options:
+                if mass + siteMass <= massThreshold:
+                    key = labels + siteLabels
+                    if key not in extended:
+                        extended[key] = [0, 0, mass + siteMass]
+                    extended[key][0] += number * siteNumber
+                    extended[key][1] += conc * siteConc
+        partial = extended
+
+    bySub = {}
+    for labels, (number, conc, mass) in partial.items():
+        bySub['-'.join(labels)] = {'Number': number, 'Conc': conc, 'Mass': [mass]}
+
+    return bySub
+
+def inputToAtomDict(molecularDataFrame, disable = False, M1Only = False, maxMass = None):
     '''
     A function wrapper to combine several of the basic tasks leading to construction of the isotopologue dictionary. If you are trying to understand how this works, run each of these functions individually. 
     
@@ -423,6 +1314,7 @@ def inputToAtomDict(molecularDataFrame, disable = False, M1Only = False):
         molecularDataFrame: A dataFrame containing information about the molecule.
         disable: If True, disables tqdm progress bars for the dictionary calculations (which can be time-intensive). 
         M1Only: If True, only calculates the M+1 population. 
+        maxMass: An int or None. If an int, only calculates isotopologues with cardinal mass difference up to maxMass; use this when only the M0...M+maxMass populations will be selected via massSelections. 
     
     Outputs: 
         byAtom: A dictionary where keys are "ATOM strings" (i.e. '0000100010') corresponding to different isotopologues and values are dictionaries, listing information about the concentration, number, composition, etc. of those isotopologues. 
@@ -431,7 +1323,7 @@ def inputToAtomDict(molecularDataFrame, disable = False, M1Only = False):
         print("Calculating Isotopologue Concentrations")
     siteElements = strSiteElements(molecularDataFrame)
     siteIsotopes, multinomialCoeff = calculateSetsOfSiteIsotopes(molecularDataFrame)
-    bigA, SN = calcAllIsotopologues(siteIsotopes, multinomialCoeff, M1Only = M1Only)
+    bigA, SN = calcAllIsotopologues(siteIsotopes, multinomialCoeff, M1Only = M1Only, maxMass = maxMass)
     concentrationArray = siteSpecificConcentrations(molecularDataFrame)
     d = calculateIsotopologueConcentrations(bigA, SN, concentrationArray, disable = disable)
 
@@ -441,12 +1333,46 @@ def inputToAtomDict(molecularDataFrame, disable = False, M1Only = False):
     
     return byAtom
 
+def inputToSparseDict(molecularDataFrame, maxMass = 3):
+    '''
+    The sparse counterpart of inputToAtomDict, for molecules too large for ATOM strings. Calculates the isotopologues with cardinal mass difference up to maxMass, keyed by their substitutions (see calcSparseIsotopologues) rather than by ATOM strings. 
+
+    An example entry for a singly deuterated isotopologue:
+
+    ((20, 1),): {'Number': 3, 'Conc': 0.00043, 'Mass': 1, 'Subs': 'D'}
+
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        maxMass: An int, the highest cardinal mass difference to include. 
+
+    Outputs:
+        bySparse: A dictionary where keys are tuples of (position, cardinal mass) pairs and values are dictionaries giving the number, concentration, mass and substitutions of each isotopologue. 
+    '''
+    siteElements = strSiteElements(molecularDataFrame)
+    siteIsotopes, multinomialCoeff = calculateSetsOfSiteIsotopes(molecularDataFrame)
+    setOfSparseIsotopologues, symmetryNumbers = calcSparseIsotopologues(siteIsotopes, multinomialCoeff, maxMass)
+
+    concentrationArray = siteSpecificConcentrations(molecularDataFrame)
+    atomSites = atomSiteIndices(molecularDataFrame['Number'].values)
+    concentrations = sparseConcentrations(setOfSparseIsotopologues, symmetryNumbers, concentrationArray, atomSites)
+
+    bySparse = {}
+    for substitutions, number, conc in zip(setOfSparseIsotopologues, symmetryNumbers, concentrations):
+        bySparse[substitutions] = {'Number': number,
+                                   'Conc': conc,
+                                   'Mass': sum(cardinalMass for position, cardinalMass in substitutions),
+                                   'Subs': sparseSubs(substitutions, siteElements)}
+
+    return bySparse
+
 def massSelections(atomDictionary, massThreshold = 4):
     '''
     Pulls out M0, M1, etc. populations from the ATOM dictionary, up to specified threshold. Packages them into a dictionary, where keys are "M0", "M1", etc. and values are dictionaries giving the isotopologues associated with that population. 
+
+    The ATOM dictionary need not include every isotopologue; one calculated via inputToAtomDict with maxMass = massThreshold gives the same populations without enumerating the isotopologues which are discarded here. 
     
     Inputs:
-        atomDictionary: A dictionary with information about all isotopologues, keyed by ATOM strings. The output of calcAtomDictionary.
+        atomDictionary: A dictionary with information about all isotopologues, keyed by ATOM strings. The output of calcAtomDictionary. May also be a stream of isotopologue table chunks (see isotopologueTable.iterIsotopologueChunks), which are read one at a time. For a view of an isotopologue table (see isotopologueTable.AtomDictionaryView), each population is read from the mass partition of the table, so only the selected isotopologues are visited. 
         massThreshold: An int. Does not include populations with cardinal mass difference above this threshold. 
         
     Outputs:
@@ -456,11 +1382,28 @@ def massSelections(atomDictionary, massThreshold = 4):
     
     for i in range(massThreshold+1):
         MNDict['M' + str(i)] = {}
+
+    #A view of an isotopologue table, which is already partitioned by mass
+    if hasattr(atomDictionary, 'massSelection'):
+        for i in range(massThreshold+1):
+            MNDict['M' + str(i)] = atomDictionary.massSelection(i)
+
+        return MNDict
+
+    #A stream of isotopologue table chunks; only the selected isotopologues are kept as dictionaries
+    if not isinstance(atomDictionary, collections.abc.Mapping):
+        chunks = [atomDictionary] if hasattr(atomDictionary, 'isotopeCodes') else atomDictionary
+        for chunk in chunks:
+            selected = chunk.take(chunk.mass <= massThreshold)
+            for i, v in selected.atomDictionary().items():
+                MNDict['M' + str(v['Mass'])][i] = dict(v)
+
+        return MNDict
         
     for i, v in atomDictionary.items():
-        for j in range(massThreshold+1):
-            if v['Mass'] == j:
-                MNDict['M' + str(j)][i] = v
+        MNKey = 'M' + str(v['Mass'])
+        if MNKey in MNDict:
+            MNDict[MNKey][i] = v
             
     return MNDict
 
@@ -468,7 +1411,7 @@ def introduceClump(clumpD, siteList, clumpAmount, molecularDataFrame):
     '''
     Introduce a clump between any number of sites while keeping the site-specific concentrations the same. This is a complicated operation--we must add concentration to the clumped isotopologue, remove it from the singly-substituted isotopologues, and add it to the unsubstituted isotopologue.
     
-    Note--this function only works for mass 1 substitutions. A more general function should be built for mass 2, 3, etc. 
+    Note--this function only works for mass 1 substitutions. For clumps of any mass on an isotopologue table, see it.clumpAdjustment. 
     
     Inputs:
         clumpD: a "byAtom" dictionary including all isotopologues.
@@ -513,6 +1456,62 @@ def introduceClump(clumpD, siteList, clumpAmount, molecularDataFrame):
     
     return clumpD
 
+def subCardinalMass(el, sub):
+    '''
+    The inverse of uEl; gives the cardinal mass of a substitution of some element.
+
+    Inputs:
+        el: A string, giving the element of interest
+        sub: A string identifying the isotope substitution, e.g. '18O'
+
+    Returns:
+        An int, the cardinal mass of the isotope.
+    '''
+    if sub in ir.LABEL_CARDINAL_MASSES and uEl(el, ir.LABEL_CARDINAL_MASSES[sub]) == sub:
+        return ir.LABEL_CARDINAL_MASSES[sub]
+
+    raise Exception("Substitution " + str(sub) + " is not an isotope of " + str(el))
+
+def clumpSubstitutions(siteList, molecularDataFrame, subList = None):
+    '''
+    Gives the substitutions of a clump as (position, cardinal mass) pairs, the sparse depiction of calcSparseIsotopologues. Each substitution of a multiatomic site is placed at the last free position of that site, as this is how the isotopologues of multiatomic sites are indexed (see multiatomicSiteIsotopes); a site may be listed more than once, e.g. for a D-D clump on a methyl group. 
+
+    Inputs:
+        siteList: A list of sites to introduce a clump at, e.g. ['Ccarboxyl','Ocarboxyl']
+        molecularDataFrame: The initial molecular info dataFrame. 
+        subList: A list of substitutions, one for each site, e.g. ['13C','18O']. If None, uses the mass 1 substitution of each site. 
+
+    Outputs:
+        A tuple of (position, cardinal mass) pairs, sorted by position. 
+    '''
+    siteNames = list(molecularDataFrame.index)
+    siteNumber = list(molecularDataFrame.Number)
+    siteIDs = list(molecularDataFrame.IDS)
+    siteStarts = np.cumsum([0] + siteNumber[:-1])
+
+    if subList is None:
+        subList = [uEl(siteIDs[siteNames.index(site)], 1) for site in siteList]
+    if len(subList) != len(siteList):
+        raise Exception("Give one substitution for each site of the clump")
+
+    massesBySite = {}
+    for site, sub in zip(siteList, subList):
+        if site not in siteNames:
+            raise Exception("Site " + str(site) + " is not in the molecular dataframe")
+        massesBySite.setdefault(site, []).append(subCardinalMass(siteIDs[siteNames.index(site)], sub))
+
+    substitutions = []
+    for site, masses in massesBySite.items():
+        siteIndex = siteNames.index(site)
+        if len(masses) > siteNumber[siteIndex]:
+            raise Exception("Site " + str(site) + " has too few atoms for this clump")
+        #Isotopes of a multiatomic site are listed in ascending order of cardinal mass, ending at its last position
+        lastPosition = siteStarts[siteIndex] + siteNumber[siteIndex]
+        for offset, cardinalMass in enumerate(sorted(masses)):
+            substitutions.append((int(lastPosition - len(masses) + offset), cardinalMass))
+
+    return tuple(sorted(substitutions))
+
 def checkClumpDelta(siteList, molecularDataFrame, clumpD, stochD):
     '''
     Checks the CAP Delta value for substitutions at some set of sites and prints these. 
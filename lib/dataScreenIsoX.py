@@ -3,11 +3,8 @@ import pandas as pd
 import matplotlib.pyplot as plt
 import seaborn as sns
 import dataAnalyzerMNIsoX as dA
+import isotopeRegistry as ir
 from tqdm import tqdm
-    
-SUB_MASS_DICT = {'d':1.00627674587,'15n':0.997034886,'13c':1.003354835,
-                   'unsub':0,'33s':0.999387735,'34s':1.995795825,'36s':3.995009525,
-                  '18o':2.0042449924,'17o':1.0042171364}
 
 def RSESNScreen(rtnAllFilesDF, MNRelativeAbundance = False, threshold = 2):
     '''
@@ -67,11 +64,14 @@ def getThisSubMass(subKey):
     '''
     computedMass = 0
     thisSubs = subKey.split('-')
+    #Substitutions may be given in any case, e.g. '13c' or 'Unsub'
+    massChanges = {label.lower(): massChange for label, massChange in ir.LABEL_MASS_CHANGES.items()}
+    massChanges['unsub'] = 0
 
     #Find the increase in mass due to substitutions
     for sub in thisSubs:
         try:
-            computedMass += SUB_MASS_DICT[sub.lower()]
+            computedMass += massChanges[sub.lower()]
         except:
             print("Could not look up substitution " + sub + " correctly.")
             computedMass += 0
@@ -1,8 +1,12 @@
+import collections.abc
+
 import numpy as np
 import pandas as pd
+import scipy.sparse
 
 import basicDeltaOperations as op
 import calcIsotopologues as ci
+import isotopeRegistry as ir
 
 '''
 This code extracts the concentrations of isotopologues of interest from the dictionary of all isotopologues   
@@ -12,19 +16,7 @@ outcome of fragment measurements.
 It assumes one has access to a dictionary with information about the isotopologues. See calcIsotopologues.py. 
 '''
 
-#Gives an easy way to recover an isotope from an element and its cardinal mass representation. 
-subDict = {'C':{'0':'','1':'13C'},
-           'N':{'0':'','1':'15N'},
-           'H':{'0':'','1':'D'},
-           'O':{'0':'','1':'17O','2':'18O'},
-           'S':{'0':'','1':'33S','2':'34S','4':'36S'}}
-
-#An easy way to recover the mass of an isotope from an element and its cardinal mass representation
-massDict = {'C':{'0':12,'1':13.00335484},
-            'N':{'0':14.003074,'1':15.00010889},
-            'H':{'0':1.007825032,'1':2.014101778},
-            'O':{'0':15.99491462,'1':16.99913175,'2':17.9991596},
-            'S':{'0':31.97207117,'1':32.9714589,'2':33.96786701,'4':35.9670807}}
+#The label and exact mass of an isotope are recovered from its element and cardinal mass representation via the isotope registry; see isotopeRegistry.py. 
 
 def UValueMeasurement(bySub, allMeasurementInfo, massThreshold = 3, subList = []):
     '''
@@ -53,6 +45,23 @@ def UValueMeasurement(bySub, allMeasurementInfo, massThreshold = 3, subList = []
     return allMeasurementInfo
     
 
+def UValueMeasurementFromSites(molecularDataFrame, allMeasurementInfo, massThreshold = 3, subList = []):
+    '''
+    Simulates measurements with no fragmentation, as UValueMeasurement, but computes the concentration of each substitution directly from the site-specific concentrations (see ci.calcSubTotals) rather than from a "bySub" dictionary. No isotopologues are enumerated, so this is fast even for large molecules. Assumes the stochastic distribution; if clumps have been added to the isotopologues, use UValueMeasurement. 
+    
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        allMeasurementInfo: A dictionary containing information from many types of measurements. 
+        massThreshold: A mass cutoff; isotopologues with cardinal mass change above this will not be included unless indicated in subList. 
+        subList: A list giving specific substitutions to calculate U values for ('13C', '15N', etc.). If substitutions are given, calculates U values only for these substitutions. Otherwise, calculates all U values below the mass threshold. 
+        
+    Outputs:
+        allMeasurementInfo: A dictionary, updated to include information from direct measurements.
+    '''
+    bySub = ci.calcSubTotals(molecularDataFrame, massThreshold = massThreshold, subList = subList)
+    
+    return UValueMeasurement(bySub, allMeasurementInfo, massThreshold = massThreshold, subList = subList)
+
 def fragMult(z, y):
     '''
     Fragments an individual site of an isotopologue. z should be 1 or 'x'. 
@@ -114,39 +123,236 @@ def fragmentIsotopologueDict(atomIsotopologueDict, atomFrag, relContribution = 1
     Applies the same fragmentation vector to all isotopologues of an input isotopologue dict and stores the results. This operation corresponds to the "fragmentation" operation from the M+N paper. Combines isotopologues which fragment to yield the same product. For the version which does track, see "fragmentAndTrackIsotopologues"
     
     Inputs:
-        atomIsotopologueDict: A dictionary containing some set of isotopologues, often a M1, M2, ... set, keyed by their ATOM depiction. 
+        atomIsotopologueDict: A dictionary containing some set of isotopologues, often a M1, M2, ... set, keyed by their ATOM depiction. May also be a stream of isotopologue table chunks; see fragmentIsotopologueChunks. 
         atomFrag: An ATOM depiction of a fragment
         relContribution: A float between 0 and 1, giving the relative contribution of this fragmentation geometry to the observed ion beam at that mass
         
     Outputs: 
         fragmentedDict: A dictionary where the keys are the ATOM isotopologues after fragmentation (i.e. "0000x") and the values are the concentrations of those isotopologues. Note that this may combine isotopologues from the input dictionary which fragment in the same way; i.e. 001 and 002 both fragment to yield "00x". 
     '''
+    if not isinstance(atomIsotopologueDict, collections.abc.Mapping):
+        return fragmentIsotopologueChunks(atomIsotopologueDict, atomFrag, relContribution = relContribution)
+
+    retained = retentionMask(atomFrag)
+    charArray, conc = populationArrays(atomIsotopologueDict, len(atomFrag))
+    if len(conc) == 0:
+        return {}
+
+    #The retained positions of every isotopologue are a masked view of the population; distinct rows are the products
+    uniqueProducts, productIndex = np.unique(charArray[:, retained], axis = 0, return_inverse = True)
+    productConc = np.bincount(productIndex.ravel(), weights = conc, minlength = len(uniqueProducts))
+
+    productChars = np.full((len(uniqueProducts), len(atomFrag)), ord('x'), dtype = np.uint8)
+    productChars[:, retained] = uniqueProducts
+    productStrings = np.char.decode(productChars.view('S' + str(len(atomFrag))).ravel(), 'ascii').tolist()
+
+    #Report products in order of their first isotopologue, as the population is read
+    firstAppearance = np.argsort(np.unique(productIndex.ravel(), return_index = True)[1], kind = 'stable')
+    fragmentedDict = {productStrings[product]: productConc[product] * relContribution for product in firstAppearance.tolist()}
+        
+    return fragmentedDict
+
+def retentionMask(atomFrag):
+    '''
+    Gives a fragment as a boolean mask over atomic positions, for fragmenting many isotopologues at once. 
+    
+    Inputs:
+        atomFrag: The ATOM depiction of the fragmentation vector
+        
+    Outputs:
+        A numpy array of booleans, True where the position is retained (1) and False where it is lost ('x'). 
+    '''
+    for z in atomFrag:
+        if z not in [1,'x']:
+            raise Exception("Cannot fragment successfully, each site must be lost ('x') or retained (1)")
+
+    return np.array([z != 'x' for z in atomFrag], dtype = bool)
+
+def populationArrays(atomIsotopologueDict, nAtoms):
+    '''
+    Reads the isotopologues of a dictionary keyed by ATOM strings into arrays: the characters of every key, one row per isotopologue, and their concentrations. 
+    
+    Inputs:
+        atomIsotopologueDict: A dictionary containing some set of isotopologues, keyed by their ATOM depiction. 
+        nAtoms: The number of atomic positions, i.e. the length of the fragment to apply. 
+        
+    Outputs:
+        charArray: A numpy array of shape (isotopologues, nAtoms) of dtype uint8, giving the ASCII character at each position of each key. 
+        conc: A numpy array giving the concentration of each isotopologue. 
+    '''
+    keys = list(atomIsotopologueDict.keys())
+    if any(len(key) != nAtoms for key in keys):
+        raise Exception("Cannot fragment successfully, as the fragment and the isotopologue you want to fragment have different lengths")
+
+    charArray = np.frombuffer(''.join(keys).encode('ascii'), dtype = np.uint8).reshape(len(keys), nAtoms)
+    conc = np.array([value['Conc'] for value in atomIsotopologueDict.values()], dtype = float)
+
+    return charArray, conc
+
+def productCodes(charArray, retained):
+    '''
+    Gives the isotope codes of the products of fragmenting a population, with lost positions set as unsubstituted, so that ci.substitutionClasses of the products gives the substitutions observed for each isotopologue. 
+    
+    Inputs:
+        charArray: A numpy array of shape (isotopologues, atoms) of ATOM characters. See populationArrays. 
+        retained: A numpy array of booleans. See retentionMask. 
+        
+    Outputs:
+        A numpy array of shape (isotopologues, atoms) of dtype uint8. 
+    '''
+    kept = retained & (charArray != ord('x'))
+
+    return np.where(kept, charArray - np.uint8(ord('0')), 0).astype(np.uint8)
+    
+def fragmentIsotopologueChunks(chunks, atomFrag, relContribution = 1):
+    '''
+    As fragmentIsotopologueDict, for a stream of isotopologue table chunks (see isotopologueTable.iterIsotopologueChunks), holding one chunk at a time. Lost positions of every isotopologue of a chunk are set to 'x' at once; the distinct products of the chunk are then found and their concentrations summed. 
+    
+    Inputs:
+        chunks: An iterable of isotopologue tables, or a single table. 
+        atomFrag: An ATOM depiction of a fragment
+        relContribution: A float between 0 and 1, giving the relative contribution of this fragmentation geometry to the observed ion beam at that mass
+        
+    Outputs: 
+        fragmentedDict: A dictionary where the keys are the ATOM isotopologues after fragmentation (i.e. "0000x") and the values are the concentrations of those isotopologues. 
+    '''
+    if hasattr(chunks, 'isotopeCodes'):
+        chunks = [chunks]
+
+    lost = ~retentionMask(atomFrag)
+
     fragmentedDict = {}
-    for isotopologue, value in atomIsotopologueDict.items():
-        newIsotopologue = fragmentOneIsotopologue(atomFrag, isotopologue)
-        if newIsotopologue not in fragmentedDict:
-            fragmentedDict[newIsotopologue] = 0
-        fragmentedDict[newIsotopologue] += (value['Conc'] * relContribution)
+    for chunk in chunks:
+        if len(atomFrag) != chunk.isotopeCodes.shape[1]:
+            raise Exception("Cannot fragment successfully, as the fragment and the isotopologue you want to fragment have different lengths")
+
+        charArray = chunk.isotopeCodes + np.uint8(ord('0'))
+        charArray[:, lost] = ord('x')
+        products = np.ascontiguousarray(charArray).view('S' + str(len(atomFrag))).ravel()
+
+        uniqueProducts, productIndex = np.unique(products, return_inverse = True)
+        productConc = np.bincount(productIndex.ravel(), weights = chunk.conc, minlength = len(uniqueProducts))
+
+        for newIsotopologue, conc in zip(np.char.decode(uniqueProducts, 'ascii').tolist(), productConc):
+            if newIsotopologue not in fragmentedDict:
+                fragmentedDict[newIsotopologue] = 0
+            fragmentedDict[newIsotopologue] += (conc * relContribution)
+
+    return fragmentedDict
+
+def fragmentSparseIsotopologue(lostPositions, substitutions):
+    '''
+    The sparse counterpart of fragmentOneIsotopologue, for isotopologues stored by their substitutions (see ci.calcSparseIsotopologues). Drops the substitutions at lost positions, so takes time proportional to the number of substitutions rather than the number of atoms. 
+    
+    Inputs:
+        lostPositions: A set of the atomic positions lost on fragmentation, i.e. those where the ATOM depiction of the fragment is 'x'. See lostAtomPositions. 
+        substitutions: A tuple of (position, cardinal mass) pairs. 
+        
+    Outputs:
+        A tuple of (position, cardinal mass) pairs, the substitutions retained in the fragment. 
+    '''
+    return tuple(substitution for substitution in substitutions if substitution[0] not in lostPositions)
+
+def lostAtomPositions(atomFrag):
+    '''
+    Gives the atomic positions lost by a fragment, for fragmentSparseIsotopologue. 
+    
+    Inputs:
+        atomFrag: The ATOM depiction of the fragmentation vector
+        
+    Outputs:
+        A frozenset of ints.
+    '''
+    for z in atomFrag:
+        if z not in [1,'x']:
+            raise Exception("Cannot fragment successfully, each site must be lost ('x') or retained (1)")
+
+    return frozenset(position for position, z in enumerate(atomFrag) if z == 'x')
+
+def fragmentSparseDict(sparseIsotopologueDict, atomFrag, relContribution = 1):
+    '''
+    The sparse counterpart of fragmentIsotopologueDict. Fragments every isotopologue of a dictionary keyed by substitutions (see ci.inputToSparseDict) and combines those which give the same product. 
+    
+    Inputs:
+        sparseIsotopologueDict: A dictionary containing some set of isotopologues, keyed by tuples of (position, cardinal mass) pairs. 
+        atomFrag: An ATOM depiction of a fragment
+        relContribution: A float between 0 and 1, giving the relative contribution of this fragmentation geometry to the observed ion beam at that mass
         
+    Outputs: 
+        fragmentedDict: A dictionary where the keys are the substitutions retained after fragmentation and the values are the concentrations of those products. 
+    '''
+    lostPositions = lostAtomPositions(atomFrag)
+
+    fragmentedDict = {}
+    for substitutions, value in sparseIsotopologueDict.items():
+        product = fragmentSparseIsotopologue(lostPositions, substitutions)
+        if product not in fragmentedDict:
+            fragmentedDict[product] = 0
+        fragmentedDict[product] += (value['Conc'] * relContribution)
+
     return fragmentedDict
+
+def computeSparseSubs(substitutions, IDs):
+    '''
+    The sparse counterpart of computeSubs. 
+    
+    Inputs:
+        substitutions: A tuple of (position, cardinal mass) pairs, e.g. the product of fragmentSparseIsotopologue. 
+        IDs: The tuple of site elements, i.e. the output of strSiteElements
+        
+    Outputs:
+        A string giving substitutions present, separated by "-". I.e. "17O-17O", or "Unsub" if there are none. 
+    '''
+    if substitutions == ():
+        return "Unsub"
+
+    return '-'.join(ir.isotopeLabel(IDs[position], cardinalMass) for position, cardinalMass in substitutions)
+
+def computeSparseMass(substitutions, IDs, baseMass):
+    '''
+    The sparse counterpart of computeMass. The exact mass of the unsubstituted fragment is calculated once (see fragmentBaseMass); each substitution then adds the mass difference between its isotope and the unsubstituted one. 
+    
+    Inputs:
+        substitutions: A tuple of (position, cardinal mass) pairs, e.g. the product of fragmentSparseIsotopologue. 
+        IDs: The tuple of site elements, i.e. the output of strSiteElements
+        baseMass: A float, the exact mass of the unsubstituted fragment. 
+        
+    Outputs:
+        mass: A float, giving the exact mass of the fragment. 
+    '''
+    mass = baseMass
+    for position, cardinalMass in substitutions:
+        mass += ir.LABEL_MASS_CHANGES[ir.isotopeLabel(IDs[position], cardinalMass)]
+
+    return mass
+
+def fragmentBaseMass(atomFrag, IDs):
+    '''
+    Gives the exact mass of the unsubstituted isotopologue of a fragment, for computeSparseMass. 
     
+    Inputs:
+        atomFrag: The ATOM depiction of the fragmentation vector
+        IDs: The tuple of site elements, i.e. the output of strSiteElements
+        
+    Outputs:
+        A float.
+    '''
+    return computeMass(''.join('x' if z == 'x' else '0' for z in atomFrag), IDs)
+
 def computeSubs(isotopologue, IDs):
     '''
     Given an ATOM depiction of an isotopologue, computes which substitutions are present. 
     
     Inputs:
         isotopologue: The ATOM string depiction of an isotopologue
-        IDs: The string of site elements, i.e. the output of strSiteElements
+        IDs: The tuple of site elements, i.e. the output of strSiteElements
         
     Outputs:
         A string giving substitutions present in that isotopologue, separated by "-". I.e. "17O-17O"
     '''
-    subs = []
-    for i in range(len(isotopologue)):
-        if isotopologue[i] != 'x':
-            element = IDs[i]
-            if subDict[element][str(isotopologue[i])] != '':
-                subs.append(subDict[element][str(isotopologue[i])])
+    elementCodes, isotopeCodes = atomCodes(isotopologue, IDs)
+    labelIds = ir.LABEL_IDS[elementCodes, isotopeCodes]
+    subs = [ir.LABELS[labelId] for labelId in labelIds if labelId != 0]
                 
     if subs == []:
         return "Unsub"
@@ -159,18 +365,164 @@ def computeMass(isotopologue, IDs):
     
     Inputs:
         isotopologue: A string, the ATOM depiction of an isotopologue.
-        IDs: A string, the ATOM depiction of element IDs.
+        IDs: A tuple giving the element at each position, i.e. the output of strSiteElements.
         
     Outputs:
         mass: A float, giving the exact mass of the isotopologue. 
     '''
-    mass = 0
-    for i in range(len(isotopologue)):
-        if isotopologue[i] != 'x':
-            element = IDs[i]
-            mass += massDict[element][str(isotopologue[i])]
+    elementCodes, isotopeCodes = atomCodes(isotopologue, IDs)
         
-    return mass
+    return float(ir.exactMasses(elementCodes, isotopeCodes))
+
+def atomCodes(isotopologue, IDs):
+    '''
+    Gives the element and isotope codes (see isotopeRegistry.py) of the positions of an ATOM string which are not lost to fragmentation, i.e. not 'x'. 
+    
+    Inputs:
+        isotopologue: A string, the ATOM depiction of an isotopologue, possibly fragmented. 
+        IDs: A tuple giving the element at each position, i.e. the output of strSiteElements.
+        
+    Outputs:
+        elementCodes: A numpy array giving the element code of each retained position. 
+        isotopeCodes: A numpy array giving the cardinal mass of the isotope at each retained position. 
+    '''
+    characters = np.frombuffer(isotopologue.encode(), dtype = np.uint8)
+    retained = characters != ord('x')
+
+    return ir.elementCodes(IDs)[retained], characters[retained] - ord('0')
+
+class FragmentIncidence:
+    '''
+    The mapping from the isotopologues of an M+N population to the ion beams they are observed in, as a sparse matrix. Row i is the beam beams[i], a (fragment, substitution) pair, e.g. ('44_01', '13C'); column j is isotopologue j of the population; entry [i][j] is the relative contribution of the fragment if isotopologue j is observed in beam i, and 0 otherwise. It depends only on the isotopologues and the fragmentation, not on their concentrations, so is compiled once (see compileFragmentIncidence and isotopologueIncidence) and reused. 
+
+    The abundance of every beam is then a single sparse matrix-vector product with the concentrations (see predict), and the composition matrix of the solver is a slice of its rows (see compositionMatrix). 
+
+    Attributes:
+        matrix: A scipy.sparse csr matrix of shape (beams, isotopologues).
+        beams: A list of (fragment, substitution) pairs, one for each row. 
+        isotopologues: A list of the isotopologues of the population, one for each column, e.g. ATOM strings. 
+    '''
+    def __init__(self, matrix, beams, isotopologues):
+        self.matrix = matrix.tocsr()
+        self.beams = beams
+        self.isotopologues = isotopologues
+        self.beamIndex = {beam: row for row, beam in enumerate(beams)}
+
+    def predict(self, conc):
+        '''
+        Gives the absolute abundance of every beam.
+
+        Inputs:
+            conc: A numpy array giving the concentration of each isotopologue; or of shape (isotopologues, scenarios) for many scenarios at once. 
+
+        Outputs:
+            A numpy array with one entry (or row) per beam. 
+        '''
+        return self.matrix @ conc
+
+    def fragmentRows(self, fragKey):
+        '''
+        Gives the rows of the beams of one fragment, in order. 
+        '''
+        return [row for row, beam in enumerate(self.beams) if beam[0] == fragKey]
+
+    def combined(self):
+        '''
+        Combines fragments with multiple subgeometries, as combineFragmentSubgeometries; i.e. the beams ('82_01', '13C') and ('82_02', '13C') are summed to give ('82', '13C'). 
+
+        Outputs:
+            A FragmentIncidence.
+        '''
+        combinedIndex = {}
+        combinedRows = [combinedIndex.setdefault((fragKey.split('_')[0], sub), len(combinedIndex)) for fragKey, sub in self.beams]
+        aggregate = scipy.sparse.csr_matrix((np.ones(len(self.beams)), (combinedRows, np.arange(len(self.beams)))),
+                                            shape = (len(combinedIndex), len(self.beams)))
+
+        return FragmentIncidence(aggregate @ self.matrix, list(combinedIndex), self.isotopologues)
+
+    def compositionMatrix(self, beams):
+        '''
+        Gives the rows of some beams as a dense array, e.g. to construct the composition matrix of the solver. A beam not observed from any isotopologue gives a row of zeros. 
+
+        Inputs:
+            beams: A list of (fragment, substitution) pairs. 
+
+        Outputs:
+            A numpy array of shape (len(beams), isotopologues).
+        '''
+        comp = np.zeros((len(beams), len(self.isotopologues)))
+        found = [(i, self.beamIndex[beam]) for i, beam in enumerate(beams) if beam in self.beamIndex]
+        if found:
+            positions, rows = zip(*found)
+            comp[list(positions)] = self.matrix[list(rows)].toarray()
+
+        return comp
+
+def compileFragmentIncidence(MN, atomFragList, fragSubgeometryKeys, fragmentationDictionary, siteElements):
+    '''
+    Compiles the FragmentIncidence of an M+N population from its isotopologues, with one row per fragment subgeometry and substitution, in the order the substitutions first appear. Unresolved peaks are not combined; see computeMNRelAbundances. 
+
+    Inputs:
+        MN: A dictionary containing the isotopologues of a mass selection, keyed by their ATOM depiction. 
+        atomFragList: A list of expanded fragments, one for each subgeometry. See expandFrags function.
+        fragSubgeometryKeys: A list of strings, indicating the identity of each fragment subgeometry. I.e. ['54_01','42_01']
+        fragmentationDictionary: A dictionary giving information about the fragments, their subgeometries and relative contributions. See predictMNFragmentExpt. 
+        siteElements: A tuple giving the chemical element by position, i.e. the output of ci.strSiteElements
+
+    Outputs:
+        incidence: A FragmentIncidence, with columns in the order of MN. 
+        conc: A numpy array giving the concentration of each isotopologue of MN. 
+    '''
+    nAtoms = len(atomFragList[0]) if len(atomFragList) > 0 else 0
+    charArray, conc = populationArrays(MN, nAtoms)
+    nIsotopologues = len(conc)
+
+    beams, rows, weights = [], [], []
+    for fragment, fragSubgeometryKey in zip(atomFragList, fragSubgeometryKeys):
+        if nIsotopologues == 0:
+            break
+        fragKey, fragNum = fragSubgeometryKey.split('_')
+        relContribution = fragmentationDictionary[fragKey][fragNum]['relCont']
+
+        subIds, subLabels = ci.substitutionClasses(productCodes(charArray, retentionMask(fragment)), siteElements)
+        rows.append(subIds + len(beams))
+        weights.append(np.full(nIsotopologues, relContribution, dtype = float))
+        beams += [(fragSubgeometryKey, sub if sub != '' else 'Unsub') for sub in subLabels]
+
+    columns = np.tile(np.arange(nIsotopologues), len(rows))
+    matrix = scipy.sparse.csr_matrix((np.concatenate(weights) if weights else np.zeros(0), (np.concatenate(rows) if rows else np.zeros(0, dtype = int), columns)),
+                                     shape = (len(beams), nIsotopologues))
+
+    return FragmentIncidence(matrix, beams, list(MN.keys())), conc
+
+def isotopologueIncidence(Isotopologues, fragmentationDictionary):
+    '''
+    Compiles the FragmentIncidence of an M+N population from the dataFrame of its isotopologues (see isotopologueDataFrame), which records the substitution observed for each isotopologue in each fragment subgeometry, including any unresolved peaks. Subgeometries are combined, so there is one row per fragment and substitution, as observed. Used by the solver, see ss.constructMatrix. 
+
+    Inputs:
+        Isotopologues: A dataFrame containing isotopologues and information about their fragmentation.
+        fragmentationDictionary: A dictionary giving information about the fragments, their subgeometries and relative contributions. See predictMNFragmentExpt. 
+
+    Outputs:
+        A FragmentIncidence, with columns in the order of Isotopologues. 
+    '''
+    nIsotopologues = len(Isotopologues.index)
+
+    beamIndex = {}
+    rows, weights = [], []
+    for fragKey, fragInfo in fragmentationDictionary.items():
+        for subFrag, subFragInfo in fragInfo.items():
+            subCodes, subs = pd.factorize(Isotopologues[fragKey + '_' + subFrag + ' Subs'])
+            beamRows = np.array([beamIndex.setdefault((fragKey, sub), len(beamIndex)) for sub in subs], dtype = int)
+            rows.append(beamRows[subCodes])
+            weights.append(np.full(nIsotopologues, subFragInfo['relCont'], dtype = float))
+
+    #Entries for the same beam and isotopologue from different subgeometries are summed
+    columns = np.tile(np.arange(nIsotopologues), len(rows))
+    matrix = scipy.sparse.csr_matrix((np.concatenate(weights) if weights else np.zeros(0), (np.concatenate(rows) if rows else np.zeros(0, dtype = int), columns)),
+                                     shape = (len(beamIndex), nIsotopologues))
+
+    return FragmentIncidence(matrix, list(beamIndex), list(Isotopologues.index))
 
 def predictMNFragmentExpt(allMeasurementInfo, MNDict, atomFragList, fragSubgeometryKeys, molecularDataFrame, fragmentationDictionary, abundanceThreshold = 0, omitMeasurements = {}, fractionationFactors = {}, calcFF = False, ffstd = 0.05, randomseed = 25, unresolvedDict = {}, outputFull = False):
     '''
@@ -190,7 +542,7 @@ def predictMNFragmentExpt(allMeasurementInfo, MNDict, atomFragList, fragSubgeome
         fractionationFactors: A dictionary, specifying a fractionation factor to apply to each ion beam. This is used to apply fractionation factors calculated previously to this predicted measurement (e.g. for a sample/standard comparison with the same experimental fractionation). 
         calcFF: A boolean, specifying whether new fractionation factors should be calculated via this function. If True, fractionFactors should be left empty. 
         ffstd: A float. If new fractionation factors are calculated, they are generated from a normal distribution with mean 1 and standard deviation of ffstd. 
-        randomseed: An integer. If new fractionation factors are calculated, we initialize this random seed; this allows us to generate the same factors if we run multiple times. 
+        randomseed: An integer. If new fractionation factors are calculated, they are drawn from a random state initialized with this seed; this allows us to generate the same factors if we run multiple times. The global numpy random state is not reseeded. 
         unresolvedDict: A dictionary, specifying which unresolved ion beams add to each other. 
         outputFull: A boolean. Typically False, in which case beams that are not observed are culled from the dictionary. If True, includes this information; this should only be used for debugging, and will likely break the solver routine. 
         
@@ -200,7 +552,8 @@ def predictMNFragmentExpt(allMeasurementInfo, MNDict, atomFragList, fragSubgeome
     '''
     calculatedFF = {}
     siteElements = ci.strSiteElements(molecularDataFrame)
-    np.random.seed(randomseed)
+    #A legacy RandomState gives the same factors as seeding the global state did, without resetting the draws of other routines
+    randomState = np.random.RandomState(randomseed)
     #For each population (M1, M2, M3) that we mass select
     for massSelection, MN in MNDict.items():
         #add a key to output dictionary
@@ -210,6 +563,11 @@ def predictMNFragmentExpt(allMeasurementInfo, MNDict, atomFragList, fragSubgeome
         if calcFF == True:
             calculatedFF[massSelection] = {}
 
+        #Which beam each isotopologue is observed in is found once for all fragments; the abundance of every beam is then one product
+        if isinstance(MN, collections.abc.Mapping):
+            incidence, conc = compileFragmentIncidence(MN, atomFragList, fragSubgeometryKeys, fragmentationDictionary, siteElements)
+            beamAbundances = incidence.predict(conc)
+
         #For each fragment we will observe
         for j, fragment in enumerate(atomFragList):
 
@@ -220,25 +578,18 @@ def predictMNFragmentExpt(allMeasurementInfo, MNDict, atomFragList, fragSubgeome
             if calcFF == True:
                 calculatedFF[massSelection][fragSubgeometryKeys[j]] = {}
  
-            #fragment the mass selection accordingly 
-            fragKey, fragNum = fragSubgeometryKeys[j].split('_')
-            relContribution = fragmentationDictionary[fragKey][fragNum]['relCont']
-            fragmentedIsotopologues = fragmentIsotopologueDict(MN, fragment, relContribution = relContribution)
-
             #compute the absolute abundance of each substitution
-            predictSpectrum = {}
-
-            for key, item in fragmentedIsotopologues.items():
-                sub = computeSubs(key, siteElements)
-                    
-                if sub not in predictSpectrum:
-                    predictSpectrum[sub] = {'Abs. Abundance':0}
-                predictSpectrum[sub]['Abs. Abundance'] += item
+            if isinstance(MN, collections.abc.Mapping):
+                predictSpectrum = {incidence.beams[row][1]: {'Abs. Abundance': beamAbundances[row]} for row in incidence.fragmentRows(fragSubgeometryKeys[j])}
+            else:
+                fragKey, fragNum = fragSubgeometryKeys[j].split('_')
+                relContribution = fragmentationDictionary[fragKey][fragNum]['relCont']
+                predictSpectrum = fragmentSpectrum(MN, fragment, siteElements, relContribution = relContribution)
             
             #Fractionate
             if calcFF == True:
                 for sub in predictSpectrum.keys():
-                    ff = np.random.normal(1,ffstd)
+                    ff = randomState.normal(1,ffstd)
                     calculatedFF[massSelection][fragSubgeometryKeys[j]][sub] = ff
                     predictSpectrum[sub]['Abs. Abundance'] *= ff
             
@@ -254,6 +605,102 @@ def predictMNFragmentExpt(allMeasurementInfo, MNDict, atomFragList, fragSubgeome
                              
     return allMeasurementInfo, calculatedFF
 
+def fragmentSpectrum(MN, atomFrag, siteElements, relContribution = 1):
+    '''
+    Fragments a mass selected population and gives the absolute abundance of each observed substitution. The fragment is applied to the whole population at once as a mask over its isotope codes; the substitution observed for each isotopologue follows from ci.substitutionClasses and the abundance of each from a single bincount. 
+    
+    Inputs:
+        MN: A dictionary containing the isotopologues of a mass selection, keyed by their ATOM depiction. May also be a stream of isotopologue table chunks. 
+        atomFrag: An ATOM depiction of a fragment
+        siteElements: A tuple giving the chemical element by position, i.e. the output of ci.strSiteElements
+        relContribution: A float between 0 and 1, giving the relative contribution of this fragmentation geometry to the observed ion beam at that mass
+        
+    Outputs:
+        predictSpectrum: A dictionary where the keys are substitutions ('13C', 'Unsub') and values are dictionaries giving their 'Abs. Abundance'. 
+    '''
+    predictSpectrum = {}
+    if not isinstance(MN, collections.abc.Mapping):
+        for key, item in fragmentIsotopologueChunks(MN, atomFrag, relContribution = relContribution).items():
+            sub = computeSubs(key, siteElements)
+            if sub not in predictSpectrum:
+                predictSpectrum[sub] = {'Abs. Abundance':0}
+            predictSpectrum[sub]['Abs. Abundance'] += item
+
+        return predictSpectrum
+
+    retained = retentionMask(atomFrag)
+    charArray, conc = populationArrays(MN, len(atomFrag))
+    if len(conc) == 0:
+        return predictSpectrum
+
+    subIds, subLabels = ci.substitutionClasses(productCodes(charArray, retained), siteElements)
+    subConc = np.bincount(subIds, weights = conc, minlength = len(subLabels))
+
+    for sub, abundance in zip(subLabels, subConc):
+        predictSpectrum[sub if sub != '' else 'Unsub'] = {'Abs. Abundance': abundance * relContribution}
+
+    return predictSpectrum
+
+def predictMNFragmentBatch(isotopologues, concMatrix, atomFragList, fragSubgeometryKeys, fragmentationDictionary, massThreshold = 1, fractionationFactors = {}):
+    '''
+    Predicts M+N experiments for many scenarios at once, e.g. from the concentrations of an isotopologue table evaluated for many sets of deltas (see isotopologueTable.IsotopologueTable.evaluateBatch). Which ion beam each isotopologue contributes to for each fragment does not depend on the concentrations; this is found once, and the abundance of every beam in every scenario is then a sum over columns of concMatrix. 
+
+    Gives the absolute and relative abundances of every ion beam, in the form of predictMNFragmentExpt but with an array over scenarios in place of each float. Abundance thresholds, omitted measurements and unresolved peaks are not applied; these decide which beams are observed, so should be applied when a single scenario is simulated via predictMNFragmentExpt. 
+
+    Inputs:
+        isotopologues: An IsotopologueTable.
+        concMatrix: A numpy array of shape (scenarios, isotopologues), giving the concentration of each isotopologue of the table in each scenario. 
+        atomFragList: A list of expanded fragments, one for each subgeometry, e.g. [[1, 1, 1, 1, 'x'], ['x', 1, 1, 1, 'x']]. See expandFrags function.
+        fragSubgeometryKeys: A list of strings, indicating the identity of each fragment subgeometry. I.e. ['54_01','42_01']
+        fragmentationDictionary: A dictionary giving information about the fragments, their subgeometries and relative contributions. See predictMNFragmentExpt. 
+        massThreshold: An int; predicts the M0, M1, ..., M+massThreshold experiments. 
+        fractionationFactors: A dictionary, specifying a fractionation factor to apply to each ion beam, as in predictMNFragmentExpt. 
+
+    Outputs:
+        allMeasurementInfo: A dictionary where allMeasurementInfo['M1']['44']['13C'] gives the 'Abs. Abundance' and 'Rel. Abundance' of that beam, each a numpy array over scenarios. 
+    '''
+    allMeasurementInfo = {}
+    for massIndex in range(massThreshold + 1):
+        massSelection = 'M' + str(massIndex)
+        allMeasurementInfo[massSelection] = {}
+        rows = np.nonzero(isotopologues.mass == massIndex)[0]
+        selectionConc = concMatrix[:, rows]
+
+        for j, fragment in enumerate(atomFragList):
+            fragKey, fragNum = fragSubgeometryKeys[j].split('_')
+            relContribution = fragmentationDictionary[fragKey][fragNum]['relCont']
+
+            #Lost positions are set as unsubstituted, so the substitution class of a row is that of its product
+            retained = np.array([z != 'x' for z in fragment])
+            productCodes = isotopologues.isotopeCodes[rows] * retained.astype(np.uint8)
+            productIds, productSubs = ci.substitutionClasses(productCodes, isotopologues.siteElements)
+
+            #Sum the columns of each product substitution at once
+            order = np.argsort(productIds, kind = 'stable')
+            starts = np.searchsorted(productIds[order], np.arange(len(productSubs)))
+            productConc = np.add.reduceat(selectionConc[:, order], starts, axis = 1) if len(rows) > 0 else np.zeros((len(concMatrix), 0))
+
+            if fragKey not in allMeasurementInfo[massSelection]:
+                allMeasurementInfo[massSelection][fragKey] = {}
+            fragmentData = allMeasurementInfo[massSelection][fragKey]
+
+            for classIndex, sub in enumerate(productSubs):
+                sub = sub if sub != '' else 'Unsub'
+                abundance = productConc[:, classIndex] * relContribution
+                if fractionationFactors != {}:
+                    abundance = abundance * fractionationFactors[massSelection][fragSubgeometryKeys[j]][sub]
+
+                if sub not in fragmentData:
+                    fragmentData[sub] = {'Abs. Abundance':0}
+                fragmentData[sub]['Abs. Abundance'] = fragmentData[sub]['Abs. Abundance'] + abundance
+
+        for fragKey, fragmentData in allMeasurementInfo[massSelection].items():
+            totalAbundance = sum(subData['Abs. Abundance'] for subData in fragmentData.values())
+            for sub, subData in fragmentData.items():
+                subData['Rel. Abundance'] = subData['Abs. Abundance'] / totalAbundance
+
+    return allMeasurementInfo
+
 def combineFragmentSubgeometries(allMeasurementInfo, fragmentationDictionary):
     '''
     Takes fragments with multiple subgeometries and combines their measurements. For example, if frag 82 is made via 82_01 (relCont = 0.4) and 82_02 (relCont = 0.6) this function adds the values of these subfragments to give the actual measurement. 
@@ -407,22 +854,28 @@ def fragmentAndTrackIsotopologues(massSelection, atomFrag, fragmentKey, unsubCon
         massSelection: The same dictionary, updated to include information about fragmentation. 
     '''
     siteElements = ci.strSiteElements(molecularDataFrame)
-    
-    fragmentedDict = {}
-    for isotopologue, value in massSelection.items():
-        value['Stochastic U'] = value['Conc'] / unsubConc
-        frag = [fragMult(x,y) for x, y in zip(atomFrag, isotopologue)]
-        newIsotopologue = ''.join(frag)
-        massSelection[isotopologue][fragmentKey + ' Identity'] = newIsotopologue
-        
-        sub = computeSubs(newIsotopologue, siteElements)
-            
-        #If unresolved peaks are a problem
-        if fragmentKey in unresolvedDict:
-            if sub in unresolvedDict[fragmentKey]:
-                sub = unresolvedDict[fragmentKey][sub]
+    retained = retentionMask(atomFrag)
+    charArray, conc = populationArrays(massSelection, len(atomFrag))
+    if len(conc) == 0:
+        return massSelection
+
+    #Fragment the whole population at once: lost positions become 'x' in the identities and unsubstituted in the codes
+    productChars = charArray.copy()
+    productChars[:, ~retained] = ord('x')
+    identities = np.char.decode(productChars.view('S' + str(len(atomFrag))).ravel(), 'ascii').tolist()
+
+    subIds, subLabels = ci.substitutionClasses(productCodes(charArray, retained), siteElements)
+    subLabels = [sub if sub != '' else 'Unsub' for sub in subLabels]
             
-        massSelection[isotopologue][fragmentKey + ' Subs'] = sub
+    #If unresolved peaks are a problem
+    if fragmentKey in unresolvedDict:
+        subLabels = [unresolvedDict[fragmentKey].get(sub, sub) for sub in subLabels]
+
+    stochasticU = (conc / unsubConc).tolist()
+    for value, U, identity, subId in zip(massSelection.values(), stochasticU, identities, subIds.tolist()):
+        value['Stochastic U'] = U
+        value[fragmentKey + ' Identity'] = identity
+        value[fragmentKey + ' Subs'] = subLabels[subId]
         
     return massSelection
 
@@ -482,15 +935,6 @@ def predictTraditionalMeasurement(molecularDataFrame, atomFrag, byAtom):
     Outputs:
         predictSpectrum: A dictionary. Keys are subKeys (e.g., 'D-D-13C') and values are the abundances of those after fragmentation. 
     '''
-    predictSpectrum = {}
     siteElements = ci.strSiteElements(molecularDataFrame)
-    fragmentedIsotopologues = fragmentIsotopologueDict(byAtom, atomFrag, relContribution = 1)
-
-    for isoKey, isoData in fragmentedIsotopologues.items():
-        subKey = computeSubs(isoKey, siteElements)
-                    
-        if subKey not in predictSpectrum:
-            predictSpectrum[subKey] = {'Abs. Abundance':0}
-        predictSpectrum[subKey]['Abs. Abundance'] += isoData
 
-    return predictSpectrum
\ No newline at end of file
+    return fragmentSpectrum(byAtom, atomFrag, siteElements, relContribution = 1)
\ No newline at end of file
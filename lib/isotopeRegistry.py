@@ -0,0 +1,165 @@
+import functools
+
+import numpy as np
+
+'''
+A single registry of the isotopes of every element the code understands. Isotopes are indexed by an element code and an isotope code, the cardinal mass difference of the isotope from the unsubstituted one (so "1" is 13C for carbon, and "2" is 18O for oxygen). From one table of isotope data, the registry compiles numpy lookup arrays indexed by (element code, isotope code), giving the exact mass, the label id and the reference ratio of each isotope, as well as the string-keyed dictionaries used elsewhere (setsOfElementIsotopes, STD_Rs, etc.).
+
+To add an element, call registerElement; all lookup arrays and dictionaries are recompiled in place, and the modules which compile their own tables from the registry (see COMPILE_HOOKS) are told to recompile.
+'''
+
+#For each element, its isotopes by cardinal mass: (label, exact mass, reference ratio) or (label, exact mass, reference ratio, delta scaling). Reference
+#ratios are relative to the unsubstituted isotope, in the standards of basicDeltaOperations: VPDB for carbon, AIR for nitrogen, VSMOW for H/O, and CDT
+#for sulfur. The delta of an element refers to its lightest rare isotope; the delta scaling gives the delta of each other rare isotope relative to that
+#one, following a mass scaling law. If it is not given, it is computed from the exact masses (see deltaScaling).
+ELEMENTS = {'H': {0: ('', 1.007825032, 1), 1: ('D', 2.014101778, 0.00015576)},
+            'C': {0: ('', 12, 1), 1: ('13C', 13.00335484, 0.011180)},
+            'N': {0: ('', 14.003074, 1), 1: ('15N', 15.00010889, 0.003676)},
+            'O': {0: ('', 15.99491462, 1), 1: ('17O', 16.99913175, 0.0003799), 2: ('18O', 17.9991596, 0.0020052, 1/0.52)},
+            'S': {0: ('', 31.97207117, 1), 1: ('33S', 32.9714589, 0.007877), 2: ('34S', 33.96786701, 0.0441626, 1/0.515),
+                  4: ('36S', 35.9670807, 0.000105274, 1.9/0.515)}}
+
+#Compiled from ELEMENTS by compileRegistry. The dictionaries are updated in place, so other modules may keep references to them.
+#ELEMENT_CODES gives the element code of each element; LABELS gives the label of each label id, with 0 as the unsubstituted isotope of any element.
+ELEMENT_CODES = {}
+LABELS = []
+#The possible isotope codes of each element, e.g. {'O': (0, 1, 2)}
+ISOTOPES_BY_ELEMENT = {}
+#The cardinal mass and exact mass change relative to the unsubstituted isotope of each label, e.g. {'18O': 2}
+LABEL_CARDINAL_MASSES = {}
+LABEL_MASS_CHANGES = {}
+#Reference ratios as keyed by basicDeltaOperations: by element for elements with one rare isotope, otherwise by label
+STD_RS = {}
+#The label of each rare isotope, keyed to (element, cardinal mass, reference ratio, delta scaling)
+RARE_ISOTOPES = {}
+#The label of the rare isotope the delta of each element refers to, e.g. {'O': '17O'}
+DELTA_ISOTOPES = {}
+
+#Arrays of shape (elements, isotope codes). Entries for isotope codes an element does not have are NaN (EXACT_MASSES, REFERENCE_RATIOS) or -1 (LABEL_IDS).
+EXACT_MASSES = None
+LABEL_IDS = None
+REFERENCE_RATIOS = None
+
+#Functions called after every compilation, e.g. to rebuild the tables of basicDeltaOperations or clear caches. Modules add to this list when imported.
+COMPILE_HOOKS = []
+
+def compileRegistry():
+    '''
+    Compiles ELEMENTS into the lookup arrays and dictionaries of this module.
+    '''
+    global EXACT_MASSES, LABEL_IDS, REFERENCE_RATIOS
+
+    ELEMENT_CODES.clear()
+    LABELS[:] = ['']
+    ISOTOPES_BY_ELEMENT.clear()
+    LABEL_CARDINAL_MASSES.clear()
+    LABEL_MASS_CHANGES.clear()
+    STD_RS.clear()
+    RARE_ISOTOPES.clear()
+    DELTA_ISOTOPES.clear()
+
+    width = max(max(isotopes) for isotopes in ELEMENTS.values()) + 1
+    exactMasses = np.full((len(ELEMENTS), width), np.nan)
+    labelIds = np.full((len(ELEMENTS), width), -1, dtype = np.int32)
+    referenceRatios = np.full((len(ELEMENTS), width), np.nan)
+
+    for elementCode, (element, isotopes) in enumerate(ELEMENTS.items()):
+        ELEMENT_CODES[element] = elementCode
+        ISOTOPES_BY_ELEMENT[element] = tuple(sorted(isotopes))
+        unsubMass = isotopes[0][1]
+        rareIsotopes = sorted(cardinalMass for cardinalMass in isotopes if cardinalMass != 0)
+        if rareIsotopes != []:
+            DELTA_ISOTOPES[element] = isotopes[rareIsotopes[0]][0]
+
+        for cardinalMass, (label, exactMass, referenceRatio, *scaling) in sorted(isotopes.items()):
+            if cardinalMass != 0:
+                LABELS.append(label)
+                LABEL_CARDINAL_MASSES[label] = cardinalMass
+                LABEL_MASS_CHANGES[label] = exactMass - unsubMass
+                STD_RS[element if len(rareIsotopes) == 1 else label] = referenceRatio
+                if scaling == []:
+                    scaling = [deltaScaling(unsubMass, isotopes[rareIsotopes[0]][1], exactMass)]
+                RARE_ISOTOPES[label] = (element, cardinalMass, referenceRatio, scaling[0])
+
+            exactMasses[elementCode, cardinalMass] = exactMass
+            labelIds[elementCode, cardinalMass] = LABELS.index(label)
+            referenceRatios[elementCode, cardinalMass] = referenceRatio
+
+    EXACT_MASSES, LABEL_IDS, REFERENCE_RATIOS = exactMasses, labelIds, referenceRatios
+    elementCodes.cache_clear()
+
+    for hook in COMPILE_HOOKS:
+        hook()
+
+def deltaScaling(unsubMass, deltaMass, exactMass):
+    '''
+    Gives the delta of an isotope relative to the delta of the lightest rare isotope of its element, following the mass-dependent scaling law, 
+    (1/m_unsub - 1/m) / (1/m_unsub - 1/m_light). Used where no delta scaling is given explicitly. 
+
+    Inputs:
+        unsubMass, deltaMass, exactMass: Floats, the exact masses of the unsubstituted isotope, the lightest rare isotope, and the isotope of interest. 
+
+    Outputs:
+        A float. 
+    '''
+    return (1/unsubMass - 1/exactMass) / (1/unsubMass - 1/deltaMass)
+
+def onCompile(hook):
+    '''
+    Adds a function to be called whenever the registry is compiled, and calls it once now. 
+    '''
+    COMPILE_HOOKS.append(hook)
+    hook()
+
+def registerElement(element, isotopes):
+    '''
+    Adds an element to the registry, or replaces it, and recompiles.
+
+    Inputs:
+        element: A string, the element symbol, e.g. 'Cl'.
+        isotopes: A dictionary keying the cardinal mass of each isotope to (label, exact mass, reference ratio), e.g. {0: ('', 34.96885268, 1), 2: ('37Cl', 36.96590259, 0.319627)}, optionally with a fourth entry giving the delta scaling (see ELEMENTS). Must include the unsubstituted isotope, 0.
+    '''
+    if 0 not in isotopes:
+        raise Exception("Give the unsubstituted isotope of " + str(element) + " as cardinal mass 0")
+
+    ELEMENTS[element] = isotopes
+    compileRegistry()
+
+@functools.lru_cache(maxsize = None)
+def elementCodes(siteElements):
+    '''
+    Gives the element code of each position of a molecule. Cached, as the same molecule is looked up many times.
+
+    Inputs:
+        siteElements: A tuple giving the chemical element by position. See ci.strSiteElements.
+
+    Outputs:
+        A read-only numpy array of ints.
+    '''
+    codes = np.array([ELEMENT_CODES[element] for element in siteElements], dtype = np.int64)
+    codes.setflags(write = False)
+
+    return codes
+
+def isotopeLabel(element, cardinalMass):
+    '''
+    Gives the label of an isotope, e.g. '18O' for ('O', 2); '' for the unsubstituted isotope, and None for an isotope not in the registry.
+    '''
+    isotope = ELEMENTS[element].get(cardinalMass)
+
+    return None if isotope is None else isotope[0]
+
+def exactMasses(elementCodes, isotopeCodes):
+    '''
+    Gives the exact mass of each isotopologue of an isotope code array in one lookup.
+
+    Inputs:
+        elementCodes: A numpy array giving the element code of each position. See elementCodes.
+        isotopeCodes: A numpy array of shape (..., atoms), giving the cardinal mass of the isotope at each position.
+
+    Outputs:
+        A numpy array of floats, of shape isotopeCodes.shape[:-1].
+    '''
+    return EXACT_MASSES[elementCodes, isotopeCodes].sum(axis = -1)
+
+compileRegistry()
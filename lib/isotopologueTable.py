@@ -0,0 +1,790 @@
+import collections
+import collections.abc
+import concurrent.futures
+import copy
+import os
+
+import numpy as np
+
+import calcIsotopologues as ci
+import parallelMonteCarlo as pmc
+
+'''
+This code stores the isotopologues of a molecule as a table of numpy arrays, rather than as the "byAtom" dictionary of dictionaries from calcIsotopologues. Each isotopologue is a row of an integer isotope code array (its ATOM depiction), and its symmetry number, concentration, cardinal mass and substitution class are entries of parallel arrays. The string depictions are only produced on request.
+
+Code written for the byAtom dictionary can use the table via atomDictionary(), which gives a read-only mapping keyed by ATOM strings that builds the dictionary for each isotopologue only when it is accessed.
+
+For molecules too large to hold in memory, iterIsotopologueChunks gives the isotopologues as a stream of smaller tables, optionally writing them to disk as it goes. ci.massSelections, ci.calcSubDictionary and fas.fragmentIsotopologueDict accept such streams in place of a dictionary.
+'''
+
+class IsotopologueTable:
+    '''
+    A columnar, array-backed table of isotopologues.
+
+    Attributes:
+        isotopeCodes: A numpy array of shape (isotopologues, atoms) of dtype uint8, where entry [i][j] gives the cardinal mass of the isotope at position j of isotopologue i.
+        number: A numpy array of ints, giving the symmetry number of each isotopologue.
+        conc: A numpy array of floats, giving the concentration of each isotopologue (including its symmetry number), or None if concentrations have not been calculated.
+        mass: A numpy array of ints, giving the cardinal mass difference of each isotopologue.
+        subIds: A numpy array of ints, giving the substitution class of each isotopologue.
+        subLabels: A list of strings; subLabels[subIds[i]] is the "Subs" string of isotopologue i.
+        siteElements: A tuple giving the chemical element by position. See ci.strSiteElements.
+        widths: A list of ints, giving the number of atoms at each site.
+        discarded: A float, the total concentration of isotopologues left out of the table as too rare (see inputToIsotopologueTable). 
+        maxMass: An int or None. If an int, the table includes only isotopologues with cardinal mass difference up to maxMass. 
+    '''
+    def __init__(self, isotopeCodes, number, conc, siteElements, widths, float32 = False, subIds = None, subLabels = None):
+        '''
+        Inputs:
+            isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+            number: A list or array of ints, giving the symmetry number of each isotopologue.
+            conc: A list or array of floats giving the concentration of each isotopologue, or None.
+            siteElements: A tuple giving the chemical element by position.
+            widths: A list of ints, giving the number of atoms at each site.
+            float32: If True, stores concentrations as 32 bit floats to save memory.
+            subIds, subLabels: Optionally, precomputed substitution classes (see ci.substitutionClasses). Calculated if not given.
+        '''
+        self.isotopeCodes = np.asarray(isotopeCodes, dtype = np.uint8)
+        self.number = np.asarray(number, dtype = np.int64)
+        self.siteElements = siteElements
+        self.widths = [int(width) for width in widths]
+        self.float32 = float32
+
+        self.conc = None
+        if conc is not None:
+            self.setConcentrations(conc)
+
+        self.mass = ci.cardinalMasses(self.isotopeCodes)
+
+        if subIds is None:
+            subIds, subLabels = ci.substitutionClasses(self.isotopeCodes, siteElements)
+        self.subIds = subIds
+        self.subLabels = subLabels
+
+        self.discarded = 0
+        self.maxMass = None
+
+        #String depictions, keys and the mass partition, computed on request; tables evaluated from the same topology share them (see evaluate)
+        self._cache = {}
+
+    def __len__(self):
+        return len(self.isotopeCodes)
+
+    def setConcentrations(self, conc):
+        '''
+        Sets the concentration of every isotopologue, respecting the float32 option.
+
+        Inputs:
+            conc: A list or array of floats, giving the concentration of each isotopologue.
+        '''
+        self.conc = np.asarray(conc, dtype = np.float32 if self.float32 else np.float64)
+
+    def atomStrings(self):
+        '''
+        Gives the ATOM string depiction of each isotopologue, i.e. '000100'. Computed once and stored.
+
+        Outputs:
+            A list of strings.
+        '''
+        if 'ATOM' not in self._cache:
+            self._cache['ATOM'] = ci.atomStrings(self.isotopeCodes)
+
+        return self._cache['ATOM']
+
+    def fullStrings(self):
+        '''
+        Gives the "expanded" string depiction of each isotopologue, i.e. '00(0, 1)0'. Computed once and stored.
+
+        Outputs:
+            A list of strings.
+        '''
+        if 'Full' not in self._cache:
+            self._cache['Full'] = ci.fullStrings(self.isotopeCodes, self.widths)
+
+        return self._cache['Full']
+
+    def keys(self):
+        '''
+        Gives the integer key of each isotopologue (see ci.isotopologueKey), from its packed isotope codes. Computed once and stored. 
+
+        Outputs:
+            A list of ints.
+        '''
+        if 'Key' not in self._cache:
+            self._cache['Key'] = ci.packedKeys(ci.packIsotopeCodes(self.isotopeCodes))
+
+        return self._cache['Key']
+
+    def rowIndex(self):
+        '''
+        Gives a dictionary from the integer key of each isotopologue to its row. Computed once and stored. 
+
+        Outputs:
+            A dictionary, {key: row}.
+        '''
+        if 'Rows' not in self._cache:
+            self._cache['Rows'] = {key: row for row, key in enumerate(self.keys())}
+
+        return self._cache['Rows']
+
+    def rowsOf(self, isotopeCodes):
+        '''
+        Finds the rows of some isotopologues of this table.
+
+        Inputs:
+            isotopeCodes: A numpy array of shape (isotopologues, atoms), giving the cardinal mass of the isotope at each position.
+
+        Outputs:
+            A numpy array of row indices.
+        '''
+        rowIndex = self.rowIndex()
+        keys = ci.packedKeys(ci.packIsotopeCodes(np.asarray(isotopeCodes, dtype = np.uint8)))
+        for key in keys:
+            if key not in rowIndex:
+                raise Exception("Isotopologue " + ci.keyToATOM(key, self.isotopeCodes.shape[1]) + " is not in the table")
+
+        return np.array([rowIndex[key] for key in keys], dtype = np.int64)
+
+    def withClumps(self, molecularDataFrame, clumpD):
+        '''
+        Introduces clumps to the isotopologues of this table, while keeping the site-specific concentrations the same. All clumps are applied at once, as a sparse change to the concentrations (see clumpAdjustment); this table is left unchanged as the stochastic reference. 
+
+        Inputs:
+            molecularDataFrame: The initial molecular info dataFrame. 
+            clumpD: A dictionary specifying the clumps to add, i.e. {'01':{'Sites':['Ccarboxyl','Ocarboxyl'],'Amount':0.0001,'Subs':['13C','18O']}}. 'Subs' is optional; without it, the mass 1 substitution of each site is used. 
+
+        Outputs:
+            A new IsotopologueTable, sharing all arrays but the concentrations with this one.
+        '''
+        rows, adjustment = clumpAdjustment(self, molecularDataFrame, clumpD)
+
+        conc = np.array(self.conc, dtype = np.float64)
+        #Unbuffered, so clumps affecting the same isotopologue are added in turn
+        np.add.at(conc, rows, adjustment)
+
+        clumped = copy.copy(self)
+        clumped.setConcentrations(conc)
+
+        return clumped
+
+    def massPartition(self):
+        '''
+        Partitions the isotopologues by cardinal mass: a stable argsort of the masses, plus the offset at which each mass begins. Computed once and stored. 
+
+        Outputs:
+            order: A numpy array of row indices, sorted by cardinal mass and otherwise in table order. 
+            offsets: A numpy array of ints; the rows of the M+N population are order[offsets[N]:offsets[N+1]]. 
+        '''
+        if 'Partition' not in self._cache:
+            order = np.argsort(self.mass, kind = 'stable')
+            highestMass = int(self.mass.max()) if len(self) > 0 else -1
+            offsets = np.searchsorted(self.mass[order], np.arange(highestMass + 2))
+            self._cache['Partition'] = (order, offsets)
+
+        return self._cache['Partition']
+
+    def population(self, mass):
+        '''
+        Gives the rows of the M+mass population, as a view into the mass partition. 
+
+        Inputs:
+            mass: An int, the cardinal mass difference. 
+
+        Outputs:
+            A numpy array of row indices, in table order. 
+        '''
+        order, offsets = self.massPartition()
+        if mass + 1 >= len(offsets):
+            return order[:0]
+
+        return order[offsets[mass]:offsets[mass + 1]]
+
+    def classPartition(self):
+        '''
+        Groups the isotopologues by substitution class: a stable argsort of the class ids, plus the offset at which each class begins. Classes are renumbered in order of their first isotopologue, the order in which calcSubDictionary meets them. Computed once and stored. 
+
+        Outputs:
+            classOrder: A numpy array of class ids, in order of their first isotopologue. 
+            order: A numpy array of row indices, grouped by class in the order of classOrder, and otherwise in table order. 
+            offsets: A numpy array of ints; the rows of class classOrder[i] are order[offsets[i]:offsets[i+1]]. 
+        '''
+        if 'Classes' not in self._cache:
+            presentIds, firstRows = np.unique(self.subIds, return_index = True)
+            classOrder = presentIds[np.argsort(firstRows)]
+
+            rank = np.zeros(len(self.subLabels), dtype = np.int64)
+            rank[classOrder] = np.arange(len(classOrder))
+            order = np.argsort(rank[self.subIds], kind = 'stable')
+            offsets = np.searchsorted(rank[self.subIds][order], np.arange(len(classOrder) + 1))
+            self._cache['Classes'] = (classOrder, order, offsets)
+
+        return self._cache['Classes']
+
+    def substitutionIndex(self, siteNames = None):
+        '''
+        Gives an inverted index from substitutions to the isotopologues of this table. See SubstitutionIndex. 
+        '''
+        return SubstitutionIndex(self, siteNames = siteNames)
+
+    def subStrings(self):
+        '''
+        Gives the substitution string ("Subs") of each isotopologue.
+
+        Outputs:
+            A list of strings.
+        '''
+        return [self.subLabels[subId] for subId in self.subIds]
+
+    def evaluate(self, deltas):
+        '''
+        Calculates the concentrations of the isotopologues of this table for a new set of deltas. The isotopologues, their symmetry numbers, masses, and substitutions do not depend on the deltas, so a table compiled once (see compileIsotopologueTopology) can be evaluated for a sample, a standard, a forward model, or a sweep over deltas without enumerating the isotopologues again. 
+
+        Inputs:
+            deltas: A list of floats, giving the delta value of each site.
+
+        Outputs:
+            A new IsotopologueTable, sharing all arrays but the concentrations with this one.
+        '''
+        #Which isotopologues survive abundance pruning depends on the deltas
+        if self.discarded != 0:
+            raise Exception("Cannot evaluate a table pruned by abundance for new deltas; compile it with compileIsotopologueTopology instead")
+
+        concentrationArray = ci.siteConcentrationsFromDeltas(self.siteIDs(), deltas)
+
+        evaluated = copy.copy(self)
+        evaluated.setConcentrations(ci.isotopologueConcentrationArray(self.isotopeCodes, self.number, concentrationArray, ci.atomSiteIndices(self.widths)))
+
+        return evaluated
+
+    def evaluateBatch(self, deltaMatrix):
+        '''
+        Calculates the concentrations of the isotopologues of this table for many sets of deltas in one pass (see ci.isotopologueConcentrationMatrix), e.g. for sensitivity checks or sweeps over the deltas of a standard. 
+
+        Inputs:
+            deltaMatrix: A numpy array of shape (scenarios, sites), where row i gives the delta value of each site in scenario i. 
+
+        Outputs:
+            A numpy array of shape (scenarios, isotopologues), giving the concentration of each isotopologue of this table in each scenario. 
+        '''
+        if self.discarded != 0:
+            raise Exception("Cannot evaluate a table pruned by abundance for new deltas; compile it with compileIsotopologueTopology instead")
+
+        concentrationArrays = ci.batchSiteConcentrations(self.siteIDs(), deltaMatrix)
+
+        return ci.isotopologueConcentrationMatrix(self.isotopeCodes, self.number, concentrationArrays, ci.atomSiteIndices(self.widths))
+
+    def siteIDs(self):
+        '''
+        Gives the chemical element at each site, i.e. the IDS column of the molecular dataframe. 
+        '''
+        siteStarts = np.cumsum([0] + self.widths[:-1])
+
+        return [self.siteElements[start] for start in siteStarts]
+
+    def take(self, rows):
+        '''
+        Selects a subset of the isotopologues as a new table. The substitution classes are carried over, so class ids are comparable between the two tables.
+
+        Inputs:
+            rows: A boolean mask or an array of row indices.
+
+        Outputs:
+            A new IsotopologueTable.
+        '''
+        conc = None if self.conc is None else self.conc[rows]
+
+        return IsotopologueTable(self.isotopeCodes[rows], self.number[rows], conc, self.siteElements, self.widths,
+                                 float32 = self.float32, subIds = self.subIds[rows], subLabels = self.subLabels)
+
+    def nbytes(self):
+        '''
+        Gives the memory used by the arrays of the table, in bytes.
+        '''
+        arrays = [self.isotopeCodes, self.number, self.mass, self.subIds]
+        if self.conc is not None:
+            arrays.append(self.conc)
+
+        return sum(array.nbytes for array in arrays)
+
+    def atomDictionary(self):
+        '''
+        Gives a view of the table with the same keys and values as a "byAtom" dictionary from ci.calcAtomDictionary.
+
+        Outputs:
+            An AtomDictionaryView of this table.
+        '''
+        return AtomDictionaryView(self)
+
+class AtomDictionaryView(collections.abc.Mapping):
+    '''
+    A read-only mapping over an IsotopologueTable, keyed by ATOM strings, for code written against the "byAtom" dictionary. The dictionary for each isotopologue is only built when accessed, and is kept so that further information can be added to it (as in fas.fragmentAndTrackIsotopologues). Changes to its 'Conc' are written back to the table.
+
+    Rows are looked up by integer key (see ci.isotopologueKey) rather than by string, so no dictionary of strings is built. 
+    '''
+    def __init__(self, table):
+        self.table = table
+        self._records = {}
+
+    def _row(self, ATOM):
+        if type(ATOM) != str or len(ATOM) != self.table.isotopeCodes.shape[1]:
+            raise KeyError(ATOM)
+        try:
+            return self.table.rowIndex()[ci.isotopologueKey(ATOM)]
+        except ValueError:
+            raise KeyError(ATOM)
+
+    def __getitem__(self, ATOM):
+        row = self._row(ATOM)
+        if row not in self._records:
+            self._records[row] = IsotopologueRecord(self.table, row)
+
+        return self._records[row]
+
+    def substitutionIndex(self, siteNames = None):
+        '''
+        Gives an inverted index from substitutions to the isotopologues of the table, with totals for the current concentrations. See SubstitutionIndex. 
+        '''
+        return self.table.substitutionIndex(siteNames = siteNames)
+
+    def massSelection(self, mass):
+        '''
+        Gives the isotopologues of the M+mass population as a dictionary, as in ci.massSelections, with the same records as this view. Only the rows of this population are visited (see IsotopologueTable.population). 
+
+        Inputs:
+            mass: An int, the cardinal mass difference. 
+
+        Outputs:
+            selection: A dictionary, keyed by ATOM strings. 
+        '''
+        rows = self.table.population(mass)
+        codes = self.table.isotopeCodes[rows]
+
+        selection = {}
+        for row, ATOM, full in zip(rows.tolist(), ci.atomStrings(codes), ci.fullStrings(codes, self.table.widths)):
+            if row not in self._records:
+                self._records[row] = IsotopologueRecord(self.table, row, full = full)
+            selection[ATOM] = self._records[row]
+
+        return selection
+
+    def __iter__(self):
+        return iter(self.table.atomStrings())
+
+    def __len__(self):
+        return len(self.table)
+
+    def __contains__(self, ATOM):
+        try:
+            self._row(ATOM)
+            return True
+        except KeyError:
+            return False
+
+class SubstitutionIndex(collections.abc.Mapping):
+    '''
+    An inverted index from substitutions (e.g. '13C-D') to the isotopologues of an IsotopologueTable with that substitution, in place of the lists of the "bySub" dictionary. The rows of every substitution are found with one group-by over the integer class ids, and the total number and concentration of every substitution with one bincount each.
+
+    Indexing by a substitution gives its totals in the form of a "bySub" entry, {'Number': ..., 'Conc': ..., 'Mass': [mass]}, so the index can be passed to fas.UValueMeasurement directly. The totals are those of the concentrations when the index is made. 
+    '''
+    def __init__(self, table, siteNames = None):
+        '''
+        Inputs:
+            table: An IsotopologueTable.
+            siteNames: A list of strings giving the name of each site (the index of the molecular dataframe), so queries can refer to sites by name. 
+        '''
+        self.table = table
+        self.siteNames = siteNames
+
+        classOrder, self.order, self.offsets = table.classPartition()
+        self.subs = [table.subLabels[classId] for classId in classOrder]
+        self._position = {sub: position for position, sub in enumerate(self.subs)}
+
+        nClasses = len(table.subLabels)
+        self.number = np.bincount(table.subIds, weights = table.number, minlength = nClasses)[classOrder].astype(np.int64)
+        self.conc = np.bincount(table.subIds, weights = table.conc, minlength = nClasses)[classOrder]
+        self.mass = table.mass[self.order[self.offsets[:-1]]]
+
+    def __getitem__(self, sub):
+        position = self._position[sub]
+
+        return {'Number': int(self.number[position]), 'Conc': float(self.conc[position]), 'Mass': [int(self.mass[position])]}
+
+    def __iter__(self):
+        return iter(self.subs)
+
+    def __len__(self):
+        return len(self.subs)
+
+    def rows(self, sub):
+        '''
+        Gives the rows of the table with a substitution, in table order. 
+
+        Inputs:
+            sub: A substitution string, e.g. '13C-D'. 
+
+        Outputs:
+            A numpy array of row indices.
+        '''
+        position = self._position[sub]
+
+        return self.order[self.offsets[position]:self.offsets[position + 1]]
+
+    def subDictionary(self):
+        '''
+        Gives the full "bySub" dictionary of ci.calcSubDictionary, including the lists of 'Full' and 'ATOM' strings and masses of each substitution. 
+
+        Outputs:
+            bySub: A dictionary keyed by substitution. 
+        '''
+        ATOMStrings = self.table.atomStrings()
+        fullStrings = self.table.fullStrings()
+
+        bySub = {}
+        for position, sub in enumerate(self.subs):
+            rows = self.rows(sub).tolist()
+            bySub[sub] = {'Number': int(self.number[position]),
+                          'Full': [fullStrings[row] for row in rows],
+                          'Conc': float(self.conc[position]),
+                          'Mass': [int(self.mass[position])] * len(rows),
+                          'ATOM': [ATOMStrings[row] for row in rows]}
+
+        return bySub
+
+    def query(self, atSite = {}, anywhere = []):
+        '''
+        Finds the isotopologues with given substitutions, e.g. those with 13C at site 'Calpha' and D anywhere: query(atSite = {'Calpha': '13C'}, anywhere = ['D']). Substitutions listed in anywhere are matched against the substitution classes, so only the rows of matching classes are visited; atSite is then checked on these rows. 
+
+        Inputs:
+            atSite: A dictionary where keys are sites (names if siteNames was given, otherwise indices) and values are substitutions which must be present at that site. 
+            anywhere: A list of substitutions which must each be present somewhere in the isotopologue; repeat a substitution to require it more than once. 
+
+        Outputs:
+            rows: A numpy array of row indices, in table order. 
+        '''
+        required = collections.Counter(anywhere)
+        matching = [sub for sub in self.subs if all(collections.Counter(sub.split('-'))[label] >= count for label, count in required.items())]
+        if matching == []:
+            return self.order[:0]
+        rows = np.sort(np.concatenate([self.rows(sub) for sub in matching]))
+
+        siteStarts = np.cumsum([0] + self.table.widths)
+        for site, label in atSite.items():
+            siteIndex = self.siteNames.index(site) if self.siteNames is not None else site
+            element = self.table.siteElements[siteStarts[siteIndex]]
+            massesWithLabel = [cardinalMass for cardinalMass in ci.setsOfElementIsotopes[element] if ci.uEl(element, cardinalMass) == label]
+
+            siteCodes = self.table.isotopeCodes[rows, siteStarts[siteIndex]:siteStarts[siteIndex + 1]]
+            rows = rows[np.isin(siteCodes, massesWithLabel).any(axis = 1)]
+
+        return rows
+
+class IsotopologueRecord(dict):
+    '''
+    The dictionary for a single isotopologue of an AtomDictionaryView, with keys 'Number', 'Full', 'Conc', 'Mass' and 'Subs'. Setting 'Conc' also updates the concentration in the table.
+    '''
+    def __init__(self, table, row, full = None):
+        self.table = table
+        self.row = row
+
+        if full is None:
+            full = table.fullStrings()[row]
+
+        conc = None if table.conc is None else float(table.conc[row])
+        super().__init__(Number = int(table.number[row]), Full = full, Conc = conc,
+                         Mass = int(table.mass[row]), Subs = table.subLabels[table.subIds[row]])
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        if key == 'Conc':
+            self.table.conc[self.row] = value
+
+def clumpAdjustment(table, molecularDataFrame, clumpD):
+    '''
+    Gives the change in concentration from introducing clumps to an isotopologue table, as a sparse vector over its rows. Generalizes ci.introduceClump to substitutions of any mass, e.g. 13C-18O or D-D clumps. For each clump, the clumped isotopologue gains the clump amount (times its symmetry number), the isotopologue singly substituted at each of its sites loses it, and the unsubstituted isotopologue gains it, so the site-specific concentrations are unchanged. 
+
+    Inputs:
+        table: An IsotopologueTable, including all isotopologues involved in the clumps. 
+        molecularDataFrame: The initial molecular info dataFrame. 
+        clumpD: A dictionary specifying the clumps to add. See IsotopologueTable.withClumps. 
+
+    Outputs:
+        rows: A numpy array of row indices. A row may appear more than once if several clumps affect it. 
+        adjustment: A numpy array of floats, giving the change in concentration of each entry of rows. 
+    '''
+    nAtoms = table.isotopeCodes.shape[1]
+
+    clumpIsotopologues = []
+    amounts = []
+    for clumpNumber, clumpInfo in clumpD.items():
+        subList = clumpInfo.get('Subs')
+        if subList is None:
+            subList = [None] * len(clumpInfo['Sites'])
+        substitutions = ci.clumpSubstitutions(clumpInfo['Sites'], molecularDataFrame, subList = clumpInfo.get('Subs'))
+        #Each singly substituted isotopologue is indexed on its own, e.g. a single D of a D-D clump sits at the last position of the site
+        singles = [ci.clumpSubstitutions([site], molecularDataFrame, subList = None if sub is None else [sub]) for site, sub in zip(clumpInfo['Sites'], subList)]
+        #In the order of ci.introduceClump: unsubstituted, each singly substituted, then clumped
+        clumpIsotopologues += [()] + singles + [substitutions]
+        amounts += [clumpInfo['Amount']] + [-clumpInfo['Amount']] * len(singles) + [clumpInfo['Amount']]
+
+    rows = table.rowsOf(ci.sparseToCodes(clumpIsotopologues, nAtoms))
+    #The unsubstituted isotopologue has symmetry number 1
+    adjustment = np.array(amounts, dtype = np.float64) * table.number[rows]
+
+    return rows, adjustment
+
+def inputToIsotopologueTable(molecularDataFrame, disable = False, maxMass = None, float32 = False, abundanceThreshold = 0, topK = None, processes = 1):
+    '''
+    The IsotopologueTable counterpart of ci.inputToAtomDict. Enumerates the isotopologues of a molecule directly as an isotope code array and calculates their concentrations.
+
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        disable: If True, does not print progress messages.
+        maxMass: An int or None. If an int, only includes isotopologues with cardinal mass difference up to maxMass.
+        float32: If True, stores concentrations as 32 bit floats.
+        abundanceThreshold: A float. If above 0, only includes isotopologues with at least this concentration. See ci.calcAbundantIsotopologues.
+        topK: An int or None. If an int, only includes the topK most abundant isotopologues, from most to least abundant.
+        processes: An int. If above 1, enumerates and evaluates the isotopologues with this many worker processes; see parallelIsotopologueTable. 
+
+    Outputs:
+        table: An IsotopologueTable with all (or all up to maxMass, or all abundant) isotopologues of the molecule. Its discarded attribute gives the total concentration of isotopologues left out as too rare.
+    '''
+    if abundanceThreshold == 0 and topK is None and processes > 1:
+        if disable == False:
+            print("Calculating Isotopologue Table with " + str(processes) + " processes")
+        return parallelIsotopologueTable(molecularDataFrame, processes, maxMass = maxMass, float32 = float32)
+
+    if abundanceThreshold == 0 and topK is None:
+        topology = compileIsotopologueTopology(molecularDataFrame, disable = disable, maxMass = maxMass, float32 = float32)
+        if disable == False:
+            print("Calculating Isotopologue Concentrations")
+        return topology.evaluate(molecularDataFrame['deltas'].values)
+
+    if disable == False:
+        print("Calculating Isotopologue Concentrations")
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+    concentrationArray = ci.siteSpecificConcentrations(molecularDataFrame)
+
+    abundantIsotopologues, symmetryNumbers, abundantConc, discarded = ci.calcAbundantIsotopologues(siteIsotopes, multinomialCoeff, concentrationArray,
+                                                                                                 abundanceThreshold = abundanceThreshold, topK = topK, maxMass = maxMass)
+    isotopeCodes = ci.isotopologueCodeArray(abundantIsotopologues) if abundantIsotopologues else np.zeros((0, int(molecularDataFrame['Number'].sum())), dtype = np.uint8)
+    if disable == False:
+        print("Discarded " + str(discarded) + " of the molecule as isotopologues below the abundance threshold")
+
+    widths = list(molecularDataFrame['Number'].values)
+    conc = ci.isotopologueConcentrationArray(isotopeCodes, symmetryNumbers, concentrationArray, ci.atomSiteIndices(widths))
+
+    if disable == False:
+        print("Compiling Isotopologue Table")
+    table = IsotopologueTable(isotopeCodes, symmetryNumbers, conc, ci.strSiteElements(molecularDataFrame), widths, float32 = float32)
+    table.discarded = discarded
+    table.maxMass = maxMass
+
+    return table
+
+def compileIsotopologueTopology(molecularDataFrame, disable = False, maxMass = None, float32 = False):
+    '''
+    Enumerates the isotopologues of a molecule as an IsotopologueTable without concentrations. Everything in this "topology" depends only on the elements and number of atoms at each site, not on the deltas; call evaluate on the output to get concentrations for any set of deltas. 
+
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule. The deltas column is not used. 
+        disable: If True, does not print progress messages.
+        maxMass: An int or None. If an int, only includes isotopologues with cardinal mass difference up to maxMass.
+        float32: If True, evaluated tables store concentrations as 32 bit floats.
+
+    Outputs:
+        topology: An IsotopologueTable, with conc None.
+    '''
+    if disable == False:
+        print("Compiling Isotopologue Table")
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+
+    if maxMass is None:
+        isotopeCodes, symmetryNumbers = ci.calcAllIsotopologueCodes(siteIsotopes, multinomialCoeff)
+    else:
+        isotopeCodes, symmetryNumbers = ci.calcBoundedMassIsotopologueCodes(siteIsotopes, multinomialCoeff, maxMass)
+
+    widths = list(molecularDataFrame['Number'].values)
+    topology = IsotopologueTable(isotopeCodes, symmetryNumbers, None, ci.strSiteElements(molecularDataFrame), widths, float32 = float32)
+    topology.maxMass = maxMass
+
+    return topology
+
+def iterIsotopologueChunks(molecularDataFrame, chunkSize = 2**20, maxMass = None, float32 = False, sink = None):
+    '''
+    Gives the isotopologues of a molecule as a stream of IsotopologueTables of at most chunkSize isotopologues each, in the same order as ci.calcAllIsotopologues. Each chunk is computed from its range of isotopologue indices alone (see ci.calcAllIsotopologueCodes), so only one chunk is held in memory at a time, however large the molecule. If maxMass is given, the indices range over the isotopologues up to maxMass only (see ci.calcBoundedMassIsotopologueCodes), so those above it are never enumerated. 
+
+    All chunks share one list of substitution labels, which grows as new substitutions are found, so a substitution has the same class id in every chunk. 
+
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        chunkSize: An int, the number of isotopologues enumerated per chunk. 
+        maxMass: An int or None. If an int, only includes isotopologues with cardinal mass difference up to maxMass. 
+        float32: If True, stores concentrations as 32 bit floats.
+        sink: None, or the path of a directory. If given, each chunk is also written to memory-mapped .npy files in this directory, which can be read back with loadIsotopologueChunks. 
+
+    Outputs:
+        A generator of IsotopologueTables.
+    '''
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+    widths = list(molecularDataFrame['Number'].values)
+    atomSites = ci.atomSiteIndices(widths)
+    concentrationArray = ci.siteSpecificConcentrations(molecularDataFrame)
+    siteElements = ci.strSiteElements(molecularDataFrame)
+
+    nIsotopologues = ci.countIsotopologues(siteIsotopes, maxMass = maxMass)
+    if sink is not None:
+        store = sinkArrays(sink, nIsotopologues, len(atomSites), float32)
+        written = 0
+
+    subLabels = []
+    subIdsByLabel = {}
+    for start in range(0, nIsotopologues, chunkSize):
+        end = min(start + chunkSize, nIsotopologues)
+        if maxMass is None:
+            isotopeCodes, symmetryNumbers = ci.calcAllIsotopologueCodes(siteIsotopes, multinomialCoeff, start = start, stop = end)
+        else:
+            isotopeCodes, symmetryNumbers = ci.calcBoundedMassIsotopologueCodes(siteIsotopes, multinomialCoeff, maxMass, start = start, stop = end)
+
+        conc = ci.isotopologueConcentrationArray(isotopeCodes, symmetryNumbers, concentrationArray, atomSites)
+
+        #Renumber the classes of this chunk to the shared labels
+        chunkSubIds, chunkSubLabels = ci.substitutionClasses(isotopeCodes, siteElements)
+        for label in chunkSubLabels:
+            if label not in subIdsByLabel:
+                subIdsByLabel[label] = len(subLabels)
+                subLabels.append(label)
+        sharedIds = np.array([subIdsByLabel[label] for label in chunkSubLabels], dtype = np.int32)
+
+        chunk = IsotopologueTable(isotopeCodes, symmetryNumbers, conc, siteElements, widths, float32 = float32,
+                                  subIds = sharedIds[chunkSubIds], subLabels = subLabels)
+
+        if sink is not None:
+            stop = written + len(chunk)
+            store['isotopeCodes'][written:stop] = chunk.isotopeCodes
+            store['number'][written:stop] = chunk.number
+            store['conc'][written:stop] = chunk.conc
+            store['subIds'][written:stop] = chunk.subIds
+            written = stop
+
+        yield chunk
+
+    if sink is not None:
+        for array in store.values():
+            array.flush()
+        np.save(os.path.join(sink, 'subLabels.npy'), np.array(subLabels, dtype = str))
+
+def sinkArrays(sink, nIsotopologues, nAtoms, float32 = False):
+    '''
+    Creates the memory-mapped .npy files written by iterIsotopologueChunks. 
+
+    Inputs:
+        sink: The path of a directory; created if it does not exist. 
+        nIsotopologues: An int, the number of isotopologues to be written. 
+        nAtoms: An int, the number of atoms of the molecule. 
+        float32: If True, stores concentrations as 32 bit floats.
+
+    Outputs:
+        A dictionary where keys are the names of the IsotopologueTable arrays and values are writable memory maps. 
+    '''
+    os.makedirs(sink, exist_ok = True)
+    shapes = {'isotopeCodes': ((nIsotopologues, nAtoms), np.uint8),
+              'number': ((nIsotopologues,), np.int64),
+              'conc': ((nIsotopologues,), np.float32 if float32 else np.float64),
+              'subIds': ((nIsotopologues,), np.int32)}
+
+    return {name: np.lib.format.open_memmap(os.path.join(sink, name + '.npy'), mode = 'w+', dtype = dtype, shape = shape)
+            for name, (shape, dtype) in shapes.items()}
+
+def loadIsotopologueChunks(sink, molecularDataFrame, chunkSize = 2**20):
+    '''
+    Reads isotopologues written by iterIsotopologueChunks back from disk as a stream of IsotopologueTables. The files are memory-mapped, so only one chunk is read into memory at a time. 
+
+    Inputs:
+        sink: The path of the directory given to iterIsotopologueChunks. 
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        chunkSize: An int, the number of isotopologues per chunk. 
+
+    Outputs:
+        A generator of IsotopologueTables.
+    '''
+    arrays = {name: np.load(os.path.join(sink, name + '.npy'), mmap_mode = 'r') for name in ['isotopeCodes', 'number', 'conc', 'subIds']}
+    subLabels = np.load(os.path.join(sink, 'subLabels.npy')).tolist()
+    float32 = arrays['conc'].dtype == np.float32
+
+    widths = list(molecularDataFrame['Number'].values)
+    siteElements = ci.strSiteElements(molecularDataFrame)
+
+    for start in range(0, len(arrays['number']), chunkSize):
+        rows = slice(start, start + chunkSize)
+        yield IsotopologueTable(np.array(arrays['isotopeCodes'][rows]), np.array(arrays['number'][rows]), np.array(arrays['conc'][rows]),
+                                siteElements, widths, float32 = float32, subIds = np.array(arrays['subIds'][rows]), subLabels = subLabels)
+
+def parallelIsotopologueTable(molecularDataFrame, processes, maxMass = None, float32 = False, shardsPerProcess = 4):
+    '''
+    Enumerates the isotopologues of a molecule and calculates their concentrations in parallel. The isotopologues are split into shards of consecutive isotopologue indices, as equal in size as possible. Any range of isotopologues can be computed from its indices alone (see ci.calcAllIsotopologueCodes and ci.calcBoundedMassIsotopologueCodes), so each worker process enumerates and evaluates its shards independently (see enumerateShard), and the shards are joined in order. The table is the same as from inputToIsotopologueTable whatever the number of processes. 
+
+    There are several shards per process, so a process which finishes early can take up another shard. 
+
+    Inputs:
+        molecularDataFrame: A dataFrame containing information about the molecule.
+        processes: An int, the number of worker processes. 
+        maxMass: An int or None. If an int, only includes isotopologues with cardinal mass difference up to maxMass.
+        float32: If True, stores concentrations as 32 bit floats.
+        shardsPerProcess: An int, the number of shards to split into for each process. 
+
+    Outputs:
+        table: An IsotopologueTable with all (or all up to maxMass) isotopologues of the molecule.
+    '''
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+    concentrationArray = ci.siteSpecificConcentrations(molecularDataFrame)
+    widths = list(molecularDataFrame['Number'].values)
+    siteElements = ci.strSiteElements(molecularDataFrame)
+
+    nIsotopologues = ci.countIsotopologues(siteIsotopes, maxMass = maxMass)
+    shards = [(siteIsotopes, multinomialCoeff, start, stop, maxMass, concentrationArray, widths, siteElements)
+              for start, stop in pmc.chunkBounds(nIsotopologues, processes * shardsPerProcess)]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = processes) as executor:
+        results = list(executor.map(enumerateShard, shards))
+
+    #Join the substitution classes of the shards, numbering them in order of their first isotopologue as ci.substitutionClasses does
+    subLabels = []
+    subIdsByLabel = {}
+    subIds = []
+    for isotopeCodes, symmetryNumbers, conc, shardSubIds, shardSubLabels in results:
+        for label in shardSubLabels:
+            if label not in subIdsByLabel:
+                subIdsByLabel[label] = len(subLabels)
+                subLabels.append(label)
+        sharedIds = np.array([subIdsByLabel[label] for label in shardSubLabels], dtype = np.int32)
+        subIds.append(sharedIds[shardSubIds])
+
+    table = IsotopologueTable(np.concatenate([result[0] for result in results]), np.concatenate([result[1] for result in results]),
+                              np.concatenate([result[2] for result in results]), siteElements, widths, float32 = float32,
+                              subIds = np.concatenate(subIds), subLabels = subLabels)
+    table.maxMass = maxMass
+
+    return table
+
+def enumerateShard(shard):
+    '''
+    Enumerates and evaluates a range of consecutive isotopologues, for parallelIsotopologueTable. Runs in a worker process. 
+
+    Inputs:
+        shard: A tuple of (setsOfSiteIsotopes, multinomialCoefficients, start, stop, maxMass, concentrationArray, widths, siteElements), where start and stop give the range of isotopologue indices. 
+
+    Outputs:
+        isotopeCodes, symmetryNumbers, conc: Numpy arrays for the isotopologues of this shard, in serial order. 
+        subIds, subLabels: The substitution classes of these isotopologues (see ci.substitutionClasses).
+    '''
+    siteIsotopes, multinomialCoeff, start, stop, maxMass, concentrationArray, widths, siteElements = shard
+
+    if maxMass is None:
+        isotopeCodes, symmetryNumbers = ci.calcAllIsotopologueCodes(siteIsotopes, multinomialCoeff, start = start, stop = stop)
+    else:
+        isotopeCodes, symmetryNumbers = ci.calcBoundedMassIsotopologueCodes(siteIsotopes, multinomialCoeff, maxMass, start = start, stop = stop)
+
+    conc = ci.isotopologueConcentrationArray(isotopeCodes, symmetryNumbers, concentrationArray, ci.atomSiteIndices(widths))
+    subIds, subLabels = ci.substitutionClasses(isotopeCodes, siteElements)
+
+    return isotopeCodes, symmetryNumbers, conc, subIds, subLabels
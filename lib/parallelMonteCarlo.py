@@ -0,0 +1,92 @@
+import concurrent.futures
+
+import numpy as np
+
+'''
+Runs the draws of a Monte Carlo routine across worker processes. Every draw gets its own random number generator, spawned from a single SeedSequence, so the random numbers used by a draw depend only on the seed and the index of the draw. The draws are split into contiguous chunks, one per worker, and the results are put back together in order, so a run is reproducible bit-for-bit for a given seed regardless of the number of workers.
+'''
+
+def drawSeeds(N, seed = None):
+    '''
+    Spawns an independent SeedSequence for each draw of a Monte Carlo routine.
+
+    Inputs:
+        N: The number of draws.
+        seed: An integer, a SeedSequence, or None. If None, fresh entropy is taken from the operating system, and the run cannot be reproduced.
+
+    Outputs:
+        A list of N SeedSequences.
+    '''
+    if not isinstance(seed, np.random.SeedSequence):
+        seed = np.random.SeedSequence(seed)
+
+    return seed.spawn(N)
+
+def drawGenerators(seeds):
+    '''
+    Gives a numpy Generator for each SeedSequence of a list.
+    '''
+    return [np.random.default_rng(seedSequence) for seedSequence in seeds]
+
+def chunkBounds(N, workers):
+    '''
+    Splits N draws into contiguous chunks, as evenly as possible.
+
+    Inputs:
+        N: The number of draws.
+        workers: The number of chunks to split into.
+
+    Outputs:
+        A list of (start, stop) tuples, one for each nonempty chunk.
+    '''
+    edges = np.linspace(0, N, max(min(workers, N), 1) + 1).astype(int)
+
+    return [(start, stop) for start, stop in zip(edges[:-1], edges[1:]) if stop > start]
+
+def runChunk(function, seeds, args, kwargs):
+    '''
+    Runs one chunk of draws, calling function with one Generator per draw as the keyword argument "rngs". Defined at the top level so it can be sent to worker processes.
+    '''
+    return function(*args, rngs = drawGenerators(seeds), **kwargs)
+
+def runParallel(function, seeds, chunkArguments, workers = 1):
+    '''
+    Splits the draws of a Monte Carlo routine into chunks and runs each chunk in a worker process.
+
+    Inputs:
+        function: A top level function (so that it can be sent to worker processes), which takes a keyword argument "rngs", a list giving the Generator for each draw of the chunk.
+        seeds: A list of SeedSequences, one per draw. See drawSeeds.
+        chunkArguments: A function taking the (start, stop) bounds of a chunk and returning (args, kwargs) to call function with for that chunk.
+        workers: The number of worker processes. If 1, the chunk is run in this process.
+
+    Outputs:
+        A list, giving the output of function for each chunk, in order.
+    '''
+    bounds = chunkBounds(len(seeds), workers)
+
+    if len(bounds) <= 1:
+        return [runChunk(function, seeds[start:stop], *chunkArguments(start, stop)) for start, stop in bounds]
+
+    with concurrent.futures.ProcessPoolExecutor(max_workers = len(bounds)) as executor:
+        futures = [executor.submit(runChunk, function, seeds[start:stop], *chunkArguments(start, stop)) for start, stop in bounds]
+        return [future.result() for future in futures]
+
+def mergeResults(chunkResults):
+    '''
+    Puts the results of several chunks back together. Dictionaries are merged key by key, lists are concatenated in order; anything else is taken from the final chunk.
+
+    Inputs:
+        chunkResults: A list, giving the output of each chunk.
+
+    Outputs:
+        The merged output.
+    '''
+    last = chunkResults[-1]
+
+    if isinstance(last, dict):
+        return {key: mergeResults([chunk[key] for chunk in chunkResults]) for key in last}
+
+    if isinstance(last, list):
+        return [entry for chunk in chunkResults for entry in chunk]
+
+    return last
@@ -2,7 +2,9 @@ import pandas as pd
 import fragmentAndSimulate as fas
 import readInput as ri
 import solveSystem as ss
+import parallelMonteCarlo as pmc
 import calcIsotopologues as ci
+import isotopologueTable as it
 import matplotlib.pyplot as plt
 import basicDeltaOperations as op
 
@@ -125,6 +127,23 @@ def moleculeFromCsv(path, deltas = False, fragSubset = None):
     
     return initializedMolecule
 
+def moleculeWithDeltas(initializedMolecule, deltas):
+    '''
+    Gives a copy of an initialized molecule with new deltas, without reading the .csv again. 
+
+    Inputs:
+        initializedMolecule: A dictionary, the output of moleculeFromCsv.
+        deltas: A list of floats, giving the delta value of each site.
+
+    Outputs:
+        newMolecule: A dictionary, as initializedMolecule, with a new molecularDataFrame.
+    '''
+    newMolecule = dict(initializedMolecule)
+    newMolecule['molecularDataFrame'] = initializedMolecule['molecularDataFrame'].copy()
+    newMolecule['molecularDataFrame']['deltas'] = deltas
+
+    return newMolecule
+
 def extractExperimentalErrors(errorPath, UValueError = 0.001, MNError = 0.001):
     '''
     Read in error bars from a user provided csv. If no CSV is provided, instead return a single float giving error for the molecular average measurement (U Value) and for the M+N Experiment. A value of 0.001 corresponds to a 1 per mil error. 
@@ -188,15 +207,23 @@ def addClumps(byAtom, molecularDataFrame, clumpD):
     Inputs:
         byAtom: A dictionary where keys are isotoplogues and values are dictionaries containing details about those isotopologues. 
         molecularDataFrame: A dataframe containing basic information about the molecule. 
-        clumpD: Specifies information about clumps to add; otherwise the isotome follows the stochastic assumption. Currently works only for mass 1 substitutions (e.g. 1717, 1317, etc.) See ci.introduceClump for details.
+        clumpD: Specifies information about clumps to add; otherwise the isotome follows the stochastic assumption. For a view of an isotopologue table, clumps of any mass may be added (e.g. 1318, DD), see it.clumpAdjustment; for a dictionary, only mass 1 substitutions (e.g. 1717, 1317, etc.), see ci.introduceClump.
 
     Outputs:
-        byAtom: The same dictionary, with concentrations modified to include clumps. 
+        byAtom: The same dictionary, with concentrations modified to include clumps. For a view of an isotopologue table, a view of a new table with the clumps added. 
     '''
-    stochD = copy.deepcopy(byAtom)
-    
-    for clumpNumber, clumpInfo in clumpD.items():
-        byAtom = ci.introduceClump(byAtom, clumpInfo['Sites'], clumpInfo['Amount'], molecularDataFrame)
+    if hasattr(byAtom, 'table'):
+        #The stochastic table is kept as it is, so no copy is needed for the reference
+        stochD = byAtom
+        byAtom = byAtom.table.withClumps(molecularDataFrame, clumpD).atomDictionary()
+
+    else:
+        stochD = copy.deepcopy(byAtom)
+
+        for clumpNumber, clumpInfo in clumpD.items():
+            if 'Subs' in clumpInfo:
+                raise Exception("Clumps with specified substitutions require an isotopologue table; see it.inputToIsotopologueTable")
+            byAtom = ci.introduceClump(byAtom, clumpInfo['Sites'], clumpInfo['Amount'], molecularDataFrame)
         
     for clumpNumber, clumpInfo in clumpD.items():
         ci.checkClumpDelta(clumpInfo['Sites'], molecularDataFrame, byAtom, stochD)
@@ -204,7 +231,7 @@ def addClumps(byAtom, molecularDataFrame, clumpD):
     return byAtom
 
 def simulateMeasurement(initializedMolecule, abundanceThreshold = 0, UValueList = [],
-                        massThreshold = 1, clumpD = {}, outputPath = None, disableProgress = True, calcFF = False, fractionationFactors = {}, omitMeasurements = {}, ffstd = 0.05, unresolvedDict = {}, outputFull = False):
+                        massThreshold = 1, clumpD = {}, outputPath = None, disableProgress = True, calcFF = False, fractionationFactors = {}, omitMeasurements = {}, ffstd = 0.05, unresolvedDict = {}, outputFull = False, isotopologueThreshold = 0, topology = None):
     '''
     Simulates M+N measurements of an alanine molecule with input deltas specified by the input dataframe molecularDataFrame. 
 
@@ -216,7 +243,7 @@ def simulateMeasurement(initializedMolecule, abundanceThreshold = 0, UValueList
         abundanceThreshold: A float; Does not include measurements below this M+N relative abundance, i.e. assuming they will not be  measured due to low abundance. 
         UValueList: A list giving specific substitutions to calculate molecular average U values for ('13C', '15N', etc.)
         massThreshold: An integer; will calculate M+N relative abundances for N <= massThreshold
-        clumpD: Specifies information about clumps to add; otherwise the isotome follows the stochastic assumption. Currently works only for mass 1 substitutions (e.g. 1717, 1317, etc.) See ci.introduceClump for details.
+        clumpD: Specifies information about clumps to add; otherwise the isotome follows the stochastic assumption, i.e. {'01':{'Sites':['Ccarboxyl','Ocarboxyl'],'Amount':0.0001,'Subs':['13C','18O']}}. 'Subs' is optional, and defaults to mass 1 substitutions. See it.clumpAdjustment for details.
         outputPath: A string, e.g. 'output', or None. If it is a string, outputs the simulated spectrum as a json. 
         disableProgress: Disables tqdm progress bars when True.
         calcFF: When True, computes a new set of fractionation factors for this measurement.
@@ -225,6 +252,8 @@ def simulateMeasurement(initializedMolecule, abundanceThreshold = 0, UValueList
         ffstd: A float; if new fractionation factors are calculated, they are pulled from a normal distribution centered around 1, with this standard deviation.
         unresolvedDict: A dictionary, specifying which unresolved ion beams add to each other.
         outputFull: A boolean. Typically False, in which case beams that are not observed are culled from the dictionary. If True, includes this information; this should only be used for debugging, and will likely break the solver routine. 
+        isotopologueThreshold: A float; isotopologues with concentration below this are never enumerated, as they contribute nothing observable. The total concentration left out is printed unless disableProgress is True. See ci.calcAbundantIsotopologues. 
+        topology: None, or the isotopologues of this molecule from it.compileIsotopologueTopology, to be evaluated for its deltas rather than enumerated again. Must include isotopologues up to at least massThreshold, or all isotopologues if clumps are added. 
         
     Outputs:
         predictedMeasurement: A dictionary giving information from the M+N measurements. 
@@ -237,16 +266,31 @@ def simulateMeasurement(initializedMolecule, abundanceThreshold = 0, UValueList
     fragSubgeometryKeys = initializedMolecule['fragSubgeometryKeys']
     fragmentationDictionary = initializedMolecule['fragmentationDictionary']
 
-    byAtom = ci.inputToAtomDict(molecularDataFrame, disable = disableProgress)
+    #Isotopologues above massThreshold are only needed to introduce clumps
+    maxMass = None
+    if clumpD == {}:
+        maxMass = massThreshold
+
+    #byAtom is a view of an array-backed table of isotopologues, keyed and indexed like the dictionary from ci.inputToAtomDict
+    if topology is not None and isotopologueThreshold == 0:
+        if topology.maxMass is not None and (maxMass is None or topology.maxMass < maxMass):
+            raise Exception("The compiled topology does not include all isotopologues needed for this measurement")
+        isotopologues = topology.evaluate(molecularDataFrame['deltas'].values)
+    else:
+        isotopologues = it.inputToIsotopologueTable(molecularDataFrame, disable = disableProgress, maxMass = maxMass, abundanceThreshold = isotopologueThreshold)
+    byAtom = isotopologues.atomDictionary()
     if clumpD != {}:
         byAtom = addClumps(byAtom, molecularDataFrame, clumpD)
 
-    #bySub is an representation of data, a dictionary where keys are substitutions (e.g., '13C'), and values are their abundances. 
-    bySub = ci.calcSubDictionary(byAtom, molecularDataFrame, atomInput = True)
-    
     #Initialize Measurement output
     allMeasurementInfo = {}
-    allMeasurementInfo = fas.UValueMeasurement(bySub, allMeasurementInfo, massThreshold = massThreshold,subList = UValueList)
+    if clumpD == {}:
+        #Without clumps, the U values follow directly from the site-specific concentrations
+        allMeasurementInfo = fas.UValueMeasurementFromSites(molecularDataFrame, allMeasurementInfo, massThreshold = massThreshold, subList = UValueList)
+    else:
+        #bySub is an representation of data, where keys are substitutions (e.g., '13C'), and values are their abundances. An index over the table gives the totals without listing every isotopologue. 
+        bySub = byAtom.substitutionIndex()
+        allMeasurementInfo = fas.UValueMeasurement(bySub, allMeasurementInfo, massThreshold = massThreshold,subList = UValueList)
 
     MN = ci.massSelections(byAtom, massThreshold = massThreshold)
     MN = fas.trackMNFragments(MN, expandedFrags, fragSubgeometryKeys, molecularDataFrame, unresolvedDict = unresolvedDict)
@@ -292,7 +336,7 @@ def plotOutput(simulationOutput, relativeDeltasActual = None, ylim = False):
     if ylim:
         ax.set_ylim(*ylim)
 
-def simulateSmpStd(path, deltasStd, deltasSmp, deltasStdAppx, abundanceThreshold = 0, UValueList = [], massThreshold = 1,  disableProgress = True, calcFF = False, omitMeasurements = {}, ffstd = 0.05, plot = True, MonteCarloN = 100, perturbTheoryOAmt = 0, errorPath = False, MNError = 0, UValueError = 0, resultsFileName = 'output.csv', outputPrecision = 3, UMNSub = '13C'):
+def simulateSmpStd(path, deltasStd, deltasSmp, deltasStdAppx, abundanceThreshold = 0, UValueList = [], massThreshold = 1,  disableProgress = True, calcFF = False, omitMeasurements = {}, ffstd = 0.05, plot = True, MonteCarloN = 100, perturbTheoryOAmt = 0, errorPath = False, MNError = 0, UValueError = 0, resultsFileName = 'output.csv', outputPrecision = 3, UMNSub = '13C', seed = 25, workers = 1):
     '''
     Parent function which constructs and runs a full sample standard comparison. 
 
@@ -310,6 +354,8 @@ def simulateSmpStd(path, deltasStd, deltasSmp, deltasStdAppx, abundanceThreshold
         resultsFileName: Name the output CSV. 
         outputPrecision: Adjust precision on the output CSV. 
         UMNSub: Choose which isotope to anchor to when calculating site-specific data. 
+        seed: An integer, giving the random numbers of the Monte Carlo routine and the processing of its results, so that a simulation gives the same errors every time it is run. If None, every run is different. See ss.M1MonteCarlo. 
+        workers: The number of worker processes to split the Monte Carlo routine across. The results do not depend on it. 
 
     Outputs:
         simulationOutput: A dataframe containing the results of the simulation. Also produces a cleaned CSV containing the most relevant pieces of information. Also plots these data (if plot). 
@@ -323,19 +369,22 @@ def simulateSmpStd(path, deltasStd, deltasSmp, deltasStdAppx, abundanceThreshold
     'omitMeasurements': omitMeasurements,
     'ffstd': ffstd}
 
-    #Simulate observations of the standard
+    #The isotopologues do not depend on the deltas, so we enumerate them once for the standard, sample, and forward model
     thisStd = moleculeFromCsv(path, deltas = deltasStd)
-    stdMeasurement, stdMNDict, stdFF = simulateMeasurement(thisStd, **simArgs)
+    topology = it.compileIsotopologueTopology(thisStd['molecularDataFrame'], disable = disableProgress, maxMass = max(massThreshold, 1))
+
+    #Simulate observations of the standard
+    stdMeasurement, stdMNDict, stdFF = simulateMeasurement(thisStd, topology = topology, **simArgs)
 
     #Simulate observations of the sample
-    thisSmp = moleculeFromCsv(path, deltas = deltasSmp)
-    smpMeasurement, smpMNDict, smpFF = simulateMeasurement(thisSmp, **simArgs)
+    thisSmp = moleculeWithDeltas(thisStd, deltasSmp)
+    smpMeasurement, smpMNDict, smpFF = simulateMeasurement(thisSmp, topology = topology, **simArgs)
 
     #Simulate a forward model of the standard. 
-    forwardModel = moleculeFromCsv(path, deltas = deltasStdAppx)
+    forwardModel = moleculeWithDeltas(thisStd, deltasStdAppx)
     forwardModelPredictions, MNDict, FF = simulateMeasurement(forwardModel,abundanceThreshold = 0,
                                                                         massThreshold = 1,
-                                                                            unresolvedDict = {})
+                                                                            unresolvedDict = {}, topology = topology)
 
     #Get error bars used for the simulation from an input CSV or use the same specified value for each.
     UValueError, MNError = extractExperimentalErrors(errorPath, UValueError = UValueError, MNError = MNError)
@@ -349,12 +398,17 @@ def simulateSmpStd(path, deltasStd, deltasSmp, deltasStdAppx, abundanceThreshold
     OCorrection = ss.OValueCorrectTheoretical(forwardModelPredictions, processSample, massThreshold = 1)
     isotopologuesDict = fas.isotopologueDataFrame(MNDict, forwardModel['molecularDataFrame'])
 
+    #Independent random streams for the solver and the processing of its results
+    solveSeed, processSeed = (None, None) if seed is None and workers == 1 else pmc.drawSeeds(2, seed)
+
     #Solve the system, update the dataframe
     M1Results = ss.M1MonteCarlo(processStandard, processSample, OCorrection, isotopologuesDict,
                                 forwardModel['fragmentationDictionary'], 
-                                N = MonteCarloN, perturbTheoryOAmt = perturbTheoryOAmt, disableProgress = disableProgress)
+                                N = MonteCarloN, perturbTheoryOAmt = perturbTheoryOAmt, disableProgress = disableProgress,
+                                seed = solveSeed, workers = workers)
 
-    processedResults = ss.processM1MCResults(M1Results, UValuesSmp, isotopologuesDict, forwardModel['molecularDataFrame'], UMNSub = [UMNSub], disableProgress = disableProgress)
+    processedResults = ss.processM1MCResults(M1Results, UValuesSmp, isotopologuesDict, forwardModel['molecularDataFrame'], UMNSub = [UMNSub], disableProgress = disableProgress,
+                                             seed = processSeed, workers = workers)
 
     simulationOutput = ss.updateSiteSpecificDfM1MC(processedResults, forwardModel['molecularDataFrame'])
 
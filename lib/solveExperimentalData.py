@@ -8,6 +8,7 @@ import solveSystem as ss
 import readCSVAndSimulate as sim
 import basicDeltaOperations as op
 import fragmentAndSimulate as fas
+import parallelMonteCarlo as pmc
 import dataAnalyzerMNIsoX
 
 def defineProcessFragKeys(fragmentationDictionary):
@@ -27,7 +28,7 @@ def defineProcessFragKeys(fragmentationDictionary):
 
     return processFragKeys
 
-def experimentalDataM1(rtnMeans, cwd, MOLECULE_INPUT_PATH, std_deltas, UValue = '13C/Unsub', mAObs = None, mARelErr = None, perturbTheoryOAmt = 0.001, MonteCarloN = 1000, outputPrecision = 3, resultsFileName = 'M1Output.csv', plot = True):
+def experimentalDataM1(rtnMeans, cwd, MOLECULE_INPUT_PATH, std_deltas, UValue = '13C/Unsub', mAObs = None, mARelErr = None, perturbTheoryOAmt = 0.001, MonteCarloN = 1000, outputPrecision = 3, resultsFileName = 'M1Output.csv', plot = True, seed = 25, workers = 1):
     '''
     Parent function to process experimental M+1 Data and return results. 
 
@@ -42,6 +43,7 @@ def experimentalDataM1(rtnMeans, cwd, MOLECULE_INPUT_PATH, std_deltas, UValue =
         outputPrecision: The number of decimals to include in the output .csv. 
         resultsFileName: Filename to export results to. 
         plot: If True, return a plot. 
+        seed, workers: Used to split the Monte Carlo solver and processing of its results across worker processes, reproducibly for a given seed; the results do not depend on the number of workers. With the default seed, every run gives the same errors. If seed is None, every run is different. See ss.M1MonteCarlo. 
 
     Outputs: 
         cleanExperimentalOutput: A dataframe containing basic information about the molecule and the results of the M+1 algorithm. 
@@ -70,6 +72,9 @@ def experimentalDataM1(rtnMeans, cwd, MOLECULE_INPUT_PATH, std_deltas, UValue =
     isotopologuesDict = fas.isotopologueDataFrame(MNDict, mDf)
 
     rare_sub = UValue.split('/')[0]
+    #Independent random streams for the solver and the processing of its results
+    solveSeed, processSeed = (None, None) if seed is None and workers == 1 else pmc.drawSeeds(2, seed)
+
     #Run the M+1 algorithm and process the results
     M1Results = ss.M1MonteCarlo(replicateData['Std'], replicateData['Smp'], 
                                 OValueCorrection, 
@@ -77,13 +82,17 @@ def experimentalDataM1(rtnMeans, cwd, MOLECULE_INPUT_PATH, std_deltas, UValue =
                                 initializedMolecule['fragmentationDictionary'], 
                                 N = MonteCarloN,
                                 perturbTheoryOAmt = perturbTheoryOAmt, 
-                                disableProgress = True)
+                                disableProgress = True,
+                                seed = solveSeed,
+                                workers = workers)
     
     processedResults = ss.processM1MCResults(M1Results, UValuesSmp,
                                              isotopologuesDict, 
                                              mDf, 
                                              UMNSub = [rare_sub],
-                                             disableProgress = True)
+                                             disableProgress = True,
+                                             seed = processSeed,
+                                             workers = workers)
 
     mDf = ss.updateSiteSpecificDfM1MC(processedResults, mDf)
     #END M1 ALGORITHM
@@ -151,11 +160,8 @@ def getAverageRatio(molecularDataFrame, element):
     numbers = thisElementDf['Number']
     deltas = thisElementDf['deltas']
 
-    #Loop through sites. Get the concentration of each and add to total
-    totalConc = [0,0,0,0]
-    for siteIdx, siteDelta in enumerate(deltas):
-        thisConc = np.array(op.deltaToConcentration(element,siteDelta))
-        totalConc += thisConc * numbers[siteIdx]
+    #Get the concentration of each site and add to total
+    totalConc = (op.deltasToConcentrations(element, deltas.values) * numbers.values).sum(axis = 1)
 
     #convert total concentration to ratio and delta
     avgRatio = op.concentrationToM1Ratio(totalConc)
@@ -8,18 +8,22 @@ from scipy.linalg import null_space
 from tqdm import tqdm
 
 import basicDeltaOperations as op
+import fragmentAndSimulate as fas
+import parallelMonteCarlo as pmc
 
-def perturbStandard(standardData, theory = True):
+def perturbStandard(standardData, theory = True, rng = None):
     '''
     Takes a dictionary with standard data. For each fragment, perturbs every measurement according to its experimental error, then renormalizes. Calculates correction factors by comparing these perturbed values to the predicted abundance of each peak.
     
     Inputs:
         standardData: A dictionary; keys are mass selections ("M1", "M2") then fragment Keys ("full", "44"), then information about substitutions, observed abundances, predicted abundances, and errors. 
         theory: A boolean. If true, calculates correction factors. 
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
         
     Outputs:
         standardData: The same dictionary as the input, with entries for the perturbed observation as well as correction factors. 
     '''
+    random = np.random if rng is None else rng
     #146 us   
     for massSelection in standardData.keys():
         for frag, data in standardData[massSelection].items():
@@ -27,7 +31,7 @@ def perturbStandard(standardData, theory = True):
             error = np.array(data['Error'])
 
             #perturb
-            perturbed = np.random.normal(observed,error)
+            perturbed = random.normal(observed,error)
             perturbed /= perturbed.sum()
                 
             if theory:
@@ -39,16 +43,18 @@ def perturbStandard(standardData, theory = True):
             
     return standardData
 
-def perturbSampleError(sampleData):
+def perturbSampleError(sampleData, rng = None):
     '''
     Perturbs sample data according to observed experimental errors. For each mass selection, for each fragment, perturbs based on experimental error, then renormalizes. This can be seen as a companion function to perturbStandard; differs in that it does not calculate correction factors and outputs a new dictionary. 
     
     Inputs:
         sampleData: A dictionary; keys are mass selections ("M1", "M2") then fragment Keys ("full", "44"), then information about substitutions, observed abundances, and errors. 
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
         
     Outputs:
         perturbedSample: A dictionary; keys are mass selections, then fragment keys. Contains information about observed abundance and substitutions. 
     '''
+    random = np.random if rng is None else rng
     perturbedSample = {}
     for massSelection in sampleData.keys():
         perturbedSample[massSelection] = {}
@@ -58,7 +64,7 @@ def perturbSampleError(sampleData):
             error = np.array(fragData['Error'])
 
             #perturb and renormalize
-            perturbed = np.random.normal(observed,error)
+            perturbed = random.normal(observed,error)
             perturbed /= perturbed.sum()
             
             perturbedSample[massSelection][fragKey] = {'Observed Abundance': perturbed,
@@ -124,7 +130,7 @@ def perturbSampleOCorrection(correctedSample, OCorrection, perturbOverrideList =
 
 def perturbSample(sampleData, perturbedStandard, OCorrection, experimentalOCorrectList = [], 
                     correctionFactors = True, abundanceCorrect = True, explicitOCorrect = {}, 
-                    perturbOverrideList = []):
+                    perturbOverrideList = [], rng = None):
     '''
     Takes sample data and perturbs it multiple ways--first perturbs experimental error, then applies (fractionation) correction factors, then applies M+N Relative abundance correction factors. Finally processes the perturbed sample into a dataframe to be looped into the matrix solver. 
     
@@ -137,10 +143,11 @@ def perturbSample(sampleData, perturbedStandard, OCorrection, experimentalOCorre
         abundanceCorrect: A boolean, determines whether to apply observed abundance correction factors. 
         perturbOverrideList: perturbSample will automatically perturb all sample acquisitions (M1, M2, M3, M4); in some cases, e.g. when doing an iterated correction for M1, we do not want to perturb all, only M1. This can be specified with this list. (E.g. ['M1']) 
         explicitOCorrect: For each MNKey and each fragment, may provide bounds on reasonable O correction values. 
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
     Outputs:
         measurementData: A dictionary containing a dataframe for each M+N experiment. The dataframe gives the final corrected relative abundances for each peak of each fragment. 
     '''
-    perturbedSample = perturbSampleError(sampleData)
+    perturbedSample = perturbSampleError(sampleData, rng = rng)
     
     if correctionFactors:
         perturbedSample = perturbSampleCorrectionFactors(perturbedSample, perturbedStandard, renormalize = abundanceCorrect)
@@ -217,7 +224,7 @@ def OValueCorrectTheoretical(predictedMeasurement, processSample, massThreshold
             
     return OValueCorrection
 
-def modifyOValueCorrection(OValueCorrection, variableOCorrect, MNKey, explicitOCorrect = {}, amount = 0.002):
+def modifyOValueCorrection(OValueCorrection, variableOCorrect, MNKey, explicitOCorrect = {}, amount = 0.002, rng = None):
     '''
     Perturbs the M+N Relative abundance correction factors, for example if they are only approximately known. 
     
@@ -227,10 +234,12 @@ def modifyOValueCorrection(OValueCorrection, variableOCorrect, MNKey, explicitOC
         MNKey: "M1", "M2", etc. 
         amount: The size of the perturbation in relative terms (e.g. 2 per mil)
         explicitOCorrect: An override dictionary, where an explicit distribution can be set for each fragment, rather than using the input from OValueCorrection and the calculated standard error.
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
         
     Outputs:
         variableOCorrect: A perturbed copy of the OValueCorrection dictionary. 
     '''
+    random = np.random if rng is None else rng
     for fragKey, OFactor in OValueCorrection[MNKey].items():
         corrected = False
         #if == 1, no correction performed
@@ -238,7 +247,7 @@ def modifyOValueCorrection(OValueCorrection, variableOCorrect, MNKey, explicitOC
             if MNKey in explicitOCorrect:
                 if fragKey in explicitOCorrect[MNKey]:
                     corrected = True
-                    v = np.random.normal(explicitOCorrect[MNKey][fragKey]['Mu,Sigma'][0], explicitOCorrect[MNKey][fragKey]['Mu,Sigma'][1])
+                    v = random.normal(explicitOCorrect[MNKey][fragKey]['Mu,Sigma'][0], explicitOCorrect[MNKey][fragKey]['Mu,Sigma'][1])
                     if 'Bounds' in explicitOCorrect[MNKey][fragKey]:
                         if v <= explicitOCorrect[MNKey][fragKey]['Bounds'][0]:
                             v = explicitOCorrect[MNKey][fragKey]['Bounds'][0]
@@ -250,7 +259,7 @@ def modifyOValueCorrection(OValueCorrection, variableOCorrect, MNKey, explicitOC
                     variableOCorrect[MNKey][fragKey] = v
                     
             if corrected == False:
-                variableOCorrect[MNKey][fragKey] = np.random.normal(OFactor, OFactor*amount)
+                variableOCorrect[MNKey][fragKey] = random.normal(OFactor, OFactor*amount)
             
     return variableOCorrect
 
@@ -300,9 +309,9 @@ def experimentalOCorrection(MNKey, fragToCorrect, subToCorrect, perturbedSample,
     
     return OValueCorrection
 
-def constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary, includeSubs = [], omitSubs = []):
+def constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary, includeSubs = [], omitSubs = [], incidence = None):
     '''
-    Constructs the matrix and the measurement vector for the Monte Carlo method to solve. We could increase speed by only constructing the composition matrix once and tracking how to reconstruct the measurement vector, rather than solving it each time. But we have not implemented this. 
+    Constructs the matrix and the measurement vector for the Monte Carlo method to solve. Which observation each isotopologue contributes to does not change between iterations; if the compiled incidence of the isotopologues is given (see fas.isotopologueIncidence), the rows of the composition matrix are sliced from it rather than found again. 
     
     Inputs:
         Isotopologues: A dataFrame containing isotopologues and information about their fragmentation.
@@ -312,6 +321,7 @@ def constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary, includeS
                                                      '44': {'01': {'subgeometry': [1, 'x', 'x', 1, 1, 'x'], 'relCont': 1}}} which gives information about the fragments, their subgeometries and relative contributions.
         includeSubs: A list of isotopes, if we want to include only certain isotopes in the matrix. If it is nonempty, only isotopes in the list will be included in the matrix. Generally should be empty. 
         omitSubs: A list of isotopes, if we wish to omit certain isotopes from the matrix. If it is nonempty, isotopes in the list will not be included in the matrix. Generally should be empty. 
+        incidence: None, or the fas.FragmentIncidence of Isotopologues, compiled once via fas.isotopologueIncidence. 
         
     Outputs:
         comp: The composition matrix as a numpy array. Columns are isotopologues, rows are observations.
@@ -322,6 +332,19 @@ def constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary, includeS
     
     CMatrix.append([1]*len(Isotopologues.index))
     MeasurementVector.append(1)
+
+    if incidence is not None:
+        beams = []
+        for fragKey, fragInfo in fragmentationDictionary.items():
+            for sub, v in smp[fragKey].iteritems():
+                if (len(includeSubs) == 0 or sub in includeSubs) and sub not in omitSubs and v != 0:
+                    beams.append((fragKey, sub))
+                    MeasurementVector.append(v)
+
+        comp = np.vstack((np.array(CMatrix, dtype = float), incidence.compositionMatrix(beams)))
+        meas = np.array(MeasurementVector,dtype = float)
+
+        return comp, meas
     
     for fragKey, fragInfo in fragmentationDictionary.items():
         #One matrix/measurement vector row per sub per fragment
@@ -338,7 +361,7 @@ def constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary, includeS
                             IsotopologueFragments = Isotopologues[fragKey + '_' + subFrag + ' Subs']
                             c = list(IsotopologueFragments.isin([sub]) * subFragInfo['relCont'])
 
-                            if cFull == []:
+                            if len(cFull) == 0:
                                 cFull = np.array(c)
                             else:
                                 cFull = cFull + np.array(c)
@@ -353,7 +376,7 @@ def constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary, includeS
 
 def sanitizeMatrix(M, eps = 10**-8, full = False):
     '''
-    One inefficient attempt to avoid floating point errors. This checks every entry of a matrix to see if it is sufficiently close to some integer value. If it is, it rounds it to that integer. This is useful to run on matrices that have been manipulated and may be carrying floating point errors. 
+    One attempt to avoid floating point errors. This checks every entry of a matrix to see if it is sufficiently close to some integer value. If it is, it rounds it to that integer. This is useful to run on matrices that have been manipulated and may be carrying floating point errors. The matrix is modified in place. 
     
     Inputs:
         M: The matrix to sanitize.
@@ -363,27 +386,20 @@ def sanitizeMatrix(M, eps = 10**-8, full = False):
     Outputs:
         M: The sanitized matrix. 
     '''
-    rows, cols = M.shape
-    
-    for i, row in enumerate(M):
-        for j, col in enumerate(row):
-            if not full:
-                diff = np.abs(col - round(col))
-                #Don't fix last column of Aug Matrix
-                if j < (cols-1):
-                    if diff < eps and diff > 0:
-                        M[i][j] = round(col)
-            if full:
-                diff = np.abs(col - round(col))
-                if j < (cols):
-                    if diff < eps and diff > 0:
-                        M[i][j] = round(col)
+    #Don't fix last column of Aug Matrix
+    target = M if full else M[:,:-1]
+
+    nearest = np.round(target)
+    close = np.abs(target - nearest) < eps
+    target[close] = nearest[close]
                     
     return M
 
 def GJElim(Matrix, augMatrix = False, AugAmount = 1, store = False, sanitize = False, eps = 10**-8):
     '''
     A Gauss-Jordan Elimination algorithm. Useful to track the results of underconstrained systems, to see which isotopologues covary. We can determine which isotopologues are solved for by interrogating the null space of the GJ solution.
+
+    Pivots on the entry of largest magnitude in each column (partial pivoting), and eliminates the whole column at once, subtracting the outer product of the column with the pivot row. The reduced row echelon form of the unaugmented columns does not depend on the choice of pivots, so these are the same as from pivoting on the first nonzero entry, with less floating point error. The augmented columns are the same only if the system is consistent. If it is not, e.g. for M+N systems where there are more observations than unknowns and these do not agree exactly, the augmented columns depend on which rows are pivoted on, and can differ from those found by pivoting on the first nonzero entry. 
     
     Inputs:
         Matrix: The matrix to eliminate.
@@ -415,21 +431,21 @@ def GJElim(Matrix, augMatrix = False, AugAmount = 1, store = False, sanitize = F
     if store:
         storage.append(M.copy())
     while r < rows and c < colLimit:
-        #If there is a nonzero entry in the column, then pivot and eliminate. 
+        #If there is a nonzero entry in the column, then pivot on the largest and eliminate. 
         #Count only values above threshold as nonzero, to avoid e.g. picking "10**-15" as a nonzero entry
-        if True in (np.abs(M[r:,c]) > eps):
-            pivotRow = (M[r:,c]!=0).argmax(axis=0) + r
+        magnitudes = np.abs(M[r:,c])
+        pivotRow = magnitudes.argmax() + r
+        if magnitudes[pivotRow - r] > eps:
             rank += 1
 
             M[[r, pivotRow]] = M[[pivotRow, r]]
 
             M[r] = M[r]/ M[r,c]
 
-            for i in range(1,rows-r):
-                M[r+i] -= (M[r+i,c]/M[r,c] * M[r])
-
-            for j in range(0,r):
-                M[j] -= M[j,c]/M[r,c] * M[r]
+            #Eliminate the column from every other row at once
+            factors = M[:,c].copy()
+            factors[r] = 0
+            M -= np.outer(factors, M[r])
                 
             r += 1
 
@@ -449,15 +465,35 @@ def GJElim(Matrix, augMatrix = False, AugAmount = 1, store = False, sanitize = F
         
     return M, rank, storage
 
+def GJOperator(comp, eps = 10**-8):
+    '''
+    Records the Gauss-Jordan elimination of a composition matrix as a transform, so that it can be applied to any number of measurement vectors. The row operations of GJElim depend only on the composition matrix, not on the augmented column; eliminating the composition matrix augmented with the identity gives the reduced row echelon form together with the matrix of row operations that produced it. The augmented column for a measurement vector meas is then transform @ meas, and for many measurement vectors at once, meas @ transform.T. 
+    
+    Inputs:
+        comp: The composition matrix. 
+        eps: A float. Values with absolute value < epsilon are considered 0s and are not selected as pivots. See GJElim. 
+        
+    Outputs:
+        rref: The composition matrix after GJ elimination. 
+        rank: An integer, the rank of the composition matrix. 
+        transform: A numpy array of shape (rows, rows), giving the row operations of the elimination. 
+    '''
+    rows, cols = comp.shape
+    M, rank, storage = GJElim(np.column_stack((comp, np.eye(rows))), augMatrix = True, AugAmount = rows, eps = eps)
+
+    return M[:, :cols], rank, M[:, cols:]
+
 def M1MonteCarlo(standardData, sampleData, OCorrection, isotopologuesDict, fragmentationDictionary, 
                 N = 100, GJ = False, debugMatrix = False, includeSubs = [], omitSubs = [], 
                 disableProgress = False, theory = True, perturbTheoryOAmt = 0.002,
                 experimentalOCorrectList = [], abundanceCorrect = True, 
                 debugUnderconstrained = True, plotUnconstrained = False,
                 storePerturbedSamples = False, storeOCorrect = False, explicitOCorrect = {}, 
-                perturbOverrideList = []):
+                perturbOverrideList = [], batch = False, seed = None, workers = 1, rngs = None):
     '''
     The Monte Carlo routine which is applied to M+1 measurements. This perturbs sample, standard, and M+N Relative abundance corrections N times, constructing and solving the matrix each time and recording the M+N Relative abundances. If the solution is underconstrained, it will also attempt to discover which specific isotopologues are not solved for and output this information to the user. 
+
+    With batch = True, all N draws are made and solved at once; see M1MonteCarloBatch. 
     
     Inputs:
         standardData:  A dictionary; keys are mass selections ("M1", "M2") then fragment Keys ("full", "44"), then information about substitutions, observed abundances, predicted abundances, and errors. 
@@ -481,21 +517,66 @@ def M1MonteCarlo(standardData, sampleData, OCorrection, isotopologuesDict, fragm
         storePerturbedSamples: An option to store the perturbed samples from each step of the MC for further investigation.
         perturbOverrideList: perturbSample will automatically perturb all sample acquisitions (M1, M2, M3, M4); in some cases, e.g. when doing an iterated correction for M1, we do not want to perturb all, only M1. This can be specified with this list. (E.g. ['M1']) 
         explicitOCorrect: For each MNKey and each fragment, may define specific bounds on reasonable O correction values. 
+        batch: A boolean. If True, solves all N draws at once via M1MonteCarloBatch. Not available with GJ or experimentalOCorrectList. With a seed, all draws are made from one generator, in this process. 
+        seed: An integer or numpy SeedSequence. If given, or if workers > 1, every draw gets its own random number generator spawned from the seed (see parallelMonteCarlo), so the results are reproducible regardless of the number of workers. If None, draws from the global numpy random state, unless workers > 1. 
+        workers: The number of worker processes to split the draws across. Where processes are started by spawning (Windows, macOS), call from within an "if __name__ == '__main__':" block. 
+        rngs: A list giving a numpy Generator for each draw. Used by the worker processes; generally should be None. 
 
     Outputs:
         results: A dictionary, with GJ and NUMPY as keys. Each is keyed to a list of solutions from those respective algorithms. 
     '''
+    if batch:
+        if GJ or experimentalOCorrectList != [] or not theory:
+            raise Exception("The batched Monte Carlo does not support GJ, experimentalOCorrectList, or theory = False; set batch = False")
+
+        return M1MonteCarloBatch(standardData, sampleData, OCorrection, isotopologuesDict, fragmentationDictionary, N = N,
+                                 includeSubs = includeSubs, omitSubs = omitSubs, perturbTheoryOAmt = perturbTheoryOAmt,
+                                 abundanceCorrect = abundanceCorrect, debugUnderconstrained = debugUnderconstrained,
+                                 plotUnconstrained = plotUnconstrained, storePerturbedSamples = storePerturbedSamples,
+                                 storeOCorrect = storeOCorrect, explicitOCorrect = explicitOCorrect,
+                                 rng = None if seed is None else np.random.default_rng(seed))
+
+    if rngs is None and (seed is not None or workers > 1):
+        if debugMatrix:
+            raise Exception("debugMatrix is not available with a seed or multiple workers")
+
+        seeds = pmc.drawSeeds(N, seed)
+        args = (standardData, sampleData, OCorrection, isotopologuesDict, fragmentationDictionary)
+        kwargs = {'GJ':GJ, 'includeSubs':includeSubs, 'omitSubs':omitSubs, 'disableProgress':True, 'theory':theory,
+                  'perturbTheoryOAmt':perturbTheoryOAmt, 'experimentalOCorrectList':experimentalOCorrectList,
+                  'abundanceCorrect':abundanceCorrect, 'debugUnderconstrained':False, 'storePerturbedSamples':storePerturbedSamples,
+                  'storeOCorrect':storeOCorrect, 'explicitOCorrect':explicitOCorrect, 'perturbOverrideList':perturbOverrideList}
+
+        chunks = pmc.runParallel(M1MonteCarlo, seeds, lambda start, stop: (args, dict(kwargs, N = stop - start)), workers = workers)
+        results = pmc.mergeResults(chunks)
+
+        #Repeat the final draw here to report on the null space, if the solution is underconstrained
+        if debugUnderconstrained:
+            M1MonteCarlo(*args, rngs = pmc.drawGenerators(seeds[-1:]),
+                         **dict(kwargs, N = 1, debugUnderconstrained = True, plotUnconstrained = plotUnconstrained))
+
+        return results
+
     MNKey = "M1"
     Isotopologues = isotopologuesDict[MNKey]
 
     results = {'GJ':[],"NUMPY":[], "Extra Info":{'Perturbed Samples':[],'O Correct':[],'StoreExpFactors':[]}}
     
+    #Compile which observation each isotopologue contributes to once, rather than every iteration
+    incidence = fas.isotopologueIncidence(Isotopologues, fragmentationDictionary)
+    
     variableOCorrect = copy.deepcopy(OCorrection)
     for i in tqdm(range(N), disable = disableProgress):
-        variableOCorrect = modifyOValueCorrection(OCorrection, variableOCorrect, MNKey, explicitOCorrect = explicitOCorrect, amount = perturbTheoryOAmt)
-        std = perturbStandard(standardData, theory = theory)
+        rng = None
+        if rngs is not None:
+            #Each draw starts from the same corrections, so it does not matter which chunk it is run in
+            rng = rngs[i]
+            variableOCorrect = copy.deepcopy(OCorrection)
+
+        variableOCorrect = modifyOValueCorrection(OCorrection, variableOCorrect, MNKey, explicitOCorrect = explicitOCorrect, amount = perturbTheoryOAmt, rng = rng)
+        std = perturbStandard(standardData, theory = theory, rng = rng)
         
-        perturbedSample = perturbSample(sampleData, std, variableOCorrect, experimentalOCorrectList = experimentalOCorrectList,abundanceCorrect = abundanceCorrect,explicitOCorrect = explicitOCorrect, perturbOverrideList = perturbOverrideList)
+        perturbedSample = perturbSample(sampleData, std, variableOCorrect, experimentalOCorrectList = experimentalOCorrectList,abundanceCorrect = abundanceCorrect,explicitOCorrect = explicitOCorrect, perturbOverrideList = perturbOverrideList, rng = rng)
         
         smp = perturbedSample['M1']
        
@@ -505,7 +586,7 @@ def M1MonteCarlo(standardData, sampleData, OCorrection, isotopologuesDict, fragm
             results['Extra Info']['O Correct'].append(copy.deepcopy(variableOCorrect['M1'])) 
        
         comp, meas = constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary,
-                                    includeSubs = includeSubs, omitSubs = omitSubs)
+                                    includeSubs = includeSubs, omitSubs = omitSubs, incidence = incidence)
         
         sol = np.linalg.lstsq(comp, meas, rcond = -1)
         numpy = sol[0]
@@ -537,19 +618,173 @@ def M1MonteCarlo(standardData, sampleData, OCorrection, isotopologuesDict, fragm
 
     return results
 
-def PerturbUValue(UValuesSmp):
+def perturbBatch(standardData, sampleData, OCorrection, MNKey, N, explicitOCorrect = {}, amount = 0.002, abundanceCorrect = True, rng = None):
+    '''
+    Draws N perturbed and corrected sample observations of one mass selection at once. The batch counterpart of modifyOValueCorrection, perturbStandard and perturbSample: for each fragment, the standard and sample are perturbed by their experimental errors, the sample is corrected by the standard, and M+N Relative abundance corrections are applied, each as one array operation over all draws. 
+    
+    Inputs:
+        standardData: A dictionary; keys are mass selections ("M1", "M2") then fragment Keys ("full", "44"), then information about substitutions, observed abundances, predicted abundances, and errors. 
+        sampleData: As standardData, but no predicted abundances. 
+        OCorrection: A dictionary giving the M+N Relative abundance correction factors by mass selection and fragment.
+        MNKey: "M1", "M2", etc. 
+        N: The number of draws. 
+        explicitOCorrect: An override dictionary for the M+N Relative abundance corrections; see modifyOValueCorrection. 
+        amount: The size of the perturbation of the M+N Relative abundance corrections in relative terms. 
+        abundanceCorrect: A boolean, determines whether to apply observed abundance correction factors. 
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
+        
+    Outputs:
+        perturbed: A dictionary where keys are fragment keys and values are numpy arrays of shape (N, substitutions), giving the corrected observation of each substitution (in the order of sampleData) in each draw. 
+        OFactors: A dictionary where keys are fragment keys and values are numpy arrays of shape (N,), giving the M+N Relative abundance correction of each draw. 
+    '''
+    random = np.random if rng is None else rng
+    OFactors = {}
+    for fragKey, OFactor in OCorrection[MNKey].items():
+        #if == 1, no correction performed
+        if OFactor == 1:
+            OFactors[fragKey] = np.ones(N)
+        elif MNKey in explicitOCorrect and fragKey in explicitOCorrect[MNKey]:
+            explicit = explicitOCorrect[MNKey][fragKey]
+            OFactors[fragKey] = random.normal(explicit['Mu,Sigma'][0], explicit['Mu,Sigma'][1], size = N)
+            if 'Bounds' in explicit:
+                OFactors[fragKey] = np.clip(OFactors[fragKey], explicit['Bounds'][0], explicit['Bounds'][1])
+        else:
+            OFactors[fragKey] = random.normal(OFactor, OFactor*amount, size = N)
+
+    perturbed = {}
+    for fragKey, fragData in sampleData[MNKey].items():
+        stdData = standardData[MNKey][fragKey]
+        stdPerturbed = random.normal(np.array(stdData['Observed Abundance']), np.array(stdData['Error']), size = (N, len(stdData['Observed Abundance'])))
+        stdPerturbed /= stdPerturbed.sum(axis = 1, keepdims = True)
+        correctionFactor = stdPerturbed / np.array(stdData['Predicted Abundance'])
+
+        smpPerturbed = random.normal(np.array(fragData['Observed Abundance']), np.array(fragData['Error']), size = (N, len(fragData['Observed Abundance'])))
+        smpPerturbed /= smpPerturbed.sum(axis = 1, keepdims = True)
+
+        corrected = smpPerturbed / correctionFactor
+        if abundanceCorrect:
+            corrected /= corrected.sum(axis = 1, keepdims = True)
+            corrected *= OFactors[fragKey][:, np.newaxis]
+
+        perturbed[fragKey] = corrected
+
+    return perturbed, OFactors
+
+def observationIndex(MNSampleData):
+    '''
+    Gives the order of the observations of one mass selection as they appear in the dataframes output by perturbSample, where the substitutions of every fragment are combined into a single index by pandas. constructMatrix takes the observations of each fragment in this order, so constructMatrixBatch follows it too. The M+N systems have more observations than unknowns, and these do not agree exactly, so the Gauss-Jordan solution depends on the order of the rows. 
+    
+    Inputs:
+        MNSampleData: The sample data of one mass selection, i.e. sampleData['M2'], giving the substitutions of each fragment. 
+        
+    Outputs:
+        A pandas Index of substitutions. 
+    '''
+    return pd.DataFrame.from_dict({fragKey: dict.fromkeys(fragData['Subs'], 0) for fragKey, fragData in MNSampleData.items()}).index
+
+def constructMatrixBatch(Isotopologues, perturbed, MNSampleData, fragmentationDictionary, includeSubs = [], omitSubs = []):
+    '''
+    The batch counterpart of constructMatrix. Constructs the composition matrix once and the measurement vectors of every draw at once, with the rows in the same order as constructMatrix (see observationIndex). An observation is left out if it is 0 in every draw, as constructMatrix leaves out observations of 0. 
+    
+    Inputs:
+        Isotopologues: A dataFrame containing isotopologues and information about their fragmentation.
+        perturbed: A dictionary where keys are fragment keys and values are numpy arrays of shape (N, substitutions). See perturbBatch. 
+        MNSampleData: The sample data of this mass selection, i.e. sampleData['M1'], giving the substitutions of each fragment. 
+        fragmentationDictionary: A dictionary giving information about the fragments, their subgeometries and relative contributions. 
+        includeSubs, omitSubs: As constructMatrix. 
+        
+    Outputs:
+        comp: The composition matrix as a numpy array. Columns are isotopologues, rows are observations.
+        meas: A numpy array of shape (N, observations), where row i is the measurement vector of draw i. 
+    '''
+    N = len(next(iter(perturbed.values())))
+
+    subs = observationIndex(MNSampleData)
+
+    beams = []
+    columns = [np.ones(N)]
+    for fragKey, fragInfo in fragmentationDictionary.items():
+        subIndices = {sub: subIndex for subIndex, sub in enumerate(MNSampleData[fragKey]['Subs'])}
+        for sub in subs:
+            #Substitutions not observed in this fragment are 0, so are left out
+            if sub in subIndices and (len(includeSubs) == 0 or sub in includeSubs) and sub not in omitSubs:
+                observations = perturbed[fragKey][:, subIndices[sub]]
+                if (observations != 0).any():
+                    beams.append((fragKey, sub))
+                    columns.append(observations)
+
+    incidence = fas.isotopologueIncidence(Isotopologues, fragmentationDictionary)
+    comp = np.vstack((np.ones((1, len(Isotopologues.index))), incidence.compositionMatrix(beams)))
+    meas = np.column_stack(columns)
+
+    return comp, meas
+
+def M1MonteCarloBatch(standardData, sampleData, OCorrection, isotopologuesDict, fragmentationDictionary, N = 100, 
+                      includeSubs = [], omitSubs = [], perturbTheoryOAmt = 0.002, abundanceCorrect = True, 
+                      debugUnderconstrained = True, plotUnconstrained = False, storePerturbedSamples = False, 
+                      storeOCorrect = False, explicitOCorrect = {}, rng = None):
+    '''
+    The batched version of M1MonteCarlo. For a fixed set of observed substitutions, the composition matrix is the same for every draw; only the measurement vector changes. So all N measurement vectors are drawn at once as an (N x observations) array (see perturbBatch), the pseudo-inverse of the composition matrix is computed once, and every draw is solved with a single matrix product. This gives the minimum-norm least squares solution, as np.linalg.lstsq does for each draw of M1MonteCarlo. 
+
+    Draws are made in a different order than M1MonteCarlo, so the same random seed gives different (but equally distributed) results. 
+    
+    Inputs:
+        As M1MonteCarlo. An observation is left out if it is 0 in every draw, as constructMatrix leaves out observations of 0. 
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
+
+    Outputs:
+        results: A dictionary, as M1MonteCarlo. The "GJ" list is empty. 
+    '''
+    MNKey = "M1"
+    Isotopologues = isotopologuesDict[MNKey]
+
+    results = {'GJ':[],"NUMPY":[], "Extra Info":{'Perturbed Samples':[],'O Correct':[],'StoreExpFactors':[]}}
+
+    perturbed, OFactors = perturbBatch(standardData, sampleData, OCorrection, MNKey, N, explicitOCorrect = explicitOCorrect,
+                                       amount = perturbTheoryOAmt, abundanceCorrect = abundanceCorrect, rng = rng)
+
+    comp, meas = constructMatrixBatch(Isotopologues, perturbed, sampleData[MNKey], fragmentationDictionary, 
+                                      includeSubs = includeSubs, omitSubs = omitSubs)
+
+    #Factor once, then solve every draw at once
+    solutions = meas @ np.linalg.pinv(comp).T
+    results["NUMPY"] = list(solutions)
+
+    if storePerturbedSamples:
+        for draw in range(N):
+            results["Extra Info"]['Perturbed Samples'].append({fragKey: dict(zip(sampleData[MNKey][fragKey]['Subs'], fragObs[draw]))
+                                                               for fragKey, fragObs in perturbed.items()})
+    if storeOCorrect:
+        for draw in range(N):
+            results['Extra Info']['O Correct'].append({fragKey: fragOFactors[draw] for fragKey, fragOFactors in OFactors.items()})
+
+    if np.linalg.matrix_rank(comp) < len(Isotopologues):
+        if debugUnderconstrained:
+            print("Solution is underconstrained")
+            print("After solving null space:")
+            nullSpaceCycles = findNullSpaceCycles(comp, Isotopologues, plot = plotUnconstrained)
+            actuallyConstrained = findFullyConstrained(nullSpaceCycles)
+            print("Actually Constrained:")
+            for i in actuallyConstrained:
+                print(i)
+
+    return results
+
+def PerturbUValue(UValuesSmp, rng = None):
     '''
     Perturbs the full molecule U Values based on their observed errors.
     
     Inputs:
         UValuesSmp: A dictionary where keys are isotopes and their values dictionaries giving their measured U Value and the error on that measurement.
+        rng: A numpy Generator to draw from. If None, draws from the global numpy random state. 
         
     Outputs:
         UPertub: A dictionary where keys are isotopes and values are floats giving their perturbed U Values. 
     '''
+    random = np.random if rng is None else rng
     UPerturb = {}
     for i, v in UValuesSmp.items():
-        UPerturb[i] = np.random.normal(v['Observed'],v['Error'])
+        UPerturb[i] = random.normal(v['Observed'],v['Error'])
     
     return UPerturb
 
@@ -577,9 +812,10 @@ def calcUMN(MNKey, dataFrame, UPerturb, UMNSub = []):
     
     return UMN
 
-def processM1MCResults(M1Results, UValuesSmp, isotopologuesDict,  molecularDataFrame, GJ = False, disableProgress = False, UMNSub = []):
+def processM1MCResults(M1Results, UValuesSmp, isotopologuesDict,  molecularDataFrame, GJ = False, disableProgress = False, UMNSub = [],
+                       seed = None, workers = 1, rngs = None):
     '''
-    Processes results of M1 Monte Carlo, converting the M+N Relative abundances into delta space and reordering to match the order of the original input dataframe. 
+    Processes results of M1 Monte Carlo, converting the M+N Relative abundances into delta space and reordering to match the order of the original input dataframe. All solutions are processed at once, as a (solutions x isotopologues) array. 
     
     Inputs:
         M1Results: A dictionary containing the M1 results from the M1 Monte Carlo routine. 
@@ -589,6 +825,9 @@ def processM1MCResults(M1Results, UValuesSmp, isotopologuesDict,  molecularDataF
         GJ: A boolean; if true, looks in the M1Results dictionary for GJ results, rather than NUMPY results. 
         disableProgress: A boolean; if True, disables progress bar. 
         UMNSub: A list of strings; the strings correspond to isotopes ('13C', '15N') used to calculate the U^M+1 value. Care needs to be taken--if certain isotopologues corresponding to these substitutions are not fully constrained, the routine will fail. This is one reason why it is important to check with a synthetic dataset first, to ensure the procedure works! A later update of this code should check automatically to see if this fails. 
+        seed: An integer or numpy SeedSequence, giving the random numbers used to perturb the U Values. See M1MonteCarlo. Use a different seed than for the Monte Carlo itself. 
+        workers: The number of worker processes to split the results across. See M1MonteCarlo. 
+        rngs: A list giving a numpy Generator for each result. Used by the worker processes; generally should be None. 
 
     Outputs:
         processedResults: A dictionary, containing lists of the results from every Monte Carlo solution for many variables of interest.             
@@ -598,50 +837,68 @@ def processM1MCResults(M1Results, UValuesSmp, isotopologuesDict,  molecularDataF
     string = "NUMPY"
     if GJ:
         string = "GJ"
-    
-    out = isotopologuesDict['M1'][['Number','Stochastic','Composition','Stochastic U','Precise Identity']].copy()
-    
-    for res in tqdm(M1Results[string], disable = disableProgress):
-        out[MNKey + ' M+N Relative Abundance'] = res
-        
-        #Perturb U Values
-        UPerturb = PerturbUValue(UValuesSmp)
-        
-        #Calculate UM1
-        UM1 = calcUMN(MNKey, out, UPerturb, UMNSub = UMNSub)
 
-        out['UM1'] = UM1
-        out['Calc U Values'] = out[MNKey + ' M+N Relative Abundance'] * out['UM1']
-        
-        #The Isotopologues Dataframe has the substitutions in a different order than the site-specific dataframe. 
-        #This section reassigns the solutions of the isotopologues dataframe to the right order for the 
-        #site-specific dataframe
-        M1 = [0] * len(out.index)
-        UM1 = [0] * len(out.index)
-        U = [0] * len(out.index)
-        for i, v in out.iterrows():
-            identity = v['Precise Identity'].split(' ')[1]
-            index = list(molecularDataFrame.index).index(identity)
-
-            M1[index] = v[MNKey + ' M+N Relative Abundance']
-            UM1[index] = v['UM1']
-            U[index] = v['Calc U Values']
-
-        #calculate relevant information
-        normM1 = U / molecularDataFrame['Number']
-        #This gives deltas in absolute reference frame
-        smpDeltasAbs = [op.ratioToDelta(x,y) for x, y in zip(molecularDataFrame['IDS'], normM1)]
-        
-        appxStd = molecularDataFrame['deltas']
-        
-        #This gives deltas relative to standard
-        relSmpStdDeltas = [op.compareRelDelta(atomID, delta1, delta2) for atomID, delta1, delta2 in zip(molecularDataFrame['IDS'], appxStd, smpDeltasAbs)]
-
-        processedResults['VPDB etc. Deltas'].append(smpDeltasAbs)
-        processedResults['Relative Deltas'].append(relSmpStdDeltas)
-        processedResults[MNKey + ' M+N Relative Abundance'].append(M1)
-        processedResults['UM1'].append(UM1)
-        processedResults['Calc U Values'].append(U)
+    if rngs is None and (seed is not None or workers > 1):
+        seeds = pmc.drawSeeds(len(M1Results[string]), seed)
+        kwargs = {'GJ':GJ, 'disableProgress':True, 'UMNSub':UMNSub}
+        chunkArguments = lambda start, stop: (({string:M1Results[string][start:stop]}, UValuesSmp, isotopologuesDict, molecularDataFrame), kwargs)
+
+        return pmc.mergeResults(pmc.runParallel(processM1MCResults, seeds, chunkArguments, workers = workers))
+    
+    Isotopologues = isotopologuesDict['M1']
+    siteCodes = op.atomCodes(molecularDataFrame['IDS'])
+    appxStd = molecularDataFrame['deltas'].values
+    numbers = molecularDataFrame['Number'].values
+
+    #The Isotopologues Dataframe has the substitutions in a different order than the site-specific dataframe. 
+    #Find the site of each isotopologue once, to reassign the solutions to the order of the site-specific dataframe
+    siteIndex = pd.Index(molecularDataFrame.index).get_indexer([identity.split(' ')[1] for identity in Isotopologues['Precise Identity']])
+    if (siteIndex == -1).any():
+        raise Exception("Could not find the site of every M1 isotopologue in the site-specific dataframe")
+
+    #One row per Monte Carlo solution
+    solutions = np.array(M1Results[string], dtype = float).reshape(len(M1Results[string]), len(Isotopologues.index))
+    draws = len(solutions)
+
+    #Perturb U Values, all draws at once; the global random state gives the same values as perturbing one draw at a time
+    UKeys = list(UValuesSmp.keys())
+    observed = np.array([UValuesSmp[key]['Observed'] for key in UKeys], dtype = float)
+    error = np.array([UValuesSmp[key]['Error'] for key in UKeys], dtype = float)
+    if rngs is None:
+        UPerturb = np.random.normal(observed, error, size = (draws, len(UKeys)))
+    else:
+        UPerturb = np.array([rng.normal(observed, error) for rng in tqdm(rngs, disable = disableProgress)]).reshape(draws, len(UKeys))
+
+    #Calculate UM1, as calcUMN: average the estimate from each composition with a U Value
+    compositions = Isotopologues['Composition'].values
+    estimates = []
+    for keyIndex, isotope in enumerate(UKeys):
+        if isotope in compositions and (isotope in UMNSub or UMNSub == []):
+            estimates.append(UPerturb[:,keyIndex] / solutions[:,compositions == isotope].sum(axis = 1))
+    UM1 = np.array(estimates).reshape(len(estimates), draws).mean(axis = 0)
+
+    calcU = solutions * UM1[:,np.newaxis]
+
+    M1 = np.zeros(solutions.shape)
+    U = np.zeros(solutions.shape)
+    UM1Sites = np.zeros(solutions.shape)
+    M1[:,siteIndex] = solutions
+    U[:,siteIndex] = calcU
+    UM1Sites[:,siteIndex] = UM1[:,np.newaxis]
+
+    #calculate relevant information
+    normM1 = U / numbers
+    #This gives deltas in absolute reference frame
+    smpDeltasAbs = op.ratiosToDeltas(siteCodes, normM1)
+    
+    #This gives deltas relative to standard
+    relSmpStdDeltas = op.compareRelDeltas(siteCodes, appxStd, smpDeltasAbs)
+
+    processedResults['VPDB etc. Deltas'] = list(smpDeltasAbs)
+    processedResults['Relative Deltas'] = list(relSmpStdDeltas)
+    processedResults[MNKey + ' M+N Relative Abundance'] = list(M1)
+    processedResults['UM1'] = list(UM1Sites)
+    processedResults['Calc U Values'] = list(U)
         
     return processedResults
 
@@ -660,11 +917,12 @@ def updateSiteSpecificDfM1MC(processedResults, molecularDataFrame):
     return molecularDataFrame
 
 def MonteCarloMN(MNKey, Isotopologues, standardData, sampleData, OCorrection, 
-                 fragmentationDictionary, N = 10, includeSubs = [], omitSubs = [], disableProgress = False, perturbTheoryOAmt = 0,abundanceCorrect = True):
+                 fragmentationDictionary, N = 10, includeSubs = [], omitSubs = [], disableProgress = False, perturbTheoryOAmt = 0,abundanceCorrect = True, batch = False,
+                 seed = None, workers = 1, rngs = None):
     '''
     The M+N experiment with N>2 will almost certainly be underconstrained, in contrast to the M+1 which will often be constrained. Additionally, we don't wish to report these results by updating the original dataframe. For these reasons, we define a separate set of functions for the M+N solution. 
     
-    Given an MNKey and sample/standard data, solves the MN system via GJ Elimination N times and stores the results.
+    Given an MNKey and sample/standard data, solves the MN system via GJ Elimination N times and stores the results. The elimination depends only on the composition matrix, so it is recorded once (see GJOperator) and applied to the measurement vectors of all draws at once; it is only recorded again if the composition matrix changes between draws. 
     
     Also returns the composition matrix and a full GJ solution, which are useful later on. 
     
@@ -682,37 +940,82 @@ def MonteCarloMN(MNKey, Isotopologues, standardData, sampleData, OCorrection,
         disableProgress: A boolean; true disables the tqdm bars.
         perturbTheoryOAmt: A float. For each run of the Monte Carlo, the prtvrnt sbundance correction factors can be perturbed; this may be useful because the factors are only known approximately, so this well better estimate error. 0.001 and 0.002 have been useful values before, but it may depend on the system of interest.
         abundanceCorrect: A boolean, determines whether to apply observed abundance correction factors. 
+        batch: A boolean. If True, all N draws are made at once (see perturbBatch) rather than one at a time. With a seed, all draws are made from one generator, in this process. 
+        seed: An integer or numpy SeedSequence. If given, or if workers > 1, every draw gets its own random number generator spawned from the seed (see parallelMonteCarlo), so the results are reproducible regardless of the number of workers. If None, draws from the global numpy random state, unless workers > 1. 
+        workers: The number of worker processes to split the draws across. Where processes are started by spawning (Windows, macOS), call from within an "if __name__ == '__main__':" block. 
+        rngs: A list giving a numpy Generator for each draw. Used by the worker processes; generally should be None. 
         
     Outputs:
         res: A dictionary keying "GJ" to a list of gauss-jordan solutions to the system
         comp: The initial composition matrix
-        solve: The solved GJ system, which is useful for finding codependencies
+        solve: The solved GJ system, which is useful for finding codependencies, in the form of GJElim's output for the final draw
         meas: The initial measurement vector
     '''
-    res = {}
-    res[MNKey] =  {'GJ':[]}
-    
-        
-    variableOCorrect = copy.deepcopy(OCorrection)
-    for i in tqdm(range(N), disable = disableProgress):
-        variableOCorrect = modifyOValueCorrection(OCorrection, variableOCorrect, MNKey, amount = perturbTheoryOAmt)
-        #Perturb sample and standard
-        std = perturbStandard(standardData)
-        smp = perturbSample(sampleData, std, variableOCorrect, abundanceCorrect = abundanceCorrect)[MNKey]
+    if not batch and rngs is None and (seed is not None or workers > 1):
+        seeds = pmc.drawSeeds(N, seed)
+        args = (MNKey, Isotopologues, standardData, sampleData, OCorrection, fragmentationDictionary)
+        kwargs = {'includeSubs':includeSubs, 'omitSubs':omitSubs, 'disableProgress':True, 'perturbTheoryOAmt':perturbTheoryOAmt,
+                  'abundanceCorrect':abundanceCorrect}
 
-        
-        comp, meas = constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary,
-                                    includeSubs = includeSubs, omitSubs = omitSubs)
+        chunks = pmc.runParallel(MonteCarloMN, seeds, lambda start, stop: (args, dict(kwargs, N = stop - start)), workers = workers)
+        res = pmc.mergeResults([chunk[0] for chunk in chunks])
+        comp, solve, meas = chunks[-1][1:]
 
-        AugMatrix = np.column_stack((comp, meas))
+        return res, comp, solve, meas
 
-        solve = GJElim(AugMatrix, augMatrix = True)
+    res = {}
+    res[MNKey] =  {'GJ':[]}
+
+    if batch:
+        perturbed, OFactors = perturbBatch(standardData, sampleData, OCorrection, MNKey, N, amount = perturbTheoryOAmt, abundanceCorrect = abundanceCorrect,
+                                           rng = None if seed is None else np.random.default_rng(seed))
+        comp, measurements = constructMatrixBatch(Isotopologues, perturbed, sampleData[MNKey], fragmentationDictionary,
+                                                  includeSubs = includeSubs, omitSubs = omitSubs)
+        rref, rank, transform = GJOperator(comp)
+        res[MNKey]['GJ'] = list(measurements @ transform.T)
+        meas = measurements[-1]
 
-        res[MNKey]['GJ'].append(solve[0][:,-1])
+    else:
+        #Compile which observation each isotopologue contributes to once, rather than every iteration
+        incidence = fas.isotopologueIncidence(Isotopologues, fragmentationDictionary)
+
+        operatorComp = None
+        measurements = []
+        variableOCorrect = copy.deepcopy(OCorrection)
+        for i in tqdm(range(N), disable = disableProgress):
+            rng = None
+            if rngs is not None:
+                #Each draw starts from the same corrections, so it does not matter which chunk it is run in
+                rng = rngs[i]
+                variableOCorrect = copy.deepcopy(OCorrection)
+
+            variableOCorrect = modifyOValueCorrection(OCorrection, variableOCorrect, MNKey, amount = perturbTheoryOAmt, rng = rng)
+            #Perturb sample and standard
+            std = perturbStandard(standardData, rng = rng)
+            smp = perturbSample(sampleData, std, variableOCorrect, abundanceCorrect = abundanceCorrect, rng = rng)[MNKey]
+
+            comp, meas = constructMatrix(Isotopologues, smp, MNKey, fragmentationDictionary,
+                                        includeSubs = includeSubs, omitSubs = omitSubs, incidence = incidence)
+
+            #If the observed peaks change, solve the draws so far and record the elimination of the new matrix
+            if operatorComp is None or not np.array_equal(comp, operatorComp):
+                if measurements != []:
+                    res[MNKey]['GJ'] += list(np.array(measurements) @ transform.T)
+                    measurements = []
+                rref, rank, transform = GJOperator(comp)
+                operatorComp = comp
+
+            measurements.append(meas)
+
+        res[MNKey]['GJ'] += list(np.array(measurements) @ transform.T)
+
+    #The final draw, in the form of GJElim's output
+    solve = (np.column_stack((rref, res[MNKey]['GJ'][-1])), rank, [])
         
     return res, comp, solve, meas
 
-def processMNMonteCarloResults(MNKey, results, UValuesSmp, dataFrame, molecularDataFrame, MNDictStd, UMNSub = [], disableProgress = False):
+def processMNMonteCarloResults(MNKey, results, UValuesSmp, dataFrame, molecularDataFrame, MNDictStd, UMNSub = [], disableProgress = False,
+                               seed = None, workers = 1, rngs = None):
     '''
     Given solutions from the GJ solver monte carlo routine and a dataFrame listing which isotopologues correspond to each solution, calculates M+N Relative abundances. Then perturbs and applies a UMN value and calculates deltas and clumped deltas. Stores these values in a dictionary for statistics to be run on them. 
     
@@ -726,18 +1029,28 @@ def processMNMonteCarloResults(MNKey, results, UValuesSmp, dataFrame, molecularD
         MNDictStd: A dictionary, where keys are MN Keys and values are dataframes containing the isotopologues and their concentrations for the calculated standard. 
         UMNSub: A list of substitutions to use to calculate the UMN values. 
         disableProgress: Set True to disable tqdm progress bar
+        seed: An integer or numpy SeedSequence, giving the random numbers used to perturb the U Values. See MonteCarloMN. Use a different seed than for the Monte Carlo itself. 
+        workers: The number of worker processes to split the results across. See MonteCarloMN. With more than one worker, dataFrame is not updated with the values of the final result. 
+        rngs: A list giving a numpy Generator for each result. Used by the worker processes; generally should be None. 
         
     Outputs:
         processedResults: A dictionary containing values for several important measures from each Monte Carlo
         run. 
     '''
+    if rngs is None and (seed is not None or workers > 1):
+        seeds = pmc.drawSeeds(len(results[MNKey]['GJ']), seed)
+        kwargs = {'UMNSub':UMNSub, 'disableProgress':True}
+        chunkArguments = lambda start, stop: ((MNKey, {MNKey:{'GJ':results[MNKey]['GJ'][start:stop]}}, UValuesSmp, dataFrame, molecularDataFrame, MNDictStd), kwargs)
+
+        return pmc.mergeResults(pmc.runParallel(processMNMonteCarloResults, seeds, chunkArguments, workers = workers))
+
     processedResults = {MNKey + ' M+N Relative Abundance':[],'U' + MNKey:[],'U Values':[], 'Deltas':[], 'Clumped Deltas Stochastic': [], 'Clumped Deltas Relative': []}
     rank = len(dataFrame.index)
     
-    for sol in tqdm(results[MNKey]['GJ'], disable = disableProgress):
+    for i, sol in enumerate(tqdm(results[MNKey]['GJ'], disable = disableProgress)):
         dataFrame[MNKey + ' M+N Relative Abundance'] = sol[:rank]
 
-        UPerturb = PerturbUValue(UValuesSmp)
+        UPerturb = PerturbUValue(UValuesSmp, rng = None if rngs is None else rngs[i])
 
         UMN = calcUMN(MNKey, dataFrame, UPerturb, UMNSub = UMNSub)
 
@@ -965,6 +1278,12 @@ def checkSolutionIsotopologues(solve, Isotopologues, massKey, numerical = True):
     #Take everything but the final column, which is just the answer
     solution = solve[0][:,:-1]
     rank = solve[1]
+
+    #Read the columns of the dataFrame once, rather than per entry of the solution
+    preciseIdentities = Isotopologues['Precise Identity'].values
+    stochasticUs = Isotopologues['Stochastic U'].values
+    compositions = Isotopologues['Composition'].values
+    isotopologueIndex = Isotopologues.index
     
     uniqueAnswers = []
     stochasticValues = []
@@ -986,32 +1305,27 @@ def checkSolutionIsotopologues(solve, Isotopologues, massKey, numerical = True):
         rowIsotopologues = []
         n = 0
 
-        for j in range(len(solution[i])):
-            if solution[i][j] > 0:
-                string = ""
-            elif solution[i][j] < 0:
-                string = "MINUS "           
-            
-            if solution[i][j] != 0:
-                sol = solution[i][j]
-                n += 1
+        for j in np.nonzero(solution[i])[0]:
+            sol = solution[i][j]
+            string = "" if sol > 0 else "MINUS "
+            n += 1
 
-                if sol != 1:
-                    rowIsotopologues.append(string + str(sol) + " " + Isotopologues['Precise Identity'][j])
-                else:
-                    rowIsotopologues.append(Isotopologues['Precise Identity'][j])
+            if sol != 1:
+                rowIsotopologues.append(string + str(sol) + " " + preciseIdentities[j])
+            else:
+                rowIsotopologues.append(preciseIdentities[j])
 
-                stoch += sol*Isotopologues['Stochastic U'][j]
+            stoch += sol*stochasticUs[j]
 
-                if c == None:
-                    c = Isotopologues['Composition'][j]
-                elif c != Isotopologues['Composition'][j]:
-                    c = c + " & " + Isotopologues['Composition'][j]
-                    
-                if isotopologueString == None:
-                    isotopologueString = Isotopologues.index[j]
-                elif isotopologueString != Isotopologues.index[j]:
-                    isotopologueString = isotopologueString + " & " + Isotopologues.index[j]
+            if c == None:
+                c = compositions[j]
+            elif c != compositions[j]:
+                c = c + " & " + compositions[j]
+                
+            if isotopologueString == None:
+                isotopologueString = isotopologueIndex[j]
+            elif isotopologueString != isotopologueIndex[j]:
+                isotopologueString = isotopologueString + " & " + isotopologueIndex[j]
 
         uniqueAnswers.append(rowIsotopologues)
         stochasticValues.append(stoch)
@@ -2,16 +2,11 @@ import fragmentAndSimulate as fas
 import pandas as pd
 import matplotlib.pyplot as plt
 import calcIsotopologues as ci
+import isotopeRegistry as ir
 import os
 
-MASS_CHANGE = {'13C': 13.00335484 - 12,
-            '15N': 15.00010889 - 14.003074,
-            'D': 2.014101778 - 1.007825032,
-            '17O': 16.99913175 - 15.99491462,
-            '18O': 17.9991596 - 15.99491462,
-            '33S': 32.9714589 - 31.97207117,
-            '34S':33.96786701 - 31.97207117,
-            '36S':35.96708707 - 31.97207117}
+#The exact mass change of each substitution, e.g. {'13C': 13.00335484 - 12, ...}; kept in the isotope registry
+MASS_CHANGE = ir.LABEL_MASS_CHANGES
 
 def massChangeVsUnsub(subKey):
     '''
@@ -0,0 +1,5 @@
+import os
+import sys
+
+#The modules of lib are imported by name, as in the example notebook
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'lib'))
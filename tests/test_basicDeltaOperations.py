@@ -0,0 +1,27 @@
+import numpy as np
+
+import basicDeltaOperations as op
+
+SITE_IDS = ['C', 'C', 'O', 'N', 'H', 'S']
+
+def scalarConcentrations(deltaMatrix):
+    return np.array([[op.deltaToConcentration(atomID, delta) for atomID, delta in zip(SITE_IDS, row)] for row in deltaMatrix])
+
+def test_deltasToConcentrationsDrawsBySites():
+    #Include 1 and 3 draws, where broadcasting the wrong axes would not raise
+    for draws in (1, 3, 6, 50):
+        deltaMatrix = np.random.default_rng(draws).normal(0, 50, size = (draws, len(SITE_IDS)))
+
+        concentrations = op.deltasToConcentrations(SITE_IDS, deltaMatrix)
+
+        assert concentrations.shape == (4, draws, len(SITE_IDS))
+        np.testing.assert_allclose(np.moveaxis(concentrations, 0, -1), scalarConcentrations(deltaMatrix), rtol = 1e-12, atol = 1e-15)
+
+def test_compareRelDeltasDrawsBySites():
+    deltaMatrix = np.random.default_rng(0).normal(0, 50, size = (5, len(SITE_IDS)))
+    appxStd = np.linspace(-30, 30, len(SITE_IDS))
+
+    relDeltas = op.compareRelDeltas(SITE_IDS, appxStd, deltaMatrix)
+
+    expected = [[op.compareRelDelta(atomID, std, smp) for atomID, std, smp in zip(SITE_IDS, appxStd, row)] for row in deltaMatrix]
+    np.testing.assert_allclose(relDeltas, expected, rtol = 1e-10, atol = 1e-10)
@@ -0,0 +1,150 @@
+import os
+
+import numpy as np
+import pytest
+
+import calcIsotopologues as ci
+import readCSVAndSimulate as sim
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Processed Data', 'Example Input.csv')
+
+@pytest.fixture(scope = 'module')
+def isotopologues():
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+    bigA, SN = ci.calcAllIsotopologues(siteIsotopes, multinomialCoeff)
+
+    return bigA, SN, ci.siteSpecificConcentrations(molecularDataFrame)
+
+def test_logSumGivesLogConcentrations(isotopologues):
+    bigA, SN, concentrationArray = isotopologues
+    isotopeCodes = ci.isotopologueCodeArray(bigA)
+    atomSites = ci.atomSiteIndices(ci.siteWidths(bigA[0]))
+
+    conc = ci.isotopologueConcentrationArray(isotopeCodes, SN, concentrationArray, atomSites)
+    logConc = ci.isotopologueConcentrationArray(isotopeCodes, SN, concentrationArray, atomSites, logSum = True)
+
+    np.testing.assert_allclose(logConc, np.log(conc), rtol = 1e-12)
+
+def test_logSumDoesNotUnderflow():
+    #A 200 atom chain of 13C has concentration ~1e-391, below the smallest double
+    isotopeCodes = np.ones((1, 200), dtype = np.uint8)
+    concentrationArray = np.array([[0.989], [0.011], [0], [0], [0]])
+
+    logConc = ci.isotopologueConcentrationArray(isotopeCodes, [1], concentrationArray, np.zeros(200, dtype = int), logSum = True)
+
+    assert np.isfinite(logConc[0])
+    np.testing.assert_allclose(logConc[0], 200 * np.log(0.011))
+
+@pytest.mark.parametrize('vectorize', [True, False])
+def test_calculateIsotopologueConcentrations(isotopologues, vectorize, capsys):
+    bigA, SN, concentrationArray = isotopologues
+
+    d = ci.calculateIsotopologueConcentrations(bigA, SN, concentrationArray, disable = True, vectorize = vectorize)
+
+    assert len(d) == len(bigA)
+    np.testing.assert_allclose(sum(entry['Conc'] for entry in d.values()), 1)
+    assert capsys.readouterr().err == ''
+
+    ci.calculateIsotopologueConcentrations(bigA, SN, concentrationArray, disable = False, vectorize = vectorize)
+    assert capsys.readouterr().err != ''
+
+@pytest.mark.parametrize('vectorize', [True, False])
+def test_calculateIsotopologueConcentrationsEmpty(isotopologues, vectorize):
+    concentrationArray = isotopologues[2]
+
+    assert ci.calculateIsotopologueConcentrations([], [], concentrationArray, disable = True, vectorize = vectorize) == {}
+
+def test_isotopologueKeyRoundTrip():
+    for ATOM in ['0', '0100', '0004', '7123']:
+        assert ci.keyToATOM(ci.isotopologueKey(ATOM), len(ATOM)) == ATOM
+
+@pytest.mark.parametrize('ATOM', ['', '000+', '+000', '00_0', ' 000', '000 ', '0008', '00a0', '٠000'])
+def test_isotopologueKeyRejectsMalformed(ATOM):
+    with pytest.raises(ValueError):
+        ci.isotopologueKey(ATOM)
+
+@pytest.mark.parametrize('maxMass', [0, 1, 2, 4])
+def test_boundedMassCodesMatchBoundedIsotopologues(maxMass):
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+    bounded, SN = ci.calcBoundedMassIsotopologues(siteIsotopes, multinomialCoeff, maxMass)
+
+    isotopeCodes, symmetryNumbers = ci.calcBoundedMassIsotopologueCodes(siteIsotopes, multinomialCoeff, maxMass)
+
+    assert len(isotopeCodes) == ci.countIsotopologues(siteIsotopes, maxMass = maxMass)
+    np.testing.assert_array_equal(isotopeCodes, ci.isotopologueCodeArray(bounded))
+    np.testing.assert_array_equal(symmetryNumbers, SN)
+
+    chunks = [ci.calcBoundedMassIsotopologueCodes(siteIsotopes, multinomialCoeff, maxMass, start = start, stop = min(start + 5, len(bounded)))
+              for start in range(0, len(bounded), 5)]
+    np.testing.assert_array_equal(np.vstack([codes for codes, numbers in chunks]), isotopeCodes)
+    np.testing.assert_array_equal(np.concatenate([numbers for codes, numbers in chunks]), symmetryNumbers)
+
+@pytest.fixture(scope = 'module')
+def bruteForce(isotopologues):
+    #Every isotopologue, its concentration and its cardinal mass
+    bigA, SN, concentrationArray = isotopologues
+    isotopeCodes = ci.isotopologueCodeArray(bigA)
+    conc = ci.isotopologueConcentrationArray(isotopeCodes, SN, concentrationArray, ci.atomSiteIndices(ci.siteWidths(bigA[0])))
+
+    return bigA, np.array(SN), conc, ci.cardinalMasses(isotopeCodes)
+
+def abundantInputs():
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    siteIsotopes, multinomialCoeff = ci.calculateSetsOfSiteIsotopes(molecularDataFrame)
+
+    return siteIsotopes, multinomialCoeff, ci.siteSpecificConcentrations(molecularDataFrame)
+
+@pytest.mark.parametrize('maxMass', [None, 1, 2])
+@pytest.mark.parametrize('abundanceThreshold', [0, 1e-12, 1e-8, 1e-5, 1e-3])
+def test_calcAbundantIsotopologuesThreshold(bruteForce, abundanceThreshold, maxMass):
+    bigA, SN, conc, masses = bruteForce
+    inBounds = np.ones(len(bigA), dtype = bool) if maxMass is None else masses <= maxMass
+    keep = inBounds & (conc >= abundanceThreshold)
+
+    abundant, symmetryNumbers, concentrations, discarded = ci.calcAbundantIsotopologues(*abundantInputs(), abundanceThreshold = abundanceThreshold, maxMass = maxMass)
+
+    #In the same order as the full enumeration
+    assert abundant == [isotopologue for isotopologue, kept in zip(bigA, keep) if kept]
+    np.testing.assert_array_equal(symmetryNumbers, SN[keep])
+    np.testing.assert_allclose(concentrations, conc[keep], rtol = 1e-10)
+    np.testing.assert_allclose(discarded, conc[inBounds & ~keep].sum(), rtol = 1e-8, atol = 1e-15)
+
+@pytest.mark.parametrize('maxMass', [None, 1, 2])
+@pytest.mark.parametrize('topK', [1, 5, 20, 100])
+@pytest.mark.parametrize('abundanceThreshold', [0, 1e-6])
+def test_calcAbundantIsotopologuesTopK(bruteForce, topK, maxMass, abundanceThreshold):
+    bigA, SN, conc, masses = bruteForce
+    inBounds = np.ones(len(bigA), dtype = bool) if maxMass is None else masses <= maxMass
+    candidates = inBounds & (conc >= abundanceThreshold)
+    expected = np.sort(conc[candidates])[::-1][:topK]
+
+    abundant, symmetryNumbers, concentrations, discarded = ci.calcAbundantIsotopologues(*abundantInputs(), abundanceThreshold = abundanceThreshold, topK = topK, maxMass = maxMass)
+
+    #From most to least abundant; ties at the cut may be broken either way, so compare concentrations
+    np.testing.assert_allclose(concentrations, expected, rtol = 1e-10)
+    byIsotopologue = dict(zip(bigA, zip(SN, conc)))
+    for isotopologue, number, isotopologueConc in zip(abundant, symmetryNumbers, concentrations):
+        assert byIsotopologue[isotopologue][0] == number
+        np.testing.assert_allclose(byIsotopologue[isotopologue][1], isotopologueConc, rtol = 1e-10)
+    assert len(set(abundant)) == len(abundant)
+
+    np.testing.assert_allclose(discarded, conc[inBounds].sum() - expected.sum(), rtol = 1e-8, atol = 1e-15)
+
+@pytest.mark.parametrize('maxMass', [0, 1, 2, 3])
+def test_sparseDictMatchesAtomDict(maxMass):
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    nAtoms = int(molecularDataFrame['Number'].sum())
+
+    byAtom = ci.inputToAtomDict(molecularDataFrame, disable = True, maxMass = maxMass)
+    bySparse = ci.inputToSparseDict(molecularDataFrame, maxMass = maxMass)
+
+    #In the same order as the dense enumeration
+    assert [ci.sparseToATOM(substitutions, nAtoms) for substitutions in bySparse] == list(byAtom)
+    np.testing.assert_array_equal(ci.sparseToCodes(list(bySparse), nAtoms), np.array([list(map(int, ATOM)) for ATOM in byAtom], dtype = np.uint8))
+
+    for substitutions, value in bySparse.items():
+        dense = byAtom[ci.sparseToATOM(substitutions, nAtoms)]
+        assert (value['Number'], value['Mass'], value['Subs']) == (dense['Number'], dense['Mass'], dense['Subs'])
+        np.testing.assert_allclose(value['Conc'], dense['Conc'], rtol = 1e-12)
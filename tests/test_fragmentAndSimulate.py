@@ -0,0 +1,166 @@
+import os
+
+import numpy as np
+import pytest
+
+import calcIsotopologues as ci
+import fragmentAndSimulate as fas
+import isotopologueTable as it
+import readCSVAndSimulate as sim
+import readInput as ri
+import solveSystem as ss
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Processed Data', 'Example Input.csv')
+
+@pytest.fixture(scope = 'module')
+def molecule():
+    return sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])
+
+def atomFrags(molecule):
+    #The ATOM depiction of every fragment subgeometry of the molecule
+    numbers = molecule['molecularDataFrame']['Number'].values
+    return [fas.expandFrag(subFragInfo['subgeometry'], numbers) for fragInfo in molecule['fragmentationDictionary'].values() for subFragInfo in fragInfo.values()]
+
+@pytest.mark.parametrize('maxMass', [0, 1, 2])
+def test_fragmentSparseDictMatchesDense(molecule, maxMass):
+    molecularDataFrame = molecule['molecularDataFrame']
+    siteElements = ci.strSiteElements(molecularDataFrame)
+    nAtoms = len(siteElements)
+
+    byAtom = ci.inputToAtomDict(molecularDataFrame, disable = True, maxMass = maxMass)
+    bySparse = ci.inputToSparseDict(molecularDataFrame, maxMass = maxMass)
+
+    for atomFrag in atomFrags(molecule):
+        dense = fas.fragmentIsotopologueDict(byAtom, atomFrag, relContribution = 0.5)
+        sparse = fas.fragmentSparseDict(bySparse, atomFrag, relContribution = 0.5)
+        baseMass = fas.fragmentBaseMass(atomFrag, siteElements)
+
+        assert len(sparse) == len(dense)
+        for product, conc in sparse.items():
+            #The ATOM depiction of the sparse product, with lost positions as 'x'
+            ATOM = ''.join('x' if z == 'x' else c for z, c in zip(atomFrag, ci.sparseToATOM(product, nAtoms)))
+            np.testing.assert_allclose(conc, dense[ATOM], rtol = 1e-12)
+            assert fas.computeSparseSubs(product, siteElements) == fas.computeSubs(ATOM, siteElements)
+            np.testing.assert_allclose(fas.computeSparseMass(product, siteElements, baseMass), fas.computeMass(ATOM, siteElements), rtol = 1e-12)
+
+def loopFragment(atomIsotopologueDict, atomFrag, relContribution = 1):
+    #Fragments one isotopologue at a time by its ATOM string
+    fragmentedDict = {}
+    for isotopologue, value in atomIsotopologueDict.items():
+        newIsotopologue = fas.fragmentOneIsotopologue(atomFrag, isotopologue)
+        if newIsotopologue not in fragmentedDict:
+            fragmentedDict[newIsotopologue] = 0
+        fragmentedDict[newIsotopologue] += (value['Conc'] * relContribution)
+
+    return fragmentedDict
+
+def populations(molecule):
+    #The whole molecule, its M+1 and M+2 populations, and a population whose keys are already fragmented
+    byAtom = ci.inputToAtomDict(molecule['molecularDataFrame'], disable = True)
+    selections = ci.massSelections(byAtom, massThreshold = 2)
+    fragmented = {key: {'Conc': conc} for key, conc in loopFragment(selections['M2'], atomFrags(molecule)[-1]).items()}
+
+    return [byAtom, selections['M1'], selections['M2'], fragmented]
+
+def test_fragmentIsotopologueDictMatchesLoop(molecule):
+    for population in populations(molecule):
+        for atomFrag in atomFrags(molecule):
+            fragmented = fas.fragmentIsotopologueDict(population, atomFrag, relContribution = 0.3)
+            reference = loopFragment(population, atomFrag, relContribution = 0.3)
+
+            #Same products, in order of their first isotopologue
+            assert list(fragmented) == list(reference)
+            np.testing.assert_allclose(list(fragmented.values()), list(reference.values()), rtol = 1e-12)
+
+def test_fragmentIsotopologueChunksMatchLoop(molecule):
+    byAtom = ci.inputToAtomDict(molecule['molecularDataFrame'], disable = True)
+
+    for atomFrag in atomFrags(molecule):
+        chunks = it.iterIsotopologueChunks(molecule['molecularDataFrame'], chunkSize = 100)
+        fragmented = fas.fragmentIsotopologueDict(chunks, atomFrag)
+        reference = loopFragment(byAtom, atomFrag)
+
+        assert set(fragmented) == set(reference)
+        for product, conc in reference.items():
+            np.testing.assert_allclose(fragmented[product], conc, rtol = 1e-10)
+
+def test_fragmentIsotopologueDictEdgeCases(molecule):
+    atomFrag = atomFrags(molecule)[0]
+
+    assert fas.fragmentIsotopologueDict({}, atomFrag) == {}
+    with pytest.raises(Exception):
+        fas.fragmentIsotopologueDict({'0' * (len(atomFrag) - 1): {'Conc': 1}}, atomFrag)
+    with pytest.raises(Exception):
+        fas.fragmentIsotopologueDict({'0' * len(atomFrag): {'Conc': 1}}, [0] * len(atomFrag))
+
+def subgeometries(molecule):
+    #The key and ATOM depiction of every fragment subgeometry
+    keys = [fragKey + '_' + subKey for fragKey, fragInfo in molecule['fragmentationDictionary'].items() for subKey in fragInfo]
+
+    return keys, atomFrags(molecule)
+
+@pytest.mark.parametrize('massSelection', ['M1', 'M2'])
+def test_compileFragmentIncidenceMatchesPerIsotopologue(molecule, massSelection):
+    siteElements = ci.strSiteElements(molecule['molecularDataFrame'])
+    MN = ci.massSelections(ci.inputToAtomDict(molecule['molecularDataFrame'], disable = True), massThreshold = 2)[massSelection]
+    keys, fragments = subgeometries(molecule)
+    fragmentationDictionary = {fragKey: {subKey: dict(subFragInfo, relCont = 0.25 * (i + 1)) for subKey, subFragInfo in fragInfo.items()}
+                               for i, (fragKey, fragInfo) in enumerate(molecule['fragmentationDictionary'].items())}
+
+    incidence, conc = fas.compileFragmentIncidence(MN, fragments, keys, fragmentationDictionary, siteElements)
+
+    #Build the same matrix one isotopologue at a time from the fragmented ATOM strings
+    expected = np.zeros(incidence.matrix.shape)
+    for key, atomFrag in zip(keys, fragments):
+        fragKey, subKey = key.split('_')
+        for column, isotopologue in enumerate(MN):
+            sub = fas.computeSubs(fas.fragmentOneIsotopologue(atomFrag, isotopologue), siteElements)
+            expected[incidence.beamIndex[(key, sub)], column] += fragmentationDictionary[fragKey][subKey]['relCont']
+
+    assert incidence.isotopologues == list(MN)
+    np.testing.assert_array_equal(conc, [value['Conc'] for value in MN.values()])
+    np.testing.assert_array_equal(incidence.matrix.toarray(), expected)
+    assert all((expected[row] != 0).any() for row in range(len(incidence.beams)))
+
+    combined = incidence.combined()
+    for (fragKey, sub), row in combined.beamIndex.items():
+        rows = [incidence.beamIndex[beam] for beam in incidence.beams if beam[0].split('_')[0] == fragKey and beam[1] == sub]
+        np.testing.assert_allclose(combined.matrix[row].toarray().ravel(), expected[rows].sum(axis = 0))
+
+@pytest.fixture(scope = 'module')
+def exampleMN(molecule):
+    stdMeasurement, MNDict, FF = sim.simulateMeasurement(molecule, massThreshold = 2, UValueList = ['13C'])
+    processStandard = ri.readComputedData(stdMeasurement, error = 0.001, theory = stdMeasurement)
+    isotopologuesDict = fas.isotopologueDataFrame(MNDict, molecule['molecularDataFrame'])
+    rng = np.random.default_rng(3)
+    samples = ss.perturbSample(processStandard, ss.perturbStandard(processStandard, rng = rng), ss.OValueCorrectTheoretical(stdMeasurement, processStandard, massThreshold = 2), rng = rng)
+
+    return isotopologuesDict, samples
+
+def multipleSubgeometries(Isotopologues, fragmentationDictionary):
+    #Split one fragment into two subgeometries, the second observing the substitutions of the full molecule
+    fragKey = [fragKey for fragKey in fragmentationDictionary if fragKey != 'full'][0]
+    Isotopologues = Isotopologues.copy()
+    Isotopologues[fragKey + '_02 Subs'] = Isotopologues['full_01 Subs']
+    fragmentationDictionary = dict(fragmentationDictionary)
+    fragmentationDictionary[fragKey] = {'01': dict(fragmentationDictionary[fragKey]['01'], relCont = 0.7),
+                                        '02': dict(fragmentationDictionary['full']['01'], relCont = 0.3)}
+
+    return Isotopologues, fragmentationDictionary
+
+@pytest.mark.parametrize('massSelection', ['M1', 'M2'])
+@pytest.mark.parametrize('split', [False, True])
+@pytest.mark.parametrize('includeSubs, omitSubs', [([], []), ([], ['13C']), (['13C', 'D', 'Unsub'], [])])
+def test_isotopologueIncidenceMatchesIsin(molecule, exampleMN, massSelection, split, includeSubs, omitSubs):
+    isotopologuesDict, samples = exampleMN
+    Isotopologues, fragmentationDictionary = isotopologuesDict[massSelection], molecule['fragmentationDictionary']
+    if split:
+        Isotopologues, fragmentationDictionary = multipleSubgeometries(Isotopologues, fragmentationDictionary)
+    smp = samples[massSelection]
+
+    incidence = fas.isotopologueIncidence(Isotopologues, fragmentationDictionary)
+    comp, meas = ss.constructMatrix(Isotopologues, smp, massSelection, fragmentationDictionary, includeSubs = includeSubs, omitSubs = omitSubs, incidence = incidence)
+    isinComp, isinMeas = ss.constructMatrix(Isotopologues, smp, massSelection, fragmentationDictionary, includeSubs = includeSubs, omitSubs = omitSubs)
+
+    np.testing.assert_array_equal(comp, isinComp)
+    np.testing.assert_array_equal(meas, isinMeas)
@@ -0,0 +1,50 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import basicDeltaOperations as op
+import calcIsotopologues as ci
+import fragmentAndSimulate as fas
+import isotopeRegistry as ir
+
+NEW_ELEMENTS = {'Cl': {0: ('', 34.96885268, 1), 2: ('37Cl', 36.96590259, 0.319627)},
+                'Br': {0: ('', 78.9183371, 1), 2: ('81Br', 80.9162906, 0.972775)},
+                'Si': {0: ('', 27.9769265, 1), 1: ('29Si', 28.9764947, 0.0507663), 2: ('30Si', 29.9737702, 0.0334744)}}
+
+@pytest.fixture
+def registered():
+    for element, isotopes in NEW_ELEMENTS.items():
+        ir.registerElement(element, isotopes)
+    yield
+    for element in NEW_ELEMENTS:
+        del ir.ELEMENTS[element]
+    ir.compileRegistry()
+
+def test_registeredElementsReachDeltaTables(registered):
+    for element in NEW_ELEMENTS:
+        concentrations = op.deltaToConcentration(element, 10)
+        assert abs(sum(concentrations) - 1) < 1e-12
+        assert abs(op.ratioToDelta(element, op.concentrationToM1Ratio(concentrations) if element == 'Si' else concentrations[2] / concentrations[0]) - 10) < 1e-9
+
+    assert op.deltaToConcentration('C', -30) == pytest.approx((1 - 0.011180 * 0.97 / (1 + 0.011180 * 0.97), 0.011180 * 0.97 / (1 + 0.011180 * 0.97), 0, 0))
+
+def test_registeredElementsInIsotopologues(registered):
+    molecularDataFrame = pd.DataFrame({'IDS': ['C', 'Cl', 'Br', 'Si'], 'Number': [1, 2, 1, 1], 'deltas': [-30, 5, 0, -10]},
+                                      index = ['C1', 'Cl2', 'Br3', 'Si4'])
+
+    assert ci.strSiteElements(molecularDataFrame) == ('C', 'Cl', 'Cl', 'Br', 'Si')
+
+    byAtom = ci.inputToAtomDict(molecularDataFrame, disable = True)
+    assert abs(sum(v['Conc'] for v in byAtom.values()) - 1) < 1e-12
+
+    subs = {v['Subs'] for v in byAtom.values()}
+    assert {'37Cl', '81Br', '29Si', '30Si', '37Cl-37Cl'} <= subs
+
+    siteElements = ci.strSiteElements(molecularDataFrame)
+    assert fas.computeSubs('02020', siteElements) == '37Cl-81Br'
+
+def test_registeringClearsSiteIsotopeCache(registered):
+    before = ci.multiatomicSiteIsotopes('Cl', 2)[0]
+    ir.registerElement('Cl', {0: ('', 34.96885268, 1), 1: ('36Cl', 35.96830698, 1e-12), 2: ('37Cl', 36.96590259, 0.319627)})
+
+    assert ci.multiatomicSiteIsotopes('Cl', 2)[0] != before
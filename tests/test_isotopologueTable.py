@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+import isotopologueTable as it
+import readCSVAndSimulate as sim
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Processed Data', 'Example Input.csv')
+
+@pytest.fixture(scope = 'module')
+def topology():
+    molecule = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])
+
+    return it.compileIsotopologueTopology(molecule['molecularDataFrame'], disable = True)
+
+@pytest.mark.parametrize('scenarios', [1, 3, 5])
+def test_evaluateBatchMatchesEvaluate(topology, scenarios):
+    deltaMatrix = np.random.default_rng(scenarios).normal(0, 30, size = (scenarios, 6))
+
+    batch = topology.evaluateBatch(deltaMatrix)
+
+    assert batch.shape == (scenarios, len(topology.isotopeCodes))
+    for k in range(scenarios):
+        np.testing.assert_allclose(batch[k], topology.evaluate(deltaMatrix[k]).conc, rtol = 1e-10, atol = 1e-15)
+
+@pytest.mark.parametrize('ATOM', ['000+', '+000', '00_0', ' 000'])
+def test_atomDictionaryViewRejectsMalformedKeys(topology, ATOM):
+    view = topology.evaluate([-30, -30, 0, 0, 0, 0]).atomDictionary()
+    ATOM = ATOM.rjust(view.table.isotopeCodes.shape[1], '0')
+
+    assert ATOM not in view
+    with pytest.raises(KeyError):
+        view[ATOM]
+
+@pytest.mark.parametrize('maxMass', [1, 3])
+def test_iterIsotopologueChunksBounded(monkeypatch, maxMass):
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    full = it.compileIsotopologueTopology(molecularDataFrame, disable = True, maxMass = maxMass)
+
+    #The full product space should never be enumerated
+    monkeypatch.setattr(it.ci, 'calcAllIsotopologueCodes', None)
+    chunks = list(it.iterIsotopologueChunks(molecularDataFrame, chunkSize = 7, maxMass = maxMass))
+
+    assert all(len(chunk) == 7 for chunk in chunks[:-1])
+    np.testing.assert_array_equal(np.vstack([chunk.isotopeCodes for chunk in chunks]), full.isotopeCodes)
+    np.testing.assert_array_equal(np.concatenate([chunk.number for chunk in chunks]), full.number)
+
+@pytest.mark.parametrize('maxMass', [None, 2])
+@pytest.mark.parametrize('processes', [2, 3])
+def test_parallelIsotopologueTableMatchesSerial(maxMass, processes):
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    serial = it.inputToIsotopologueTable(molecularDataFrame, disable = True, maxMass = maxMass)
+
+    parallel = it.parallelIsotopologueTable(molecularDataFrame, processes, maxMass = maxMass)
+
+    np.testing.assert_array_equal(parallel.isotopeCodes, serial.isotopeCodes)
+    np.testing.assert_array_equal(parallel.number, serial.number)
+    np.testing.assert_allclose(parallel.conc, serial.conc, rtol = 1e-12)
+    assert [parallel.subLabels[subId] for subId in parallel.subIds] == [serial.subLabels[subId] for subId in serial.subIds]
+
+def test_parallelIsotopologueTableShardsBalanced(monkeypatch):
+    molecularDataFrame = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = [-30, -30, 0, 0, 0, 0])['molecularDataFrame']
+    shardSizes = []
+
+    class SerialExecutor:
+        #Runs the shards in this process, recording their sizes
+        def __init__(self, max_workers):
+            pass
+        def __enter__(self):
+            return self
+        def __exit__(self, *args):
+            return False
+        def map(self, function, shards):
+            results = [function(shard) for shard in shards]
+            shardSizes.extend(len(result[0]) for result in results)
+            return results
+
+    monkeypatch.setattr(it.concurrent.futures, 'ProcessPoolExecutor', SerialExecutor)
+    it.parallelIsotopologueTable(molecularDataFrame, 32, maxMass = 2)
+
+    #27 isotopologues up to M+2, fewer than 4 shards for each of 32 processes
+    assert len(shardSizes) == 27 and set(shardSizes) == {1}
+
+    shardSizes.clear()
+    it.parallelIsotopologueTable(molecularDataFrame, 32)
+
+    assert len(shardSizes) == 128
+    assert max(shardSizes) - min(shardSizes) <= 1
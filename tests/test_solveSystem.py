@@ -0,0 +1,240 @@
+import copy
+import os
+
+import numpy as np
+import pytest
+
+import basicDeltaOperations as op
+import fragmentAndSimulate as fas
+import readCSVAndSimulate as sim
+import readInput as ri
+import solveSystem as ss
+
+EXAMPLE_INPUT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Processed Data', 'Example Input.csv')
+STD_DELTAS = [-30, -30, 0, 0, 0, 0]
+SMP_DELTAS = [-25, -25, 10, 10, 100, -100]
+
+@pytest.fixture(scope = 'module')
+def exampleM1():
+    std = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = STD_DELTAS)
+    stdMeasurement, MNDict, FF = sim.simulateMeasurement(std, massThreshold = 1, UValueList = ['13C'])
+    smpMeasurement, smpMNDict, smpFF = sim.simulateMeasurement(sim.moleculeWithDeltas(std, SMP_DELTAS), massThreshold = 1, UValueList = ['13C'])
+
+    processStandard = ri.readComputedData(stdMeasurement, error = 0.001, theory = stdMeasurement)
+    processSample = ri.readComputedData(smpMeasurement, error = 0.001)
+    UValuesSmp = ri.readComputedUValues(smpMeasurement, error = 0.0001, UMNSub = '13C')
+    OCorrection = ss.OValueCorrectTheoretical(stdMeasurement, processSample, massThreshold = 1)
+    isotopologuesDict = fas.isotopologueDataFrame(MNDict, std['molecularDataFrame'])
+
+    return {'std':processStandard, 'smp':processSample, 'U':UValuesSmp, 'O':OCorrection, 'iso':isotopologuesDict,
+            'molecule':std}
+
+def scalarProcessM1(M1Results, UValuesSmp, isotopologuesDict, molecularDataFrame, UMNSub):
+    #The per-draw computation, one site at a time
+    out = isotopologuesDict['M1'].copy()
+    sites = list(molecularDataFrame.index)
+    deltas, relDeltas = [], []
+    for res in M1Results['NUMPY']:
+        out['M1 M+N Relative Abundance'] = res
+        UM1 = ss.calcUMN('M1', out, ss.PerturbUValue(UValuesSmp), UMNSub = UMNSub)
+
+        U = [0] * len(sites)
+        for identity, relAbundance in zip(out['Precise Identity'], res):
+            U[sites.index(identity.split(' ')[1])] = relAbundance * UM1
+
+        drawDeltas = [op.ratioToDelta(atomID, u / n) for atomID, u, n in zip(molecularDataFrame['IDS'], U, molecularDataFrame['Number'])]
+        deltas.append(drawDeltas)
+        relDeltas.append([op.compareRelDelta(atomID, std, smp) for atomID, std, smp in zip(molecularDataFrame['IDS'], molecularDataFrame['deltas'], drawDeltas)])
+
+    return np.array(deltas), np.array(relDeltas)
+
+def test_processM1MCResultsMatchesScalar(exampleM1):
+    d = exampleM1
+    M1Results = ss.M1MonteCarlo(d['std'], d['smp'], d['O'], d['iso'], d['molecule']['fragmentationDictionary'], N = 20, disableProgress = True)
+    mDf = d['molecule']['molecularDataFrame']
+
+    np.random.seed(3)
+    processed = ss.processM1MCResults(M1Results, d['U'], d['iso'], mDf, UMNSub = ['13C'])
+    np.random.seed(3)
+    deltas, relDeltas = scalarProcessM1(M1Results, d['U'], d['iso'], mDf, ['13C'])
+
+    np.testing.assert_allclose(processed['VPDB etc. Deltas'], deltas, rtol = 1e-10, atol = 1e-9)
+    np.testing.assert_allclose(processed['Relative Deltas'], relDeltas, rtol = 1e-10, atol = 1e-9)
+
+def test_simulateSmpStdReproducible(tmp_path):
+    kwargs = dict(UValueList = ['13C'], MonteCarloN = 12, MNError = 0.001, UValueError = 0.0001, plot = False,
+                  resultsFileName = str(tmp_path / 'output.csv'))
+
+    first = sim.simulateSmpStd(EXAMPLE_INPUT, STD_DELTAS, SMP_DELTAS, STD_DELTAS, **kwargs)
+    np.random.seed(0)
+    second = sim.simulateSmpStd(EXAMPLE_INPUT, STD_DELTAS, SMP_DELTAS, STD_DELTAS, **kwargs)
+    split = sim.simulateSmpStd(EXAMPLE_INPUT, STD_DELTAS, SMP_DELTAS, STD_DELTAS, workers = 2, **kwargs)
+
+    for other in (second, split):
+        np.testing.assert_array_equal(first['Relative Deltas'].values, other['Relative Deltas'].values)
+        np.testing.assert_array_equal(first['Relative Deltas Error'].values, other['Relative Deltas Error'].values)
+
+@pytest.fixture(scope = 'module')
+def exampleM2():
+    std = sim.moleculeFromCsv(EXAMPLE_INPUT, deltas = STD_DELTAS)
+    stdMeasurement, MNDict, FF = sim.simulateMeasurement(std, massThreshold = 2, UValueList = ['13C'])
+    smpMeasurement, smpMNDict, smpFF = sim.simulateMeasurement(sim.moleculeWithDeltas(std, SMP_DELTAS), massThreshold = 2, UValueList = ['13C'])
+
+    processStandard = ri.readComputedData(stdMeasurement, error = 0.001, theory = stdMeasurement)
+    processSample = ri.readComputedData(smpMeasurement, error = 0.001)
+    OCorrection = ss.OValueCorrectTheoretical(stdMeasurement, processSample, massThreshold = 2)
+    isotopologuesDict = fas.isotopologueDataFrame(MNDict, std['molecularDataFrame'])
+
+    return {'std':processStandard, 'smp':processSample, 'O':OCorrection, 'iso':isotopologuesDict, 'molecule':std}
+
+def test_constructMatrixBatchMatchesLoop(exampleM2):
+    d = exampleM2
+    fragmentationDictionary = d['molecule']['fragmentationDictionary']
+    rng = np.random.default_rng(7)
+
+    #The same perturbed draws, as the loop sees them and as perturbBatch gives them
+    draws = [ss.perturbSample(d['smp'], ss.perturbStandard(d['std'], rng = rng), d['O'], rng = rng)['M2'] for i in range(5)]
+    perturbed = {fragKey: np.array([draw.loc[fragData['Subs'], fragKey].values for draw in draws])
+                 for fragKey, fragData in d['smp']['M2'].items()}
+
+    comp, measurements = ss.constructMatrixBatch(d['iso']['M2'], perturbed, d['smp']['M2'], fragmentationDictionary)
+    rref, rank, transform = ss.GJOperator(comp)
+    solutions = measurements @ transform.T
+
+    for draw, measurement, solution in zip(draws, measurements, solutions):
+        loopComp, loopMeas = ss.constructMatrix(d['iso']['M2'], draw, 'M2', fragmentationDictionary)
+        np.testing.assert_array_equal(comp, loopComp)
+        np.testing.assert_array_equal(measurement, loopMeas)
+
+        loopSolve = ss.GJElim(np.column_stack((loopComp, loopMeas)), augMatrix = True)
+        np.testing.assert_allclose(solution, loopSolve[0][:, -1], rtol = 1e-9, atol = 1e-12)
+
+def firstNonzeroGJElim(Matrix, augMatrix = False, AugAmount = 1, eps = 10**-8):
+    #Gauss-Jordan elimination pivoting on the first nonzero entry of each column, one row at a time
+    M = Matrix.copy()
+    rows, cols = M.shape
+    colLimit = cols - AugAmount if augMatrix else cols
+
+    r, c, rank = 0, 0, 0
+    while r < rows and c < colLimit:
+        if True in (np.abs(M[r:,c]) > eps):
+            pivotRow = (M[r:,c] != 0).argmax(axis = 0) + r
+            rank += 1
+            M[[r, pivotRow]] = M[[pivotRow, r]]
+            M[r] = M[r] / M[r,c]
+            for i in range(rows):
+                if i != r:
+                    M[i] -= M[i,c] / M[r,c] * M[r]
+            r += 1
+        c += 1
+
+    return ss.sanitizeMatrix(M), rank
+
+def consistentSystems():
+    rng = np.random.default_rng(11)
+    systems = {}
+
+    A = rng.normal(size = (5, 5))
+    systems['full rank'] = np.column_stack((A, A @ rng.normal(size = 5)))
+
+    A = rng.integers(0, 2, size = (8, 4)).astype(float)
+    A[:, 0] = 1
+    systems['overdetermined'] = np.column_stack((A, A @ rng.normal(size = 4)))
+
+    A = rng.normal(size = (6, 4))
+    A = np.column_stack((A, A[:, 0] + 2 * A[:, 1], A[:, 3]))
+    systems['rank deficient'] = np.column_stack((A, A @ rng.normal(size = 6)))
+
+    A = rng.normal(size = (3, 6))
+    systems['underconstrained'] = np.column_stack((A, A @ rng.normal(size = 6)))
+
+    A = rng.normal(size = (5, 4))
+    A[:, 1] = rng.normal(scale = 10**-10, size = 5)
+    systems['column below eps'] = np.column_stack((A, A @ rng.normal(size = 4)))
+
+    return systems
+
+@pytest.mark.parametrize('name', ['full rank', 'overdetermined', 'rank deficient', 'underconstrained', 'column below eps'])
+def test_GJElimMatchesFirstNonzeroPivoting(name):
+    AugMatrix = consistentSystems()[name]
+
+    M, rank, storage = ss.GJElim(AugMatrix, augMatrix = True)
+    reference, referenceRank = firstNonzeroGJElim(AugMatrix, augMatrix = True)
+
+    assert rank == referenceRank == np.linalg.matrix_rank(AugMatrix[:, :-1], tol = 10**-8)
+    np.testing.assert_allclose(M, reference, rtol = 1e-9, atol = 1e-9)
+
+def test_GJElimSkipsColumnBelowEps():
+    M, rank, storage = ss.GJElim(consistentSystems()['column below eps'], augMatrix = True)
+
+    #The tiny column is never pivoted on, so the remaining three columns are
+    assert rank == 3
+    np.testing.assert_array_equal(M[:3, [0, 2, 3]], np.eye(3))
+
+def test_GJElimCompositionMatrixMatchesFirstNonzeroPivoting(exampleM2):
+    d = exampleM2
+    smp = ss.perturbSample(d['smp'], ss.perturbStandard(d['std'], rng = np.random.default_rng(5)), d['O'], rng = np.random.default_rng(6))['M2']
+    comp, meas = ss.constructMatrix(d['iso']['M2'], smp, 'M2', d['molecule']['fragmentationDictionary'])
+
+    #Underconstrained and inconsistent; the eliminated composition matrix does not depend on the pivots, though the measurement column does
+    M, rank, storage = ss.GJElim(np.column_stack((comp, meas)), augMatrix = True)
+    reference, referenceRank = firstNonzeroGJElim(np.column_stack((comp, meas)), augMatrix = True)
+
+    assert rank == referenceRank < comp.shape[1]
+    np.testing.assert_allclose(M[:, :-1], reference[:, :-1], atol = 1e-9)
+
+class ShiftedGenerator:
+    #Draws loc + shift * scale every time, so the batch and loop paths see the same "random" numbers whatever order they draw in
+    def __init__(self, shift):
+        self.shift = shift
+
+    def normal(self, loc = 0, scale = 1, size = None):
+        draw = np.asarray(loc, dtype = float) + self.shift * np.asarray(scale, dtype = float)
+        return draw if size is None else np.broadcast_to(draw, size).copy()
+
+def loopPerturbation(d, rng, amount, explicitOCorrect = {}):
+    #One draw of the per-draw chain of M1MonteCarlo
+    variableOCorrect = ss.modifyOValueCorrection(d['O'], copy.deepcopy(d['O']), 'M1', explicitOCorrect = explicitOCorrect, amount = amount, rng = rng)
+    std = ss.perturbStandard(copy.deepcopy(d['std']), rng = rng)
+    smp = ss.perturbSample(d['smp'], std, variableOCorrect, explicitOCorrect = explicitOCorrect, rng = rng)['M1']
+
+    return {fragKey: smp.loc[fragData['Subs'], fragKey].values for fragKey, fragData in d['smp']['M1'].items()}
+
+@pytest.mark.parametrize('shift', [-1.5, 0.7])
+def test_perturbBatchMatchesLoopFixedGenerator(exampleM1, shift):
+    #The simulated corrections are all 1, which are not perturbed; use others, with bounds that both shifts run into
+    d = dict(exampleM1, O = {'M1': {'full': 0.98, '44': 1.03}})
+    explicitOCorrect = {'M1': {'full': {'Mu,Sigma': (0.98, 0.01), 'Bounds': (0.97, 0.985)}}}
+
+    for explicit in ({}, explicitOCorrect):
+        loop = loopPerturbation(d, ShiftedGenerator(shift), 0.002, explicitOCorrect = explicit)
+        perturbed, OFactors = ss.perturbBatch(d['std'], d['smp'], d['O'], 'M1', 3, explicitOCorrect = explicit, amount = 0.002, rng = ShiftedGenerator(shift))
+
+        for fragKey, observations in loop.items():
+            for draw in range(3):
+                np.testing.assert_allclose(perturbed[fragKey][draw], observations, rtol = 1e-12)
+
+def test_M1MonteCarloBatchMatchesLoopFixedGenerator(exampleM1):
+    d = exampleM1
+    args = (d['std'], d['smp'], {'M1': {'full': 0.98, '44': 1.03}}, d['iso'], d['molecule']['fragmentationDictionary'])
+
+    loop = ss.M1MonteCarlo(*copy.deepcopy(args), N = 2, disableProgress = True, rngs = [ShiftedGenerator(0.5)] * 2)
+    batch = ss.M1MonteCarloBatch(*copy.deepcopy(args), N = 2, rng = ShiftedGenerator(0.5))
+
+    np.testing.assert_allclose(np.array(batch['NUMPY']), np.array(loop['NUMPY']), rtol = 1e-9, atol = 1e-12)
+
+def test_perturbBatchMatchesLoopStatistics(exampleM1):
+    d = dict(exampleM1, O = {'M1': {'full': 0.98, '44': 1.03}})
+    N = 1000
+
+    perturbed, OFactors = ss.perturbBatch(d['std'], d['smp'], d['O'], 'M1', N, amount = 0.002, rng = np.random.default_rng(1))
+    rng = np.random.default_rng(2)
+    loopDraws = [loopPerturbation(d, rng, 0.002) for i in range(N)]
+
+    for fragKey, batchObservations in perturbed.items():
+        loopObservations = np.array([draw[fragKey] for draw in loopDraws])
+        loopStd = loopObservations.std(axis = 0)
+
+        #Means within 5 standard errors, spreads within 15%
+        np.testing.assert_array_less(np.abs(batchObservations.mean(axis = 0) - loopObservations.mean(axis = 0)), 5 * loopStd * np.sqrt(2 / N) + 1e-15)
+        np.testing.assert_allclose(batchObservations.std(axis = 0), loopStd, rtol = 0.15)